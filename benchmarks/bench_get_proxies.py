@@ -0,0 +1,88 @@
+"""Measure /get_proxies throughput against a synthetic proxy pool.
+
+Starts ``proxy_api.handler:app`` under uvicorn in a temporary directory
+seeded with a generated ``proxies.txt``, then hammers it from a pool of
+client threads. Each iteration leases one proxy and unlocks it again, so
+the pool never drains.
+
+    python benchmarks/bench_get_proxies.py --proxies 10000 --requests 5000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = "bench-key"
+
+
+def write_proxies(path: str, count: int):
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(f"http://10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:8080\n")
+
+
+def start_server(workdir: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ, API_KEY=API_KEY, PYTHONPATH=ROOT)
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "proxy_api.handler:app",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(600):
+        try:
+            requests.get(f"{url}/health", headers={"X-API-Key": API_KEY}, timeout=1)
+            return server
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--proxies", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}"
+    headers = {"X-API-Key": API_KEY}
+    sessions = threading.local()
+
+    def lease_and_unlock(_):
+        session = getattr(sessions, "session", None)
+        if session is None:
+            session = sessions.session = requests.Session()
+        response = session.get(f"{url}/get_proxies", params={"count": 1}, headers=headers)
+        response.raise_for_status()
+        ids = [p["id"] for p in response.json()["proxies"]]
+        session.post(f"{url}/unlock_proxies", json=ids, headers=headers).raise_for_status()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_proxies(os.path.join(tmp, "proxies.txt"), args.proxies)
+        server = start_server(tmp, args.port)
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(args.concurrency) as executor:
+                list(executor.map(lease_and_unlock, range(args.requests)))
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"pool={args.proxies} requests={args.requests} concurrency={args.concurrency}")
+    print(f"elapsed={elapsed:.2f}s throughput={args.requests / elapsed:.1f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Compare tuple rows with ``Proxy`` records when encoding lease responses.
+
+Seeds a temporary database with a synthetic pool, loads it into an
+in-memory ``ProxyPool`` and, for each pool size, times and measures the
+allocations of:
+
+- ``hydrate``: reading every proxy from SQLite as tuples vs ``Proxy`` records
+- ``lease``: encoding ``/get_proxies`` bodies, the old way (URL f-string,
+  dict and ``jsonable_encoder`` per proxy per request) vs joining the
+  records' cached JSON fragments
+- ``list``: encoding the whole pool the way ``/available_proxies`` did
+  (a dict per row) vs its streaming encoder, with all fields and with
+  ``fields=id,proxy``
+
+    python benchmarks/bench_records.py --sizes 10000 100000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fastapi.encoders import jsonable_encoder
+
+from proxy_api import database
+from proxy_api.handler import OutputFormat, _encode_rows, _projection
+from proxy_api.pool import ProxyPool
+from proxy_api.records import PROXY_FIELDS
+from proxy_api.utils import construct_proxy_url
+
+
+def seed(count: int):
+    database.init_db()
+    database.bulk_insert_proxies(
+        ("http", f"user{i}", "secret", f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", 8080, None, None, None)
+        for i in range(count)
+    )
+
+
+def measure(func, repeat: int) -> dict:
+    """Mean wall time of ``func`` and the peak memory of one call"""
+    func()
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    elapsed = time.perf_counter() - started
+    return {"mean_ms": round(elapsed / repeat * 1000, 4), "peak_kib": round(peak / 1024, 1)}
+
+
+def old_lease_body(rows) -> str:
+    result = [{"id": row[0], "proxy": construct_proxy_url(row)} for row in rows]
+    body = {"proxies": result, "lease_token": "token", "expires_at": None}
+    return json.dumps(jsonable_encoder(body))
+
+
+def new_lease_body(proxies) -> str:
+    return (
+        '{"proxies":[' + ",".join(proxy.fragment for proxy in proxies)
+        + '],"lease_token":' + json.dumps("token") + ',"expires_at":null}'
+    )
+
+
+def old_listing(rows) -> str:
+    return json.dumps(jsonable_encoder([dict(zip(PROXY_FIELDS, row)) for row in rows]))
+
+
+def new_listing(proxies, fields) -> str:
+    return "".join(_encode_rows(proxies, _projection(fields), OutputFormat.json))
+
+
+def run(size: int, lease_count: int, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        database.db_path = os.path.join(tmp, "proxies.db")
+        seed(size)
+        pool = ProxyPool()
+        pool.load()
+        records = list(pool.iter_rows())
+        tuples = [proxy.as_tuple() for proxy in records]
+        batch_records, batch_tuples = records[:lease_count], tuples[:lease_count]
+        sql = f"SELECT {database.PROXY_COLUMNS} FROM proxies"
+
+        report = {
+            "hydrate": {
+                "tuple": measure(lambda: database.get_connection().execute(sql).fetchall(), 3),
+                "record": measure(lambda: database.proxy_cursor().execute(sql).fetchall(), 3),
+            },
+            "lease": {
+                "tuple": measure(lambda: old_lease_body(batch_tuples), repeat),
+                "record": measure(lambda: new_lease_body(batch_records), repeat),
+            },
+            "list": {
+                "tuple": measure(lambda: old_listing(tuples), 3),
+                "record": measure(lambda: new_listing(records, None), 3),
+                "record_id_proxy": measure(lambda: new_listing(records, "id,proxy"), 3),
+            },
+        }
+        database.close_connections()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--lease-count", type=int, default=10, help="proxies per /get_proxies body")
+    parser.add_argument("--repeat", type=int, default=2000, help="lease bodies encoded per measurement")
+    args = parser.parse_args()
+
+    results = {size: run(size, args.lease_count, args.repeat) for size in args.sizes}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""Measure /get_proxies latency while a refresh of proxies.txt is running.
+
+Starts ``proxy_api.handler:app`` under uvicorn in a temporary directory
+seeded with a generated ``proxies.txt``, measures lease/unlock latency
+while the server is idle, then rewrites every line of the file (new ports)
+and triggers ``/refresh_proxies``, measuring the same loop until the
+refresh has finished. Refreshes run as background jobs, so the two
+latencies should stay close however long the refresh takes.
+
+    python benchmarks/bench_refresh.py --proxies 100000 --concurrency 16
+
+Health checks are throttled to a trickle so they don't skew either phase.
+Servers answering ``/refresh_proxies`` only once the refresh is done
+(before refreshes became jobs) are measured the same way.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from suite import API_KEY, CHECK_URL, HEADERS, free_port, latency_summary, start_uvicorn, write_proxies
+
+
+async def wait_for_refresh(session: aiohttp.ClientSession, base_url: str, timeout: float):
+    """Wait for the startup refresh job, if the server runs refreshes as jobs"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        async with session.get(f"{base_url}/jobs", params={"kind": "refresh"}) as response:
+            if response.status == 404:
+                return
+            jobs = await response.json()
+        if jobs and jobs[0]["status"] in ("succeeded", "failed"):
+            return
+        await asyncio.sleep(0.1)
+    raise TimeoutError("startup refresh did not finish")
+
+
+async def lease_loop(session: aiohttp.ClientSession, base_url: str, concurrency: int, done: asyncio.Event) -> dict:
+    """Lease one proxy and unlock it from ``concurrency`` clients until ``done``"""
+    latency: List[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while not done.is_set():
+            started = time.perf_counter()
+            async with session.get(f"{base_url}/get_proxies", params={"count": 1}) as response:
+                body = await response.json(content_type=None)
+            latency.append(time.perf_counter() - started)
+            if response.status != 200:
+                errors += 1
+                continue
+            ids = [proxy["id"] for proxy in body["proxies"]]
+            async with session.post(f"{base_url}/unlock_proxies", json=ids) as response:
+                await response.read()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {**latency_summary(latency, time.perf_counter() - started), "errors": errors}
+
+
+async def refresh(session: aiohttp.ClientSession, base_url: str, done: asyncio.Event) -> dict:
+    """Trigger a forced refresh and wait for it to finish"""
+    started = time.perf_counter()
+    try:
+        async with session.post(f"{base_url}/refresh_proxies", params={"force": "true"}) as response:
+            body = await response.json()
+        if response.status == 202:
+            while body["status"] not in ("succeeded", "failed"):
+                await asyncio.sleep(0.05)
+                async with session.get(f"{base_url}/jobs/{body['id']}") as response:
+                    body = await response.json()
+            summary = body["result"] or {"error": body["error"]}
+        else:
+            summary = body
+        return {"elapsed_s": round(time.perf_counter() - started, 3), "summary": summary}
+    finally:
+        done.set()
+
+
+async def run(args, base_url: str, proxy_port: int, dead_port: int) -> dict:
+    async with aiohttp.ClientSession(
+        headers=HEADERS, connector=aiohttp.TCPConnector(limit=args.concurrency + 1),
+        timeout=aiohttp.ClientTimeout(total=None)
+    ) as session:
+        await wait_for_refresh(session, base_url, args.timeout)
+
+        idle_done = asyncio.Event()
+        asyncio.get_running_loop().call_later(args.idle_seconds, idle_done.set)
+        idle = await lease_loop(session, base_url, args.concurrency, idle_done)
+
+        # Every line changes, so the refresh replaces the whole pool
+        write_proxies("proxies.txt", args.proxies, dead_port, proxy_port)
+        refresh_done = asyncio.Event()
+        during, refreshed = await asyncio.gather(
+            lease_loop(session, base_url, args.concurrency, refresh_done),
+            refresh(session, base_url, refresh_done)
+        )
+    return {"idle": idle, "during_refresh": during, "refresh": refreshed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--proxies", type=int, default=100000)
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--idle-seconds", type=float, default=5)
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the startup refresh")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="proxy-api-bench-")
+    os.chdir(workdir)
+    # Nothing listens on either port; checks fail but are throttled to a trickle
+    proxy_port, dead_port = free_port(), free_port()
+    write_proxies("proxies.txt", args.proxies, proxy_port, dead_port)
+    os.environ.update(
+        API_KEY=API_KEY,
+        CHECK_URL=CHECK_URL,
+        CHECK_RATE="0.001",
+        PROXY_FILE_WATCH_INTERVAL="0",
+    )
+
+    port = free_port()
+    server = start_uvicorn(workdir, port)
+    try:
+        result = asyncio.run(run(args, f"http://127.0.0.1:{port}", proxy_port, dead_port))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(
+        f"proxies={args.proxies} refresh={result['refresh']['elapsed_s']}s "
+        f"idle p50={result['idle']['p50_ms']}ms p99={result['idle']['p99_ms']}ms "
+        f"during refresh p50={result['during_refresh']['p50_ms']}ms "
+        f"p99={result['during_refresh']['p99_ms']}ms max={result['during_refresh']['max_ms']}ms",
+        file=sys.stderr
+    )
+    json.dump({"proxies": args.proxies, "concurrency": args.concurrency, **result}, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+"""Benchmark the proxy API hot paths across pool sizes.
+
+For every pool size a fresh working directory is seeded with a synthetic
+``proxies.txt`` whose proxies all point at a local stand-in proxy server
+(every tenth one at a closed port, so checks also fail). Each size runs in
+its own process and measures:
+
+- ``import``: ``sync_proxy_file`` of the whole file into an empty database
+- ``check``: the first round of health checks (every proxy is due on
+  startup) against the stand-in server, unthrottled unless ``--check-rate``
+- ``get_proxies``: concurrent clients leasing one proxy and unlocking it,
+  counting proxies handed to two clients at once
+- ``available_proxies``: listing the pool without locking it
+
+The app runs in-process (requests are ASGI calls, no sockets) or under
+uvicorn (``--mode uvicorn``), which adds real HTTP overhead.
+
+    python benchmarks/suite.py --sizes 1000 10000 --concurrency 64 --output run.json
+
+The stand-in proxy listens on all interfaces, because the synthetic proxies
+need distinct addresses across ``127.0.0.0/8``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import List, Optional
+from urllib.parse import urlencode
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_KEY = "bench-key"
+HEADERS = {"X-API-Key": API_KEY}
+CHECK_URL = "http://check.invalid/ip"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_proxies(path: str, count: int, port: int, dead_port: int):
+    """Write ``count`` proxies spread over 127.0.0.0/8; every tenth is dead"""
+    with open(path, "w") as f:
+        for i in range(count):
+            n = i + 1
+            address = f"127.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}"
+            f.write(f"http://bench:secret@{address}:{dead_port if i % 10 == 9 else port}\n")
+
+
+def percentile(samples: List[float], q: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def latency_summary(samples: List[float], elapsed: float) -> dict:
+    """Latencies in milliseconds and throughput in operations per second"""
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 0.50) * 1000, 3) if samples else None,
+        "p99_ms": round(percentile(samples, 0.99) * 1000, 3) if samples else None,
+        "max_ms": round(max(samples) * 1000, 3) if samples else None,
+        "throughput": round(len(samples) / elapsed, 1) if elapsed else None,
+    }
+
+
+class StandInProxy:
+    """Minimal HTTP proxy stand-in answering every request itself, on its own thread"""
+
+    def __init__(self, port: int, delay: float):
+        self.port = port
+        self.delay = delay
+        self.requests = 0
+        self._ready = threading.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return web.json_response({"origin": request.remote})
+
+    async def _serve(self):
+        server = web.Server(self._handle, access_log=None)
+        runner = web.ServerRunner(server)
+        await runner.setup()
+        await web.TCPSite(runner, "0.0.0.0", self.port, backlog=1024).start()
+        self._ready.set()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    def start(self):
+        def run():
+            self._loop = asyncio.new_event_loop()
+            self._task = self._loop.create_task(self._serve())
+            try:
+                self._loop.run_until_complete(self._task)
+            except asyncio.CancelledError:
+                pass
+        threading.Thread(target=run, daemon=True).start()
+        self._ready.wait(10)
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+
+class InProcessClient:
+    """Calls the ASGI app directly, bypassing sockets and HTTP parsing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, params: Optional[dict] = None, body=None):
+        payload = b"" if body is None else json.dumps(body).encode()
+        headers = [(b"x-api-key", API_KEY.encode()), (b"host", b"bench")]
+        if body is not None:
+            headers.append((b"content-type", b"application/json"))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+            "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+            "root_path": "", "query_string": urlencode(params or {}).encode(),
+            "headers": headers, "client": ("127.0.0.1", 1), "server": ("bench", 80),
+        }
+        chunks = []
+        status = 500
+        received = False
+
+        async def receive():
+            nonlocal received
+            if received:
+                await asyncio.Event().wait()
+            received = True
+            return {"type": "http.request", "body": payload, "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, json.loads(b"".join(chunks) or b"null")
+
+    async def close(self):
+        pass
+
+
+class HttpClient:
+    """Calls a running server over HTTP with a shared keep-alive session"""
+
+    def __init__(self, base_url: str, concurrency: int):
+        self.base_url = base_url
+        self.session = aiohttp.ClientSession(
+            headers=HEADERS, connector=aiohttp.TCPConnector(limit=concurrency)
+        )
+
+    async def request(self, method: str, path: str, params: Optional[dict] = None, body=None):
+        async with self.session.request(
+            method, self.base_url + path, params=params, json=body
+        ) as response:
+            return response.status, await response.json(content_type=None)
+
+    async def close(self):
+        await self.session.close()
+
+
+async def wait_for_check(client, timeout: float) -> dict:
+    """Poll /check_status until the startup sweep has finished"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        _, status = await client.request("GET", "/check_status")
+        if status["finished_at"] is not None:
+            return status
+        await asyncio.sleep(0.05)
+    raise TimeoutError("health check did not finish")
+
+
+async def bench_get_proxies(client, total: int, concurrency: int) -> dict:
+    """Lease one proxy and unlock it, ``total`` times from ``concurrency`` clients"""
+    held = set()
+    duplicates = 0
+    misses = 0
+    lease_latency: List[float] = []
+    unlock_latency: List[float] = []
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, duplicates, misses
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            status, body = await client.request("GET", "/get_proxies", {"count": 1})
+            lease_latency.append(time.perf_counter() - started)
+            if status != 200:
+                misses += 1
+                continue
+            ids = [proxy["id"] for proxy in body["proxies"]]
+            duplicates += sum(proxy_id in held for proxy_id in ids)
+            held.update(ids)
+            # Give up ownership before unlocking; the server may re-lease at once
+            held.difference_update(ids)
+            started = time.perf_counter()
+            await client.request("POST", "/unlock_proxies", body=ids)
+            unlock_latency.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "lease": latency_summary(lease_latency, elapsed),
+        "unlock": latency_summary(unlock_latency, elapsed),
+        "cycles_per_second": round(len(unlock_latency) / elapsed, 1),
+        "duplicate_leases": duplicates,
+        "misses": misses,
+    }
+
+
+async def bench_available_proxies(client, iterations: int) -> dict:
+    latency: List[float] = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        await client.request("GET", "/available_proxies", {"auto_lock": "false"})
+        latency.append(time.perf_counter() - t)
+    return latency_summary(latency, time.perf_counter() - started)
+
+
+async def drive(client, args) -> dict:
+    result = {}
+    check = await wait_for_check(client, args.check_timeout)
+    result["check"] = {
+        key: check[key]
+        for key in ("total", "checked", "available", "inactive", "elapsed", "proxies_per_second")
+    }
+    result["get_proxies"] = await bench_get_proxies(client, args.requests, args.concurrency)
+    result["available_proxies"] = await bench_available_proxies(client, args.list_iterations)
+    return result
+
+
+def start_uvicorn(workdir: str, port: int) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "proxy_api.handler:app",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=dict(os.environ, PYTHONPATH=ROOT),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(600):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("uvicorn did not start")
+
+
+async def run_size_async(args, workdir: str) -> dict:
+    if args.mode == "uvicorn":
+        port = free_port()
+        server = start_uvicorn(workdir, port)
+        client = HttpClient(f"http://127.0.0.1:{port}", args.concurrency)
+        try:
+            return await drive(client, args)
+        finally:
+            await client.close()
+            server.terminate()
+            server.wait()
+
+    from proxy_api.handler import app
+    async with app.router.lifespan_context(app):
+        return await drive(InProcessClient(app), args)
+
+
+def run_size(args) -> dict:
+    """Benchmark one pool size; runs in a fresh process"""
+    workdir = tempfile.mkdtemp(prefix="proxy-api-bench-")
+    os.chdir(workdir)
+    proxy = StandInProxy(free_port(), args.check_delay / 1000)
+    proxy.start()
+    write_proxies("proxies.txt", args.size, proxy.port, free_port())
+
+    os.environ.update(
+        API_KEY=API_KEY,
+        CHECK_URL=CHECK_URL,
+        CHECK_INTERVAL="86400",
+        CHECK_CONCURRENCY=str(args.check_concurrency),
+        CHECK_RATE=str(args.check_rate),
+        PROXY_FILE_WATCH_INTERVAL="0",
+    )
+    sys.path.insert(0, ROOT)
+    import logging
+    logging.disable(logging.INFO)
+    from proxy_api.database import init_db
+    from proxy_api.utils import sync_proxy_file
+
+    init_db()
+    started = time.perf_counter()
+    summary = sync_proxy_file()
+    elapsed = time.perf_counter() - started
+    result = {
+        "size": args.size,
+        "import": {
+            "inserted": summary["inserted"],
+            "elapsed_s": round(elapsed, 3),
+            "lines_per_second": round(args.size / elapsed, 1),
+        },
+    }
+    try:
+        result.update(asyncio.run(run_size_async(args, workdir)))
+    finally:
+        proxy.stop()
+    result["stand_in_requests"] = proxy.requests
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--requests", type=int, default=5000, help="lease/unlock cycles per size")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    parser.add_argument("--list-iterations", type=int, default=5)
+    parser.add_argument("--check-concurrency", type=int, default=200)
+    parser.add_argument("--check-delay", type=float, default=0, help="stand-in proxy latency in ms")
+    parser.add_argument("--check-rate", type=float, default=0, help="checks per second, 0 for no limit")
+    parser.add_argument("--check-timeout", type=float, default=600)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.size is not None:
+        json.dump(run_size(args), sys.stdout)
+        return
+
+    runs = []
+    for size in args.sizes:
+        command = [sys.executable, os.path.abspath(__file__), "--size", str(size)]
+        for option in ("mode", "requests", "concurrency", "list_iterations",
+                       "check_concurrency", "check_delay", "check_rate", "check_timeout"):
+            command += ["--" + option.replace("_", "-"), str(getattr(args, option))]
+        output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+        run = json.loads(output)
+        runs.append(run)
+        get = run["get_proxies"]
+        print(
+            f"size={size:>7} import={run['import']['elapsed_s']}s "
+            f"check={run['check']['proxies_per_second']}/s "
+            f"lease p50={get['lease']['p50_ms']}ms p99={get['lease']['p99_ms']}ms "
+            f"cycles={get['cycles_per_second']}/s duplicates={get['duplicate_leases']} "
+            f"list p50={run['available_proxies']['p50_ms']}ms",
+            file=sys.stderr
+        )
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mode": args.mode,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "runs": runs,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1 @@
-from .api import ProxyAPI
\ No newline at end of file
+from .api import ProxyAPI, AsyncProxyAPI, proxy_report
\ No newline at end of file
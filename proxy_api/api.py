@@ -1,46 +1,265 @@
+import asyncio
+import aiohttp
+import json
+import logging
 import requests
 import os
-from typing import List, Optional, Union, overload
-import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from requests.adapters import HTTPAdapter
+from typing import AsyncIterator, Deque, Iterator, List, Optional, Union, overload
 
-db_path = "proxies.db"
+logger = logging.getLogger(__name__)
+
+# Seconds before its lease expires that a buffered proxy stops being handed
+# out, covering request time and clock skew with the server
+LEASE_EXPIRY_MARGIN = 5.0
+
+def _lease_entries(body: dict) -> List[dict]:
+    """Proxies of a /get_proxies response, each tagged with its lease"""
+    proxies = body["proxies"]
+    for proxy in proxies:
+        proxy["lease_token"] = body.get("lease_token")
+        proxy["expires_at"] = body.get("expires_at")
+    return proxies
+
+def _lease_live(proxy: dict, now: float) -> bool:
+    """Whether a buffered proxy's lease is still safely ours"""
+    expires_at = proxy.get("expires_at")
+    return expires_at is None or expires_at - LEASE_EXPIRY_MARGIN > now
+
+def _pop_live(buffer: Deque[dict]) -> Optional[dict]:
+    """Take the next buffered proxy whose lease has not run out.
+
+    Expired ones are dropped without unlocking: the service may already
+    have leased them to another client.
+    """
+    now = time.time()
+    while buffer:
+        proxy = buffer.popleft()
+        if _lease_live(proxy, now):
+            return proxy
+        logger.debug(f"Dropping buffered proxy {proxy['id']}: its lease has expired")
+    return None
+
+def _available_params(
+    auto_lock: bool,
+    after_id: Optional[int],
+    limit: Optional[int],
+    fields: Optional[List[str]],
+    format: str = "json",
+    lease_seconds: Optional[float] = None
+) -> dict:
+    """Query parameters of /available_proxies"""
+    params = {"auto_lock": "true" if auto_lock else "false", "format": format}
+    if lease_seconds is not None:
+        params["lease_seconds"] = lease_seconds
+    if after_id is not None:
+        params["after_id"] = after_id
+    if limit is not None:
+        params["limit"] = limit
+    if fields:
+        params["fields"] = ",".join(fields)
+    return params
+
+def proxy_report(
+    proxy_id: int,
+    ok: Optional[bool] = None,
+    latency_ms: Optional[float] = None,
+    status: Optional[int] = None,
+    error: Optional[str] = None,
+    banned: bool = False
+) -> dict:
+    """Outcome report to pass to ``unlock_proxies`` in place of a proxy ID.
+
+    ``status`` is the HTTP status received through the proxy, ``error`` a
+    short error class such as ``"ConnectTimeout"``; ``banned`` quarantines
+    the proxy at once.
+    """
+    return {"id": proxy_id, "ok": ok, "latency_ms": latency_ms, "status": status, "error": error, "banned": banned}
 
 class ProxyAPI:
-    def __init__(self, api_key: str = None, base_url: str = "http://localhost:8000"):
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = "http://localhost:8000",
+        prefetch: int = 0,
+        pool_maxsize: int = 32,
+        timeout: Optional[float] = 30
+    ):
+        """Client for the proxy service.
+
+        All calls share one keep-alive ``requests.Session`` whose connection
+        pool holds up to ``pool_maxsize`` connections, so it can be used from
+        that many threads without reconnecting. With ``prefetch > 0``,
+        ``acquire``/``lease`` take proxies from a local buffer that is
+        refilled ``prefetch`` at a time; ``close`` unlocks whatever is left.
+        """
         self.base_url = base_url
         self.api_key = api_key or os.getenv("API_KEY", "your-default-api-key")
         self.headers = {
             "X-API-Key": self.api_key,
             "Content-Type": "application/json"
         }
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.prefetch = prefetch
+        self._buffer: Deque[dict] = deque()
+        self._buffer_lock = threading.Lock()
+
+    def __enter__(self) -> "ProxyAPI":
+        return self
 
-    def add_proxy(self, protocol: str, ip: str, port: int, username: Optional[str] = None, password: Optional[str] = None) -> dict:
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Unlock buffered proxies in one request and close the session"""
+        now = time.time()
+        with self._buffer_lock:
+            proxy_ids = [proxy["id"] for proxy in self._buffer if _lease_live(proxy, now)]
+            self._buffer.clear()
+        if proxy_ids:
+            self.unlock_proxies(proxy_ids)
+        self.session.close()
+
+    def acquire(self) -> dict:
+        """Lease one proxy, from the local buffer when prefetching is enabled.
+
+        Returns an ``{"id": ..., "proxy": ...}`` dict, with the
+        ``lease_token`` and ``expires_at`` of the lease holding it; hand it
+        back with ``release``. Buffered proxies are only handed out while
+        their lease has more than ``LEASE_EXPIRY_MARGIN`` seconds left.
+        Raises ``requests.HTTPError`` (404) when the service has no
+        available proxies.
+        """
+        if self.prefetch <= 0:
+            return self._lease_batch(1)[0]
+        with self._buffer_lock:
+            proxy = _pop_live(self._buffer)
+            if proxy is None:
+                self._buffer.extend(self._lease_batch(self.prefetch))
+                proxy = self._buffer.popleft()
+            return proxy
+
+    def release(self, proxy: dict, **outcome):
+        """Return a proxy from ``acquire``; buffered clients keep it for reuse.
+
+        Keyword arguments of ``proxy_report`` (``ok``, ``latency_ms``,
+        ``status``, ``error``, ``banned``) report how it fared, which always
+        hands it back to the service.
+        """
+        if outcome:
+            self.unlock_proxies([proxy_report(proxy["id"], **outcome)])
+            return
+        if self.prefetch <= 0:
+            self.unlock_proxies([proxy["id"]])
+            return
+        if not _lease_live(proxy, time.time()):
+            return
+        with self._buffer_lock:
+            self._buffer.append(proxy)
+
+    @contextmanager
+    def lease(self):
+        """``with api.lease() as proxy:`` acquires a proxy and always releases it"""
+        proxy = self.acquire()
+        try:
+            yield proxy
+        finally:
+            self.release(proxy)
+
+    def _lease_batch(self, count: int) -> List[dict]:
+        response = self.session.get(
+            f"{self.base_url}/get_proxies", params={"count": count}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return _lease_entries(response.json())
+
+    def add_proxy(
+        self,
+        protocol: str,
+        ip: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        country: Optional[str] = None,
+        provider: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ) -> dict:
+        """Add a proxy, optionally with the attributes get_proxies filters on"""
         url = f"{self.base_url}/add_proxy"
-        data = {
-            "protocol": protocol,
-            "ip": ip,
-            "port": port,
-            "username": username,
-            "password": password
-        }
-        response = requests.post(url, headers=self.headers, json=data)
+        params = {"protocol": protocol, "ip": ip, "port": port}
+        for name, value in (
+            ("username", username), ("password", password), ("country", country), ("provider", provider)
+        ):
+            if value is not None:
+                params[name] = value
+        if tags:
+            params["tags"] = list(tags)
+        response = self.session.post(url, params=params, timeout=self.timeout)
         return response.json()
 
     def test_proxy(self, proxy_id: int) -> dict:
         url = f"{self.base_url}/test_proxy/{proxy_id}"
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(url, timeout=self.timeout)
         return response.json()
 
-    def get_proxies(self, count: int = 1) -> dict:
+    def get_proxies(
+        self,
+        count: int = 1,
+        lease_seconds: Optional[float] = None,
+        strategy: Optional[str] = None,
+        session_id: Optional[str] = None,
+        protocol: Optional[str] = None,
+        country: Optional[str] = None,
+        provider: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ) -> dict:
+        """Lease proxies; calls with the same ``session_id`` get the same proxies.
+
+        ``protocol``, ``country``, ``provider`` and ``tags`` only lease
+        proxies with those attributes (all of the tags).
+        """
         url = f"{self.base_url}/get_proxies"
         params = {"count": count}
-        response = requests.get(url, headers=self.headers, params=params)
+        if lease_seconds is not None:
+            params["lease_seconds"] = lease_seconds
+        if strategy is not None:
+            params["strategy"] = strategy
+        if session_id is not None:
+            params["session_id"] = session_id
+        for name, value in (("protocol", protocol), ("country", country), ("provider", provider)):
+            if value is not None:
+                params[name] = value
+        if tags:
+            params["tag"] = list(tags)
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        return response.json()
+
+    def renew_lease(self, lease_token: str, lease_seconds: Optional[float] = None) -> dict:
+        """Extend a lease returned by get_proxies before it expires"""
+        url = f"{self.base_url}/renew_lease"
+        params = {"lease_token": lease_token}
+        if lease_seconds is not None:
+            params["lease_seconds"] = lease_seconds
+        response = self.session.post(url, params=params, timeout=self.timeout)
         return response.json()
 
     @overload
     def unlock_proxies(self, proxy_ids: List[int]) -> dict:
         ...
 
+    @overload
+    def unlock_proxies(self, reports: List[dict]) -> dict:
+        ...
+
     @overload
     def unlock_proxies(self, ip: str) -> dict:
         ...
@@ -49,25 +268,28 @@ class ProxyAPI:
     def unlock_proxies(self, full_address: str) -> dict:
         ...
 
-    def unlock_proxies(self, proxies: Union[List[int], str]) -> dict:
+    def unlock_proxies(self, proxies: Union[List[Union[int, dict]], str]) -> dict:
+        """Unlock proxies by ID list, IP or full address; list entries can
+        be ``proxy_report`` dicts telling the service how each proxy fared
+        """
         url = f"{self.base_url}/unlock_proxies"
         
         if isinstance(proxies, list):
-            print(f"Unlocking proxies with IDs: {proxies}")  # Debugging line
-            response = requests.post(url, headers=self.headers, json=proxies)  # Send the list directly
+            logger.debug(f"Unlocking proxies: {proxies}")
+            response = self.session.post(url, json=proxies, timeout=self.timeout)
         elif isinstance(proxies, str):
-            # Assuming you have a way to convert IP or full address to IDs
-            proxy_ids = self.get_proxy_ids(proxies)  # Implement this method
-            print(f"Unlocking proxies with IDs derived from {proxies}: {proxy_ids}")  # Debugging line
-            response = requests.post(url, headers=self.headers, json=proxy_ids)
+            proxy_ids = self.get_proxy_ids(proxies)
+            logger.debug(f"Unlocking proxies with IDs derived from {proxies}: {proxy_ids}")
+            response = self.session.post(url, json=proxy_ids, timeout=self.timeout)
         else:
             raise ValueError("Invalid input type for unlocking proxies.")
         
         return response.json()
 
-    def get_proxy_ids(self, identifier: str) -> List[int]:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+    @staticmethod
+    def get_proxy_ids(identifier: str) -> List[int]:
+        from .database import get_connection
+        cursor = get_connection().cursor()
         
         # Check if the identifier is an IP address
         cursor.execute("SELECT id FROM proxies WHERE ip = ?", (identifier,))
@@ -78,27 +300,305 @@ class ProxyAPI:
             cursor.execute("SELECT id FROM proxies WHERE CONCAT(protocol, '://', username, ':', password, '@', ip, ':', port) = ?", (identifier,))
             ids = cursor.fetchall()
         
-        conn.close()
-        
         return [id[0] for id in ids]  # Return a list of IDs
 
     def health(self) -> dict:
         url = f"{self.base_url}/health"
-        response = requests.get(url)
+        response = self.session.get(url, timeout=self.timeout)
         return response.json()
 
-    def get_all_available_proxies(self, auto_lock: bool = True) -> list:
-        """Get all available proxies with option to auto-lock them"""
+    def get_all_available_proxies(
+        self,
+        auto_lock: bool = True,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        fields: Optional[List[str]] = None,
+        lease_seconds: Optional[float] = None
+    ) -> list:
+        """Get available proxies with option to auto-lock them.
+
+        Locked proxies are leased for ``lease_seconds`` (the server's
+        ``LEASE_TTL`` by default). Without locking, ``after_id``/``limit``
+        select one page in ID order; ``fields`` limits each proxy to those
+        keys (``"proxy"`` is its URL).
+        """
         url = f"{self.base_url}/available_proxies"
-        params = {"auto_lock": auto_lock}
-        response = requests.get(url, headers=self.headers, params=params)
+        params = _available_params(auto_lock, after_id, limit, fields, lease_seconds=lease_seconds)
+        response = self.session.get(url, params=params, timeout=self.timeout)
         if response.status_code == 404:
             return []
         response.raise_for_status()
         return response.json()
 
-    def refresh_proxies(self) -> dict:
-        """Clear unused proxies and repopulate from proxies.txt"""
+    def iter_available_proxies(self, fields: Optional[List[str]] = None, auto_lock: bool = False) -> Iterator[dict]:
+        """Stream available proxies one at a time without loading the whole list"""
+        url = f"{self.base_url}/available_proxies"
+        params = _available_params(auto_lock, None, None, fields, "ndjson")
+        with self.session.get(url, params=params, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def refresh_proxies(self, force: bool = False, wait: bool = True) -> dict:
+        """Apply changes in proxies.txt; ``force`` re-reads an unchanged file.
+
+        Without ``wait`` the refresh job is returned as soon as it starts;
+        poll it with ``get_job``.
+        """
         url = f"{self.base_url}/refresh_proxies"
-        response = requests.post(url, headers=self.headers)
+        response = self.session.post(url, params={"force": force, "wait": wait}, timeout=self.timeout)
+        return response.json()
+
+    def get_job(self, job_id: str) -> dict:
+        """Status and outcome of a background job such as a refresh"""
+        url = f"{self.base_url}/jobs/{job_id}"
+        response = self.session.get(url, timeout=self.timeout)
         return response.json()
+
+
+class AsyncProxyAPI:
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = "http://localhost:8000",
+        prefetch: int = 0,
+        pool_maxsize: int = 100,
+        timeout: Optional[float] = 30,
+        unlock_batch_size: int = 500
+    ):
+        """asyncio counterpart of ``ProxyAPI``.
+
+        Every coroutine shares one ``aiohttp.ClientSession`` with up to
+        ``pool_maxsize`` keep-alive connections, created on first use inside
+        the running loop. Large unlocks are split into batches of
+        ``unlock_batch_size`` sent concurrently.
+        """
+        self.base_url = base_url
+        self.api_key = api_key or os.getenv("API_KEY", "your-default-api-key")
+        self.headers = {
+            "X-API-Key": self.api_key,
+            "Content-Type": "application/json"
+        }
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.unlock_batch_size = unlock_batch_size
+        self.prefetch = prefetch
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._buffer: Deque[dict] = deque()
+        self._buffer_lock: Optional[asyncio.Lock] = None
+
+    async def __aenter__(self) -> "AsyncProxyAPI":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=aiohttp.TCPConnector(limit=self.pool_maxsize),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def close(self):
+        """Unlock buffered proxies and close the session"""
+        now = time.time()
+        proxy_ids = [proxy["id"] for proxy in self._buffer if _lease_live(proxy, now)]
+        self._buffer.clear()
+        if proxy_ids:
+            await self.unlock_proxies(proxy_ids)
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def acquire(self) -> dict:
+        """Lease one proxy, from the local buffer when prefetching is enabled;
+        buffered proxies are handed out as in ``ProxyAPI.acquire``
+        """
+        if self.prefetch <= 0:
+            return (await self._lease_batch(1))[0]
+        if self._buffer_lock is None:
+            self._buffer_lock = asyncio.Lock()
+        async with self._buffer_lock:
+            proxy = _pop_live(self._buffer)
+            if proxy is None:
+                self._buffer.extend(await self._lease_batch(self.prefetch))
+                proxy = self._buffer.popleft()
+            return proxy
+
+    async def release(self, proxy: dict, **outcome):
+        """Return a proxy from ``acquire``; buffered clients keep it for reuse.
+
+        Outcome keyword arguments are reported as in ``ProxyAPI.release``.
+        """
+        if outcome:
+            await self.unlock_proxies([proxy_report(proxy["id"], **outcome)])
+        elif self.prefetch <= 0:
+            await self.unlock_proxies([proxy["id"]])
+        elif _lease_live(proxy, time.time()):
+            self._buffer.append(proxy)
+
+    @asynccontextmanager
+    async def lease(self):
+        """``async with api.lease() as proxy:`` acquires a proxy and always releases it"""
+        proxy = await self.acquire()
+        try:
+            yield proxy
+        finally:
+            await self.release(proxy)
+
+    async def _lease_batch(self, count: int) -> List[dict]:
+        async with self.session.get(f"{self.base_url}/get_proxies", params={"count": count}) as response:
+            response.raise_for_status()
+            return _lease_entries(await response.json())
+
+    async def add_proxy(
+        self,
+        protocol: str,
+        ip: str,
+        port: int,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        country: Optional[str] = None,
+        provider: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ) -> dict:
+        """Add a proxy, optionally with the attributes get_proxies filters on"""
+        url = f"{self.base_url}/add_proxy"
+        params = {"protocol": protocol, "ip": ip, "port": port}
+        for name, value in (
+            ("username", username), ("password", password), ("country", country), ("provider", provider)
+        ):
+            if value is not None:
+                params[name] = value
+        if tags:
+            params["tags"] = list(tags)
+        async with self.session.post(url, params=params) as response:
+            return await response.json()
+
+    async def test_proxy(self, proxy_id: int) -> dict:
+        url = f"{self.base_url}/test_proxy/{proxy_id}"
+        async with self.session.get(url) as response:
+            return await response.json()
+
+    async def get_proxies(
+        self,
+        count: int = 1,
+        lease_seconds: Optional[float] = None,
+        strategy: Optional[str] = None,
+        session_id: Optional[str] = None,
+        protocol: Optional[str] = None,
+        country: Optional[str] = None,
+        provider: Optional[str] = None,
+        tags: Optional[List[str]] = None
+    ) -> dict:
+        """Lease proxies; calls with the same ``session_id`` get the same proxies.
+
+        ``protocol``, ``country``, ``provider`` and ``tags`` only lease
+        proxies with those attributes (all of the tags).
+        """
+        url = f"{self.base_url}/get_proxies"
+        params = {"count": count}
+        if lease_seconds is not None:
+            params["lease_seconds"] = lease_seconds
+        if strategy is not None:
+            params["strategy"] = strategy
+        if session_id is not None:
+            params["session_id"] = session_id
+        for name, value in (("protocol", protocol), ("country", country), ("provider", provider)):
+            if value is not None:
+                params[name] = value
+        if tags:
+            params["tag"] = list(tags)
+        async with self.session.get(url, params=params) as response:
+            return await response.json()
+
+    async def renew_lease(self, lease_token: str, lease_seconds: Optional[float] = None) -> dict:
+        """Extend a lease returned by get_proxies before it expires"""
+        url = f"{self.base_url}/renew_lease"
+        params = {"lease_token": lease_token}
+        if lease_seconds is not None:
+            params["lease_seconds"] = lease_seconds
+        async with self.session.post(url, params=params) as response:
+            return await response.json()
+
+    async def unlock_proxies(self, proxies: Union[List[Union[int, dict]], str]) -> dict:
+        """Unlock proxies by ID list, IP or full address; list entries can
+        be ``proxy_report`` dicts.
+
+        Lists longer than ``unlock_batch_size`` are sent as concurrent batches.
+        """
+        if isinstance(proxies, str):
+            loop = asyncio.get_running_loop()
+            proxies = await loop.run_in_executor(None, ProxyAPI.get_proxy_ids, proxies)
+        elif not isinstance(proxies, list):
+            raise ValueError("Invalid input type for unlocking proxies.")
+
+        url = f"{self.base_url}/unlock_proxies"
+        size = max(self.unlock_batch_size, 1)
+        batches = [proxies[i:i + size] for i in range(0, len(proxies), size)] or [[]]
+
+        async def send(batch: List[Union[int, dict]]) -> dict:
+            async with self.session.post(url, json=batch) as response:
+                return await response.json()
+
+        results = await asyncio.gather(*(send(batch) for batch in batches))
+        return results[-1]
+
+    async def health(self) -> dict:
+        url = f"{self.base_url}/health"
+        async with self.session.get(url) as response:
+            return await response.json()
+
+    async def get_all_available_proxies(
+        self,
+        auto_lock: bool = True,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        fields: Optional[List[str]] = None,
+        lease_seconds: Optional[float] = None
+    ) -> list:
+        """Get available proxies with option to auto-lock them.
+
+        Locked proxies are leased for ``lease_seconds`` (the server's
+        ``LEASE_TTL`` by default). Without locking, ``after_id``/``limit``
+        select one page in ID order; ``fields`` limits each proxy to those
+        keys (``"proxy"`` is its URL).
+        """
+        url = f"{self.base_url}/available_proxies"
+        params = _available_params(auto_lock, after_id, limit, fields, lease_seconds=lease_seconds)
+        async with self.session.get(url, params=params) as response:
+            if response.status == 404:
+                return []
+            response.raise_for_status()
+            return await response.json()
+
+    async def iter_available_proxies(self, fields: Optional[List[str]] = None, auto_lock: bool = False) -> AsyncIterator[dict]:
+        """Stream available proxies one at a time without loading the whole list"""
+        url = f"{self.base_url}/available_proxies"
+        params = _available_params(auto_lock, None, None, fields, "ndjson")
+        async with self.session.get(url, params=params) as response:
+            response.raise_for_status()
+            async for line in response.content:
+                if line.strip():
+                    yield json.loads(line)
+
+    async def refresh_proxies(self, force: bool = False, wait: bool = True) -> dict:
+        """Apply changes in proxies.txt; ``force`` re-reads an unchanged file.
+
+        Without ``wait`` the refresh job is returned as soon as it starts.
+        """
+        url = f"{self.base_url}/refresh_proxies"
+        params = {"force": "true" if force else "false", "wait": "true" if wait else "false"}
+        async with self.session.post(url, params=params) as response:
+            return await response.json()
+
+    async def get_job(self, job_id: str) -> dict:
+        """Status and outcome of a background job such as a refresh"""
+        url = f"{self.base_url}/jobs/{job_id}"
+        async with self.session.get(url) as response:
+            return await response.json()
@@ -1,40 +1,263 @@
 import asyncio
 import logging
-import requests
-from .database import update_proxy_status
-from .utils import construct_proxy_url
+import os
+import random
+import time
+from typing import List, Optional, Set, Tuple
+
+import aiohttp
+
+from . import history, metrics
+from .database import claim_due_checks, schedule_checks
+from .executor import run_blocking
+from .pool import pool
+from .records import Proxy
 
 logger = logging.getLogger(__name__)
 
+# Health check settings, overridable through the environment
+CHECK_URL = os.getenv("CHECK_URL", "https://httpbin.org/ip")
+CHECK_CONCURRENCY = int(os.getenv("CHECK_CONCURRENCY", "100"))
+CHECK_TIMEOUT = float(os.getenv("CHECK_TIMEOUT", "5"))
+CHECK_BATCH_SIZE = int(os.getenv("CHECK_BATCH_SIZE", "500"))
+# Seconds until a proxy that passed is checked again
+CHECK_INTERVAL = float(os.getenv("CHECK_INTERVAL", "3600"))
+# Seconds until a proxy that failed is retried; doubles with every further
+# consecutive failure up to CHECK_MAX_INTERVAL
+CHECK_RETRY_INTERVAL = float(os.getenv("CHECK_RETRY_INTERVAL", "60"))
+CHECK_MAX_INTERVAL = float(os.getenv("CHECK_MAX_INTERVAL", "86400"))
+# Fraction by which intervals are randomized, so proxies added together drift apart
+CHECK_JITTER = float(os.getenv("CHECK_JITTER", "0.1"))
+# Checks started per second across the whole pool; 0 means no limit
+CHECK_RATE = float(os.getenv("CHECK_RATE", "20"))
+
+# Seconds between scheduler passes
+TICK = 0.1
+
+class CheckProgress:
+    """Progress of the current (or last) round of due health checks.
+
+    A round starts when the scheduler finds due proxies while idle, e.g.
+    every proxy on first startup, and finishes once none are left due.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.total = 0
+        self.checked = 0
+        self.available = 0
+        self.inactive = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def start(self, total: int):
+        self.running = True
+        self.total = total
+        self.checked = self.available = self.inactive = 0
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def record(self, ok: bool):
+        self.checked += 1
+        # Proxies can fall due while a round is under way
+        self.total = max(self.total, self.checked)
+        if ok:
+            self.available += 1
+        else:
+            self.inactive += 1
+
+    def finish(self):
+        self.running = False
+        self.finished_at = time.time()
+
+    def as_dict(self) -> dict:
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "running": self.running,
+            "total": self.total,
+            "checked": self.checked,
+            "available": self.available,
+            "inactive": self.inactive,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed": round(elapsed, 3),
+            "proxies_per_second": round(self.checked / elapsed, 2) if elapsed else 0.0,
+            "rate_limit": CHECK_RATE or None
+        }
+
+progress = CheckProgress()
+
+def error_class(error: Exception) -> str:
+    """Short name of a failed check's cause, e.g. ``TimeoutError`` or ``HTTP 503``"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f"HTTP {error.status}"
+    return type(error).__name__
+
+async def check_proxy(session: aiohttp.ClientSession, proxy: Proxy) -> Tuple[bool, Optional[float], Optional[str]]:
+    """Fetch ``CHECK_URL`` through a single proxy.
+
+    Returns whether it worked, the round-trip latency in milliseconds and,
+    on failure, the class of error.
+    """
+    started = time.perf_counter()
+    try:
+        async with session.get(CHECK_URL, proxy=proxy.url) as response:
+            response.raise_for_status()
+            await response.read()
+        elapsed = time.perf_counter() - started
+        metrics.CHECKS.inc(1, "ok")
+        metrics.CHECK_DURATION.observe(elapsed)
+        return True, elapsed * 1000, None
+    except Exception as e:
+        logger.debug(f"Background check: Proxy {proxy.id} failed: {e!r}")
+        metrics.CHECKS.inc(1, "failed")
+        metrics.CHECK_DURATION.observe(time.perf_counter() - started)
+        return False, None, error_class(e)
+
+def next_check_delay(ok: bool, fail_count: int) -> float:
+    """Seconds until a proxy is checked again, given its consecutive failures
+    including the check that just ran
+    """
+    if ok:
+        delay = CHECK_INTERVAL
+    else:
+        delay = min(CHECK_RETRY_INTERVAL * 2 ** min(fail_count - 1, 32), CHECK_MAX_INTERVAL)
+    return delay * random.uniform(1 - CHECK_JITTER, 1 + CHECK_JITTER)
+
+def claim_due(limit: int, count: bool = False) -> Tuple[List[Proxy], List[Tuple], int]:
+    """Claim up to ``limit`` due proxies.
+
+    Returns the proxies to check, ``(next_check_at, proxy_id)`` entries
+    postponing the ones that are leased right now and, with ``count``, how
+    many proxies were due.
+    """
+    now = time.time()
+    proxies, postponed = [], []
+    ids, due = claim_due_checks(now, limit, CHECK_TIMEOUT * 2, count)
+    for proxy_id in ids:
+        proxy = pool.get(proxy_id)
+        if proxy is None:
+            continue
+        if proxy.status == "locked":
+            postponed.append((now + CHECK_RETRY_INTERVAL, proxy_id))
+        else:
+            proxies.append(proxy)
+    return proxies, postponed, due
+
+class CheckBatch:
+    """Check results waiting to be applied to the pool, the history and the schedule.
+
+    Proxies turn inactive after ``fail_threshold`` consecutive failures.
+    """
+
+    def __init__(self, fail_threshold: int = 1):
+        self.fail_threshold = fail_threshold
+        self.results: List[Tuple[int, bool, Optional[float]]] = []
+        self.checks: List[Tuple] = []
+        self.schedule: List[Tuple] = []
+        self.flushed_at = time.monotonic()
+
+    def add(self, proxy: Proxy, ok: bool, latency_ms: Optional[float], error: Optional[str]):
+        now = time.time()
+        fail_count = 0 if ok else proxy.fail_count + 1
+        self.results.append((proxy.id, ok, latency_ms))
+        self.checks.append((proxy.id, now, int(ok), latency_ms, error))
+        self.schedule.append((now + next_check_delay(ok, fail_count), proxy.id))
+
+    def due(self) -> bool:
+        return len(self.results) >= CHECK_BATCH_SIZE or (
+            bool(self.schedule) and time.monotonic() - self.flushed_at >= 1
+        )
+
+    def take(self) -> "CheckBatch":
+        """Hand over the pending results and start a new batch"""
+        batch = CheckBatch(self.fail_threshold)
+        batch.results, self.results = self.results, []
+        batch.checks, self.checks = self.checks, []
+        batch.schedule, self.schedule = self.schedule, []
+        self.flushed_at = time.monotonic()
+        return batch
+
+    def apply(self):
+        pool.record_checks(self.results, self.fail_threshold)
+        try:
+            history.record(self.checks)
+        except Exception as e:
+            logger.error(f"Error recording check history: {e}")
+        if self.schedule:
+            schedule_checks(self.schedule)
+
 async def check_proxies():
-    """Background task to check proxies periodically"""
-    while True:
-        from .database import db_path
-        import sqlite3
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT * FROM proxies
-            WHERE status != 'locked'
-        ''')
-        proxies = cursor.fetchall()
-        conn.close()
-
-        for proxy in proxies:
-            proxy_id = proxy[0]
-            proxy_url = construct_proxy_url(proxy)
-            try:
-                response = requests.get(
-                    "https://httpbin.org/ip",
-                    proxies={"http": proxy_url, "https": proxy_url},
-                    timeout=5
-                )
-                response.raise_for_status()
-                update_proxy_status(proxy_id, "available")
-                logger.info(f"Background check: Proxy {proxy_id} is available")
-            except Exception as e:
-                update_proxy_status(proxy_id, "inactive")
-                logger.warning(f"Background check: Proxy {proxy_id} failed: {e}")
-        
-        await asyncio.sleep(3600)  # Run every 1 hour 
\ No newline at end of file
+    """Background task checking every proxy when it falls due.
+
+    Due times live in the indexed ``next_check_at`` column: new proxies are
+    due at once, passing ones every ``CHECK_INTERVAL`` and failing ones
+    after an exponentially growing back-off. Checks are started at no more
+    than ``CHECK_RATE`` per second with at most ``CHECK_CONCURRENCY`` in
+    flight, so load stays flat however large the pool is.
+    """
+    pending = CheckBatch()
+    tasks: Set[asyncio.Task] = set()
+    tokens = 0.0
+    last = time.monotonic()
+
+    async def check(session: aiohttp.ClientSession, proxy: Proxy):
+        ok, latency_ms, error = await check_proxy(session, proxy)
+        progress.record(ok)
+        pending.add(proxy, ok, latency_ms, error)
+
+    async def flush():
+        batch = pending.take()
+        try:
+            await run_blocking(batch.apply)
+        except Exception as e:
+            logger.error(f"Error saving check results: {e}")
+
+    connector = aiohttp.TCPConnector(limit=CHECK_CONCURRENCY, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=CHECK_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        try:
+            while True:
+                now = time.monotonic()
+                if CHECK_RATE > 0:
+                    # Token bucket holding at most one second of checks
+                    tokens = min(tokens + (now - last) * CHECK_RATE, max(CHECK_RATE, 1.0))
+                else:
+                    tokens = float(CHECK_CONCURRENCY)
+                last = now
+
+                wanted = min(int(tokens), CHECK_CONCURRENCY - len(tasks))
+                if wanted > 0:
+                    try:
+                        proxies, postponed, due = await run_blocking(claim_due, wanted, not progress.running)
+                    except Exception as e:
+                        logger.error(f"Error claiming due proxy checks: {e}")
+                        proxies, postponed, due = [], [], 0
+                    if proxies and not progress.running:
+                        progress.start(due)
+                    pending.schedule.extend(postponed)
+                    tokens -= len(proxies)
+                    for proxy in proxies:
+                        task = asyncio.create_task(check(session, proxy))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    if progress.running and not proxies and not tasks:
+                        progress.finish()
+                        logger.info(
+                            f"Background check: {progress.available} available, "
+                            f"{progress.inactive} inactive in {progress.as_dict()['elapsed']}s"
+                        )
+
+                if pending.due():
+                    await flush()
+                if tasks:
+                    await asyncio.wait(tasks, timeout=TICK, return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    await asyncio.sleep(TICK)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if pending.results or pending.schedule:
+                await asyncio.shield(run_blocking(pending.take().apply))
@@ -1,22 +1,26 @@
 import asyncio
 from datetime import datetime, timedelta
-from .utils import clear_and_repopulate_db
+from .jobs import jobs
+from .utils import sync_proxy_file
 import logging
 
 logger = logging.getLogger(__name__)
 
 async def periodic_refresh():
-    """Run proxy refresh every 24 hours"""
+    """Run proxy refresh every 24 hours, as a background job"""
     while True:
         try:
             logger.info("Starting scheduled proxy refresh")
-            cleared_count = clear_and_repopulate_db()
-            logger.info(f"Scheduled refresh completed. Cleared {cleared_count} proxies")
-            
+            job = await jobs.submit("refresh", sync_proxy_file, params={"force": False, "trigger": "schedule"})
+            job = await jobs.wait(job["id"])
+            if job["status"] != "succeeded":
+                raise RuntimeError(job["error"])
+            logger.info(f"Scheduled refresh completed: {job['result']}")
+
             # Wait for 24 hours
             await asyncio.sleep(24 * 60 * 60)  # 24 hours in seconds
-            
+
         except Exception as e:
             logger.error(f"Error in periodic refresh: {e}")
             # Wait for 5 minutes before retrying if there's an error
-            await asyncio.sleep(300) 
\ No newline at end of file
+            await asyncio.sleep(300)
\ No newline at end of file
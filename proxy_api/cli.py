@@ -36,9 +36,16 @@ def start():
     """Start the proxy server"""
     os.system("uvicorn handler:app --host 0.0.0.0 --port 8000")
 
+@app.command()
+def gateway(host: str = "127.0.0.1", port: int = 8899):
+    """Run the forwarding gateway that rotates requests across the pool"""
+    import asyncio
+    from proxy_api.gateway import serve
+    asyncio.run(serve(host, port))
+
 @app.command()
 def refresh():
-    """Clear unused proxies and repopulate from proxies.txt"""
+    """Apply changes in proxies.txt to the proxy pool"""
     result = api.refresh_proxies()
     typer.echo(result)
 
@@ -0,0 +1,228 @@
+import asyncio
+import heapq
+import logging
+import math
+import os
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+
+from . import metrics
+from .records import Proxy
+
+logger = logging.getLogger(__name__)
+
+# Proxies each API key may hold leased at once; 0 for no limit
+CLIENT_MAX_LEASES = int(os.getenv("CLIENT_MAX_LEASES", "0"))
+# Lease requests per second each API key may make; 0 for no limit
+CLIENT_RATE = float(os.getenv("CLIENT_RATE", "0"))
+# Lease requests an API key may make at once before CLIENT_RATE applies
+CLIENT_BURST = float(os.getenv("CLIENT_BURST", "10"))
+# Seconds between checks that proxies counted against quotas are still leased in the store
+CLIENT_RECONCILE_INTERVAL = float(os.getenv("CLIENT_RECONCILE_INTERVAL", "30"))
+# Further API keys as comma-separated name:key[:max_leases[:rate[:burst]]],
+# each with its own quota; API_KEY itself is the client "default"
+API_KEYS = os.getenv("API_KEYS", "")
+
+class Client:
+    """An API key with its lease quota and request token bucket.
+
+    ``held`` maps each proxy the client has leased to its lease expiry
+    (``None`` for no expiry); ``pending`` counts proxies requested by lease
+    calls still in flight, so concurrent calls cannot overshoot the quota.
+    """
+    __slots__ = (
+        "name", "key", "max_leases", "rate", "burst",
+        "tokens", "refilled_at", "held", "pending", "_expiry"
+    )
+
+    def __init__(self, name: str, key: str, max_leases: int = CLIENT_MAX_LEASES,
+                 rate: float = CLIENT_RATE, burst: float = CLIENT_BURST):
+        self.name = name
+        self.key = key
+        self.max_leases = max_leases
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.refilled_at = time.monotonic()
+        self.held: Dict[int, Optional[float]] = {}
+        self.pending = 0
+        self._expiry: List[Tuple[float, int]] = []
+
+    def take(self, now: float) -> float:
+        """Spend a request token; returns 0, or the seconds until one is available"""
+        if self.rate <= 0:
+            return 0
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def hold(self, proxy_id: int, expires_at: Optional[float]):
+        self.held[proxy_id] = expires_at
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, proxy_id))
+
+    def expire(self, now: float):
+        """Forget proxies whose lease has run out; renewed and released
+        proxies leave stale heap entries behind
+        """
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, proxy_id = heapq.heappop(self._expiry)
+            if self.held.get(proxy_id, 0) == expires_at:
+                del self.held[proxy_id]
+
+    def remaining(self, now: float) -> Optional[int]:
+        """Proxies the client may still lease, or ``None`` without a quota"""
+        if self.max_leases <= 0:
+            return None
+        self.expire(now)
+        return max(self.max_leases - len(self.held) - self.pending, 0)
+
+def parse_api_keys(value: str) -> List[Client]:
+    """Parse ``API_KEYS``; malformed entries are logged and skipped"""
+    clients = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        parts = entry.split(":")
+        try:
+            if len(parts) < 2 or len(parts) > 5 or not parts[0] or not parts[1]:
+                raise ValueError("expected name:key[:max_leases[:rate[:burst]]]")
+            name, key = parts[:2]
+            max_leases = int(parts[2]) if len(parts) > 2 and parts[2] else CLIENT_MAX_LEASES
+            rate = float(parts[3]) if len(parts) > 3 and parts[3] else CLIENT_RATE
+            burst = float(parts[4]) if len(parts) > 4 and parts[4] else CLIENT_BURST
+        except ValueError as e:
+            logger.error(f"Ignoring API_KEYS entry {parts[0]!r}: {e}")
+            continue
+        clients.append(Client(name, key, max_leases, rate, burst))
+    return clients
+
+class ClientRegistry:
+    """API keys and the leases held through each, kept in this process.
+
+    Quotas and rate limits are checked against in-memory state only, so
+    enforcing them costs no database or Redis round-trip. The registry
+    learns about leases from the lease endpoints and about returned proxies
+    from ``/unlock_proxies`` and lease expiry; ``run_reconcile`` catches
+    proxies the store released or removed by other means. With several
+    workers each one enforces the limits for the requests it serves.
+    """
+
+    def __init__(self, clients: Iterable[Client]):
+        self._by_key: Dict[str, Client] = {}
+        self._holders: Dict[int, Client] = {}
+        for client in clients:
+            if client.key in self._by_key:
+                logger.error(f"API key of client {client.name} is already used by {self._by_key[client.key].name}")
+                continue
+            self._by_key[client.key] = client
+
+    def authenticate(self, key: Optional[str]) -> Optional[Client]:
+        return self._by_key.get(key) if key is not None else None
+
+    def throttle(self, client: Client):
+        """Count a lease request against the client's rate limit; raises 429 when exhausted"""
+        wait = client.take(time.monotonic())
+        if wait:
+            metrics.CLIENT_THROTTLED.inc(1, client.name, "rate")
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+    @contextmanager
+    def reserve(self, client: Client, count: Optional[int]) -> Iterator[Optional[int]]:
+        """Reserve quota for a lease of ``count`` proxies (all available if ``None``).
+
+        Yields how many proxies the lease may take, which is fewer than
+        ``count`` when the quota is nearly used up; raises 429 once it is
+        used up entirely. Leased proxies must be handed to ``hold`` before
+        the block exits.
+        """
+        remaining = client.remaining(time.time())
+        if remaining is None:
+            yield count
+            return
+        if remaining == 0:
+            metrics.CLIENT_THROTTLED.inc(1, client.name, "quota")
+            raise HTTPException(status_code=429, detail="Lease quota exceeded")
+        allowed = remaining if count is None else min(count, remaining)
+        client.pending += allowed
+        try:
+            yield allowed
+        finally:
+            client.pending -= allowed
+
+    def hold(self, client: Client, proxies: Iterable[Proxy], expires_at: Optional[float]):
+        """Count freshly leased proxies against ``client``"""
+        for proxy in proxies:
+            previous = self._holders.get(proxy.id)
+            if previous is not None and previous is not client:
+                previous.held.pop(proxy.id, None)
+            self._holders[proxy.id] = client
+            client.hold(proxy.id, expires_at)
+
+    def renew(self, proxy_ids: Iterable[int], expires_at: Optional[float]):
+        for proxy_id in proxy_ids:
+            client = self._holders.get(proxy_id)
+            if client is not None and proxy_id in client.held:
+                client.hold(proxy_id, expires_at)
+
+    def release(self, client: Client, proxy_ids: Iterable[int]):
+        """Stop counting proxies ``client`` returned; those held by other
+        clients keep counting against their quota
+        """
+        for proxy_id in proxy_ids:
+            if self._holders.get(proxy_id) is client:
+                del self._holders[proxy_id]
+                client.held.pop(proxy_id, None)
+
+    def forget(self, proxy_ids: Iterable[int]):
+        """Stop counting proxies the store released or removed, whichever client held them"""
+        for proxy_id in proxy_ids:
+            client = self._holders.pop(proxy_id, None)
+            if client is not None:
+                client.held.pop(proxy_id, None)
+
+    async def run_reconcile(self, leased: Callable[[List[int]], Awaitable[Set[int]]],
+                            interval: float = CLIENT_RECONCILE_INTERVAL):
+        """Background task forgetting held proxies that ``leased`` no longer
+        reports as leased, every ``interval`` seconds
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                held = [(proxy_id, client, client.held.get(proxy_id)) for proxy_id, client in self._holders.items()]
+                if not held:
+                    continue
+                still_leased = await leased([proxy_id for proxy_id, _, _ in held])
+                # Proxies leased again while the store was asked keep counting
+                self.forget([
+                    proxy_id for proxy_id, client, expires_at in held
+                    if proxy_id not in still_leased and self._holders.get(proxy_id) is client
+                    and client.held.get(proxy_id, 0) == expires_at
+                ])
+            except Exception as e:
+                logger.error(f"Error reconciling client leases: {e}")
+
+    def leased(self) -> Dict[str, int]:
+        """Proxies held by each client; only reads, as metrics are collected off the event loop"""
+        now = time.time()
+        return {
+            client.name: sum(expires_at is None or expires_at > now for expires_at in list(client.held.values()))
+            for client in list(self._by_key.values())
+        }
+
+clients = ClientRegistry([
+    Client("default", os.getenv("API_KEY", "your-default-api-key")),
+    *parse_api_keys(API_KEYS)
+])
+metrics.CLIENT_LEASED_PROXIES.set_function(clients.leased)
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from typing import Awaitable, Callable
+
+from .database import acquire_lock, count_live_workers, heartbeat_worker, release_lock, remove_worker
+from .executor import run_blocking
+from .pool import pool
+
+logger = logging.getLogger(__name__)
+
+# Seconds a leader keeps its lock without renewing it; also how long a
+# silent worker counts as alive
+LEADER_TTL = float(os.getenv("LEADER_TTL", "15"))
+# Seconds between heartbeats and leadership renewals
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "5"))
+
+LEADER_LOCK = "leader"
+
+class Coordinator:
+    """Elects one worker process to run the pool's maintenance tasks.
+
+    Every worker heartbeats into the ``workers`` table and competes for the
+    ``leader`` row of the ``locks`` table; the holder renews it every
+    ``HEARTBEAT_INTERVAL`` seconds and another worker takes over once it has
+    gone ``LEADER_TTL`` seconds without renewing. Any number of processes on
+    hosts sharing ``proxies.db`` can take part.
+
+    This holds for every backend, so refreshes and health checks never run
+    twice against one database. A per-process pool cannot be shared safely
+    though: its workers would lease the same proxies and miss each other's
+    refreshes, so ``ensure_alone`` refuses to start one next to live peers.
+    """
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.is_leader = False
+        self._peers = 0
+
+    def heartbeat(self) -> bool:
+        """Announce this worker, try to take or keep leadership, and return it"""
+        heartbeat_worker(self.worker_id)
+        was_leader = self.is_leader
+        self.is_leader = acquire_lock(LEADER_LOCK, self.worker_id, LEADER_TTL)
+        if self.is_leader != was_leader:
+            logger.info(f"Worker {self.worker_id} {'is now' if self.is_leader else 'is no longer'} the leader")
+        if not pool.shared:
+            self._check_peers()
+        return self.is_leader
+
+    def _check_peers(self):
+        peers = count_live_workers(LEADER_TTL, exclude=self.worker_id)
+        if peers and peers != self._peers:
+            logger.error(
+                f"{peers} other worker(s) share this database, but the {type(pool).__name__} "
+                f"pool lives in each process and they may lease the same proxies; "
+                f"run several workers with STORAGE_BACKEND=sqlite or redis"
+            )
+        self._peers = peers
+
+    async def ensure_alone(self):
+        """Raise ``RuntimeError`` if other workers stay alive, for pools that
+        live in one process.
+
+        Workers of a run that crashed count as alive for ``LEADER_TTL``
+        seconds, so they are given that long to go silent first.
+        """
+        deadline = time.monotonic() + LEADER_TTL
+        while not await run_blocking(self.alone):
+            if time.monotonic() >= deadline:
+                await run_blocking(self.leave)
+                raise RuntimeError(
+                    f"Other workers share this database, but the {type(pool).__name__} pool lives "
+                    f"in each process; run several workers with STORAGE_BACKEND=sqlite or redis"
+                )
+            await asyncio.sleep(min(HEARTBEAT_INTERVAL, LEADER_TTL / 3))
+            # Stay visible, so workers starting together all see each other
+            await run_blocking(self.heartbeat)
+
+    def alone(self) -> bool:
+        """Whether no other worker is alive, so nobody else can hold leases"""
+        return count_live_workers(LEADER_TTL, exclude=self.worker_id) == 0
+
+    def leave(self):
+        """Step down and deregister on shutdown"""
+        release_lock(LEADER_LOCK, self.worker_id)
+        remove_worker(self.worker_id)
+        self.is_leader = False
+
+    async def run(self, on_elected: Callable[[], Awaitable[None]], on_demoted: Callable[[], None]):
+        """Background task that heartbeats and calls back when leadership changes"""
+        leading = False
+        while True:
+            try:
+                await run_blocking(self.heartbeat)
+            except Exception as e:
+                logger.error(f"Heartbeat failed: {e}")
+                # Without a successful renewal another worker may take over
+                self.is_leader = False
+            if self.is_leader and not leading:
+                await on_elected()
+            elif leading and not self.is_leader:
+                on_demoted()
+            leading = self.is_leader
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+coordinator = Coordinator()
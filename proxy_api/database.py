@@ -1,106 +1,1099 @@
 import sqlite3
+import json
 import logging
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
 from fastapi import HTTPException
-from typing import List, Optional, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from .metrics import timed_query
+from .records import Proxy, ProxyFilter
 
 logger = logging.getLogger(__name__)
-db_path = "proxies.db"
+# SQLite file holding the proxy catalogue (and, with STORAGE_BACKEND=sqlite, the pool)
+db_path = os.getenv("DB_PATH", "proxies.db")
+
+# Connection settings, overridable through the environment
+BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+CACHED_STATEMENTS = int(os.getenv("DB_CACHED_STATEMENTS", "256"))
+
+_local = threading.local()
+_connections: List[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+_generation = 0
+
+# Proxy columns in the order rows are handed to the rest of the app
+PROXY_COLUMNS = (
+    'id, protocol, username, password, ip, port, status, '
+    'last_tested, fail_count, latency_ms, success_rate, '
+    'country, provider, tags'
+)
+
+# Columns of ``proxy_stats`` in table order
+PROXY_STATS_COLUMNS = (
+    "proxy_id", "checks_1h", "success_rate_1h", "avg_latency_ms_1h",
+    "checks_24h", "success_rate_24h", "avg_latency_ms_24h", "last_error", "updated_at"
+)
+
+# Columns of ``jobs`` in table order
+JOB_COLUMNS = (
+    "id", "kind", "status", "params", "result", "error", "created_at", "started_at", "finished_at"
+)
+
+# ORDER BY clauses used by ``lease_proxies`` for each selection strategy;
+# weighted-random leases of a given count are sampled by ``_weighted_sample``
+LEASE_ORDER = {
+    "round_robin": "last_leased, id",
+    "lru": "last_leased, id",
+    "lowest_latency": "latency_ms IS NULL, latency_ms, id",
+    "weighted_random": "id",
+}
+# Available proxies a weighted-random lease weighs besides the ones it asks for
+WEIGHTED_CANDIDATES = 64
+
+def _weighted_key(
+    success_rate: Optional[float],
+    latency_ms: Optional[float],
+    history_rate: Optional[float] = None
+) -> float:
+    """Random sort key; ascending order is a sample weighted by health score"""
+    score = 1.0 if success_rate is None else success_rate
+    if history_rate is not None:
+        score *= history_rate
+    if latency_ms is not None:
+        score *= 1000.0 / (1000.0 + latency_ms)
+    return -math.log(1.0 - random.random()) / max(score, 0.01)
+
+def get_connection() -> sqlite3.Connection:
+    """Return the calling thread's long-lived connection to ``db_path``.
+
+    Connections are opened lazily, once per thread, in autocommit mode with
+    WAL journaling, ``synchronous=NORMAL`` and a busy timeout. Use
+    ``transaction()`` to group several statements.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        if _local.key == (db_path, _generation):
+            return conn
+        # db_path changed or close_connections() ran since this was opened
+        with _connections_lock:
+            if conn in _connections:
+                _connections.remove(conn)
+        conn.close()
+
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT * 1000)}")
+    _local.conn = conn
+    _local.key = (db_path, _generation)
+    with _connections_lock:
+        _connections.append(conn)
+    return conn
+
+def proxy_cursor(conn: Optional[sqlite3.Connection] = None) -> sqlite3.Cursor:
+    """Cursor whose rows are hydrated into ``Proxy`` records.
+
+    Only use it for ``SELECT {PROXY_COLUMNS}`` queries.
+    """
+    cursor = (conn or get_connection()).cursor()
+    cursor.row_factory = Proxy.from_row
+    return cursor
+
+@contextmanager
+def transaction(immediate: bool = False):
+    """Run the enclosed statements in one transaction on the thread's connection.
+
+    ``immediate=True`` takes the write lock up front (``BEGIN IMMEDIATE``),
+    which is what read-then-write sequences need to stay atomic.
+    """
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+def close_connections():
+    """Close every connection opened by ``get_connection``.
+
+    Threads that call ``get_connection`` afterwards transparently reconnect.
+    """
+    global _generation
+    with _connections_lock:
+        _generation += 1
+        while _connections:
+            _connections.pop().close()
+
+def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: dict):
+    """Add columns introduced after a database was first created"""
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    for name, definition in columns.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {definition}')
 
+@timed_query
 def init_db():
     """Initialize the database with required tables"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS proxies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            protocol TEXT NOT NULL,
-            username TEXT,
-            password TEXT,
-            ip TEXT NOT NULL,
-            port INTEGER NOT NULL,
-            status TEXT DEFAULT 'available',
-            last_tested TIMESTAMP,
-            fail_count INTEGER DEFAULT 0
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-def get_all_proxy_ids() -> List[int]:
-    """Get all proxy IDs from the database"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id FROM proxies")
-    proxy_ids = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return proxy_ids
-
-def get_proxy_by_id(proxy_id: int) -> Optional[Tuple]:
+    # Take the write lock up front; workers may initialize concurrently
+    with transaction(immediate=True) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS proxies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                protocol TEXT NOT NULL,
+                username TEXT,
+                password TEXT,
+                ip TEXT NOT NULL,
+                port INTEGER NOT NULL,
+                status TEXT DEFAULT 'available',
+                last_tested TIMESTAMP,
+                fail_count INTEGER DEFAULT 0,
+                latency_ms REAL,
+                success_rate REAL DEFAULT 1.0,
+                source TEXT DEFAULT 'file',
+                last_leased REAL DEFAULT 0,
+                lease_token TEXT,
+                lease_expires_at REAL,
+                history_rate REAL DEFAULT 1.0,
+                next_check_at REAL DEFAULT 0,
+                country TEXT,
+                provider TEXT,
+                tags TEXT,
+                sample_key INTEGER,
+                retired INTEGER DEFAULT 0
+            )
+        ''')
+        _add_missing_columns(conn, 'proxies', {
+            'latency_ms': 'REAL',
+            'success_rate': 'REAL DEFAULT 1.0',
+            'source': "TEXT DEFAULT 'file'",
+            'last_leased': 'REAL DEFAULT 0',
+            'lease_token': 'TEXT',
+            'lease_expires_at': 'REAL',
+            'history_rate': 'REAL DEFAULT 1.0',
+            'next_check_at': 'REAL DEFAULT 0',
+            'country': 'TEXT',
+            'provider': 'TEXT',
+            'tags': 'TEXT',
+            'sample_key': 'INTEGER',
+            'retired': 'INTEGER DEFAULT 0'
+        })
+        # Random position of each proxy for weighted-random sampling, drawn
+        # on insert and again on every lease
+        conn.execute('UPDATE proxies SET sample_key = random() WHERE sample_key IS NULL')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS proxies_sample_key
+            AFTER INSERT ON proxies
+            WHEN NEW.sample_key IS NULL
+            BEGIN
+                UPDATE proxies SET sample_key = random() WHERE id = NEW.id;
+            END
+        ''')
+        # Inverted index of the comma-separated ``proxies.tags``, kept in step
+        # by ``_index_tags`` and the delete trigger
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS proxy_tags (
+                tag TEXT NOT NULL,
+                proxy_id INTEGER NOT NULL,
+                PRIMARY KEY (tag, proxy_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxy_tags_proxy
+            ON proxy_tags (proxy_id)
+        ''')
+        conn.execute('''
+            CREATE TRIGGER IF NOT EXISTS proxies_delete_tags
+            AFTER DELETE ON proxies
+            BEGIN
+                DELETE FROM proxy_tags WHERE proxy_id = OLD.id;
+            END
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS workers (
+                id TEXT PRIMARY KEY,
+                heartbeat_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS locks (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        # Append-only health check history, compacted into hourly buckets
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS proxy_checks (
+                proxy_id INTEGER NOT NULL,
+                checked_at REAL NOT NULL,
+                ok INTEGER NOT NULL,
+                latency_ms REAL,
+                error TEXT
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS proxy_checks_hourly (
+                proxy_id INTEGER NOT NULL,
+                hour INTEGER NOT NULL,
+                checks INTEGER NOT NULL,
+                successes INTEGER NOT NULL,
+                latency_sum REAL NOT NULL,
+                latency_count INTEGER NOT NULL,
+                last_error_at REAL,
+                last_error TEXT,
+                PRIMARY KEY (proxy_id, hour)
+            ) WITHOUT ROWID
+        ''')
+        _add_missing_columns(conn, 'proxy_checks_hourly', {
+            'last_error_at': 'REAL',
+            'last_error': 'TEXT'
+        })
+        # proxy_stats is derived from the buckets; rebuild it if it predates average latencies
+        if 'p50_latency_ms_24h' in {row[1] for row in conn.execute('PRAGMA table_info(proxy_stats)')}:
+            conn.execute('DROP TABLE proxy_stats')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS proxy_stats (
+                proxy_id INTEGER PRIMARY KEY,
+                checks_1h INTEGER NOT NULL,
+                success_rate_1h REAL,
+                avg_latency_ms_1h REAL,
+                checks_24h INTEGER NOT NULL,
+                success_rate_24h REAL,
+                avg_latency_ms_24h REAL,
+                last_error TEXT,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        # Background jobs such as refreshes, visible to every worker
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                params TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_jobs_created
+            ON jobs (created_at)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxy_checks_time
+            ON proxy_checks (checked_at)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxy_checks_proxy
+            ON proxy_checks (proxy_id, checked_at)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxy_checks_hourly_hour
+            ON proxy_checks_hourly (hour)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxies_status
+            ON proxies (status, id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxies_status_leased
+            ON proxies (status, last_leased, id)
+        ''')
+        # Matches LEASE_ORDER["lowest_latency"], so those leases read in index order
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxies_status_latency
+            ON proxies (status, latency_ms IS NULL, latency_ms, id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxies_status_sample
+            ON proxies (status, sample_key)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxies_country
+            ON proxies (country, status)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxies_provider
+            ON proxies (provider, status)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxies_next_check
+            ON proxies (next_check_at)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxies_retired
+            ON proxies (id)
+            WHERE retired = 1
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_proxies_lease_expiry
+            ON proxies (lease_expires_at)
+            WHERE lease_expires_at IS NOT NULL
+        ''')
+        # Databases created before the unique index may hold duplicates
+        conn.execute('''
+            DELETE FROM proxies
+            WHERE id NOT IN (
+                SELECT MIN(id) FROM proxies GROUP BY protocol, ip, port
+            )
+        ''')
+        conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_proxies_address
+            ON proxies (protocol, ip, port)
+        ''')
+
+@timed_query
+def get_meta(key: str) -> Optional[str]:
+    """Read a value from the ``meta`` key-value table"""
+    row = get_connection().execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+@timed_query
+def set_meta(key: str, value: str):
+    """Write a value to the ``meta`` key-value table"""
+    get_connection().execute('''
+        INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)
+    ''', (key, value))
+
+@timed_query
+def get_proxy_by_id(proxy_id: int) -> Optional[Proxy]:
     """Get a proxy by its ID"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM proxies WHERE id = ?', (proxy_id,))
-    proxy = cursor.fetchone()
-    conn.close()
-    return proxy
-
-def update_proxy_status(proxy_id: int, status: str):
-    """Update the status of a proxy"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
+    cursor = proxy_cursor().execute(f'SELECT {PROXY_COLUMNS} FROM proxies WHERE id = ?', (proxy_id,))
+    return cursor.fetchone()
+
+@timed_query
+def update_proxy_statuses(proxy_ids: List[int], status: str) -> int:
+    """Set the status of many proxies in one transaction and return the row count"""
+    with transaction() as conn:
+        cursor = conn.executemany('''
+            UPDATE proxies
+            SET status = ?, lease_token = NULL, lease_expires_at = NULL
+            WHERE id = ?
+        ''', [(status, proxy_id) for proxy_id in proxy_ids])
+        return cursor.rowcount
+
+@timed_query
+def release_locked_proxies() -> int:
+    """Make every locked proxy available with a single statement and return
+    the row count; inactive proxies stay inactive
+    """
+    cursor = get_connection().execute('''
+        UPDATE proxies
+        SET status = 'available', lease_token = NULL, lease_expires_at = NULL
+        WHERE status = 'locked'
+    ''')
+    return cursor.rowcount
+
+@timed_query
+def save_proxy_states(states: List[Tuple]):
+    """Persist a batch of
+    ``(status, last_tested, fail_count, latency_ms, success_rate, proxy_id)`` rows
+    """
+    with transaction() as conn:
+        conn.executemany('''
+            UPDATE proxies
+            SET status = ?, last_tested = ?, fail_count = ?,
+                latency_ms = ?, success_rate = ?
+            WHERE id = ?
+        ''', states)
+
+@timed_query
+def get_all_proxies() -> List[Proxy]:
+    """Get every proxy from the database"""
+    return proxy_cursor().execute(f'SELECT {PROXY_COLUMNS} FROM proxies').fetchall()
+
+def _reclaim_expired_leases(conn: sqlite3.Connection, now: float) -> int:
+    cursor = conn.execute('''
         UPDATE proxies
-        SET status = ?, last_tested = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (status, proxy_id))
-    conn.commit()
-    conn.close()
-
-def get_all_available_proxies():
-    """Get all available proxies from the database"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+        SET status = 'available', lease_token = NULL, lease_expires_at = NULL
+        WHERE lease_expires_at <= ? AND status = 'locked'
+    ''', (now,))
+    return cursor.rowcount
+
+@timed_query
+def reclaim_expired_leases() -> int:
+    """Return proxies whose lease has expired to the available set"""
+    with transaction(immediate=True) as conn:
+        return _reclaim_expired_leases(conn, time.time())
+
+def _filter_clause(match: Optional[ProxyFilter]) -> Tuple[str, list]:
+    """SQL conditions and parameters selecting the proxies ``match`` accepts;
+    tags are looked up through the ``proxy_tags`` index
+    """
+    if not match:
+        return "", []
+    clauses, params = [], []
+    for field, value in match.terms():
+        if field == "tag":
+            clauses.append("id IN (SELECT proxy_id FROM proxy_tags WHERE tag = ?)")
+        else:
+            clauses.append(f"{field} = ?")
+        params.append(value)
+    return "".join(f" AND {clause}" for clause in clauses), params
+
+def _index_tags(conn: sqlite3.Connection, where: str, params: Tuple = ()):
+    """Add ``proxy_tags`` rows for the proxies selected by ``where``"""
+    conn.execute(f'''
+        WITH RECURSIVE split(proxy_id, tag, rest) AS (
+            SELECT id, '', tags || ',' FROM proxies
+            WHERE tags IS NOT NULL AND {where}
+            UNION ALL
+            SELECT proxy_id, substr(rest, 1, instr(rest, ',') - 1), substr(rest, instr(rest, ',') + 1)
+            FROM split WHERE rest != ''
+        )
+        INSERT OR IGNORE INTO proxy_tags (proxy_id, tag)
+        SELECT proxy_id, tag FROM split WHERE tag != ''
+    ''', params)
+
+def _weighted_sample(conn: sqlite3.Connection, count: int, conditions: str, params: list) -> List[Proxy]:
+    """Up to ``count`` available proxies drawn by health-weighted sampling.
+
+    Candidates are the next ``count + WEIGHTED_CANDIDATES`` available
+    proxies in ``sample_key`` order from a random key, wrapping around. Keys
+    are random and redrawn on every lease, so candidates are a fresh random
+    subset, and a lease reads and weighs a bounded number of rows through
+    ``idx_proxies_status_sample`` however large the pool is.
+    """
+    start = random.randint(-2 ** 63, 2 ** 63 - 1)
+    wanted = count + WEIGHTED_CANDIDATES
+    query = f'''
+        SELECT id, success_rate, latency_ms, history_rate FROM proxies
+        WHERE status = 'available' AND sample_key {{}} ?{conditions}
+        ORDER BY sample_key LIMIT ?
+    '''
+    candidates = conn.execute(query.format(">="), (start, *params, wanted)).fetchall()
+    if len(candidates) < wanted:
+        candidates += conn.execute(query.format("<"), (start, *params, wanted - len(candidates))).fetchall()
+    chosen = [row[0] for row in sorted(candidates, key=lambda row: _weighted_key(*row[1:]))[:count]]
+    rows = proxy_cursor(conn).execute(
+        f'SELECT {PROXY_COLUMNS} FROM proxies WHERE id IN ({",".join("?" * len(chosen))})', chosen
+    ).fetchall()
+    rank = {proxy_id: i for i, proxy_id in enumerate(chosen)}
+    return sorted(rows, key=lambda proxy: rank[proxy.id])
+
+@timed_query
+def lease_proxies(
+    count: Optional[int] = None,
+    strategy: str = "round_robin",
+    lease_token: Optional[str] = None,
+    expires_at: Optional[float] = None,
+    match: Optional[ProxyFilter] = None
+) -> List[Proxy]:
+    """Atomically lock up to ``count`` available proxies and return them.
+
+    Expired leases are reclaimed, then proxies accepted by ``match`` are
+    selected in the order of ``LEASE_ORDER[strategy]`` (or sampled, for
+    weighted-random leases of a given count) and tagged with
+    ``lease_token``, all inside a single ``BEGIN IMMEDIATE`` transaction, so
+    concurrent callers (threads or processes) can never be handed the same
+    proxy. ``count=None`` leases every available proxy.
+    """
+    if count is not None and count <= 0:
+        return []
+    limit = -1 if count is None else count
+    now = time.time()
+    conditions, params = _filter_clause(match)
+
     try:
-        cursor.execute('''
-            SELECT * FROM proxies 
-            WHERE status = 'available'
-        ''')
-        available_proxies = cursor.fetchall()
-        return available_proxies
+        with transaction(immediate=True) as conn:
+            _reclaim_expired_leases(conn, now)
+            if strategy == "weighted_random" and count is not None:
+                proxies = _weighted_sample(conn, count, conditions, params)
+            else:
+                proxies = proxy_cursor(conn).execute(f'''
+                    SELECT {PROXY_COLUMNS} FROM proxies
+                    WHERE status = 'available'{conditions}
+                    ORDER BY {LEASE_ORDER[strategy]}
+                    LIMIT ?
+                ''', (*params, limit)).fetchall()
+            conn.executemany('''
+                UPDATE proxies
+                SET status = 'locked', lease_token = ?, lease_expires_at = ?, last_leased = ?,
+                    sample_key = random()
+                WHERE id = ?
+            ''', [(lease_token, expires_at, now, proxy.id) for proxy in proxies])
+        for proxy in proxies:
+            proxy.status = "locked"
+        return proxies
     except Exception as e:
-        logger.error(f"Error getting available proxies: {e}")
-        raise HTTPException(status_code=500, detail="Failed to get available proxies")
+        logger.error(f"Error leasing proxies: {e}")
+        raise HTTPException(status_code=500, detail="Failed to lease proxies")
 
-def add_proxy_to_db(protocol: str, ip: str, port: int, username: Optional[str], password: Optional[str]):
-    """Add a new proxy to the database"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            INSERT INTO proxies (protocol, username, password, ip, port)
+@timed_query
+def renew_lease(lease_token: str, expires_at: Optional[float]) -> List[int]:
+    """Set the expiry of an unexpired lease and return the IDs it still holds"""
+    with transaction(immediate=True) as conn:
+        _reclaim_expired_leases(conn, time.time())
+        conn.execute('''
+            UPDATE proxies
+            SET lease_expires_at = ?
+            WHERE lease_token = ? AND status = 'locked'
+        ''', (expires_at, lease_token))
+        cursor = conn.execute('''
+            SELECT id FROM proxies
+            WHERE lease_token = ? AND status = 'locked'
+        ''', (lease_token,))
+        return [row[0] for row in cursor.fetchall()]
+
+@timed_query
+def get_proxy_page(status: Optional[str], after_id: int, limit: int) -> List[Proxy]:
+    """Up to ``limit`` proxies with IDs above ``after_id``, in ID order"""
+    if status is not None:
+        return proxy_cursor().execute(f'''
+            SELECT {PROXY_COLUMNS} FROM proxies
+            WHERE status = ? AND id > ?
+            ORDER BY id LIMIT ?
+        ''', (status, after_id, limit)).fetchall()
+    return proxy_cursor().execute(f'''
+        SELECT {PROXY_COLUMNS} FROM proxies
+        WHERE id > ?
+        ORDER BY id LIMIT ?
+    ''', (after_id, limit)).fetchall()
+
+def iter_proxies(
+    status: Optional[str] = None,
+    after_id: int = 0,
+    limit: Optional[int] = None,
+    chunk_size: int = 1000
+) -> Iterator[Proxy]:
+    """Yield proxies in ID order, ``chunk_size`` at a time.
+
+    Each chunk is its own keyset query (``id > last seen``), so only one
+    chunk is held in memory and no cursor stays open between chunks; the
+    generator can be advanced from different threads.
+    """
+    while limit is None or limit > 0:
+        size = chunk_size if limit is None else min(chunk_size, limit)
+        rows = get_proxy_page(status, after_id, size)
+        yield from rows
+        if len(rows) < size:
+            return
+        after_id = rows[-1].id
+        if limit is not None:
+            limit -= len(rows)
+
+@timed_query
+def count_proxies_by_status() -> dict:
+    """Number of proxies in each status"""
+    cursor = get_connection().execute('SELECT status, COUNT(*) FROM proxies GROUP BY status')
+    return dict(cursor.fetchall())
+
+@timed_query
+def count_active_leases() -> int:
+    """Number of distinct lease tokens still holding proxies"""
+    cursor = get_connection().execute('''
+        SELECT COUNT(DISTINCT lease_token) FROM proxies
+        WHERE status = 'locked' AND lease_token IS NOT NULL
+    ''')
+    return cursor.fetchone()[0]
+
+@timed_query
+def record_proxy_checks(results: List[Tuple], tested_at: str, alpha: float, fail_threshold: int = 1):
+    """Fold ``(proxy_id, ok, latency_ms)`` health check results into the table.
+
+    Mirrors ``PoolEntry.record``: success rate and latency are moving
+    averages weighted by ``alpha``, locked proxies keep their status and
+    the others turn inactive after ``fail_threshold`` consecutive failures.
+    """
+    with transaction() as conn:
+        conn.executemany('''
+            UPDATE proxies
+            SET last_tested = :tested_at,
+                success_rate = COALESCE(success_rate, 1.0)
+                    + :alpha * (:ok - COALESCE(success_rate, 1.0)),
+                latency_ms = CASE
+                    WHEN NOT :ok OR :latency_ms IS NULL THEN latency_ms
+                    WHEN latency_ms IS NULL THEN :latency_ms
+                    ELSE latency_ms + :alpha * (:latency_ms - latency_ms)
+                END,
+                fail_count = CASE WHEN :ok THEN 0 ELSE COALESCE(fail_count, 0) + 1 END,
+                status = CASE
+                    WHEN status = 'locked' THEN status
+                    WHEN :ok THEN 'available'
+                    WHEN COALESCE(fail_count, 0) + 1 >= :threshold THEN 'inactive'
+                    ELSE status
+                END
+            WHERE id = :id
+        ''', [
+            {"id": proxy_id, "ok": int(ok), "latency_ms": latency_ms,
+             "tested_at": tested_at, "alpha": alpha, "threshold": fail_threshold}
+            for proxy_id, ok, latency_ms in results
+        ])
+
+@timed_query
+def claim_due_checks(now: float, limit: int, hold: float, count: bool = False) -> Tuple[List[int], int]:
+    """Take up to ``limit`` proxies whose check is due, most overdue first.
+
+    Their due time is pushed ``hold`` seconds ahead, so they are not claimed
+    again while being checked, and are retried if the checker dies first.
+    Returns the claimed ids and, with ``count``, how many proxies were due
+    including them.
+    """
+    with transaction(immediate=True) as conn:
+        ids = [row[0] for row in conn.execute('''
+            SELECT id FROM proxies
+            WHERE next_check_at <= ?
+            ORDER BY next_check_at
+            LIMIT ?
+        ''', (now, limit))]
+        due = len(ids)
+        if count and due == limit:
+            due = conn.execute('SELECT COUNT(*) FROM proxies WHERE next_check_at <= ?', (now,)).fetchone()[0]
+        conn.executemany(
+            'UPDATE proxies SET next_check_at = ? WHERE id = ?',
+            [(now + hold, proxy_id) for proxy_id in ids]
+        )
+        return ids, due
+
+@timed_query
+def schedule_checks(schedule: List[Tuple]):
+    """Set the next check of each ``(next_check_at, proxy_id)`` pair"""
+    with transaction() as conn:
+        conn.executemany('UPDATE proxies SET next_check_at = ? WHERE id = ?', schedule)
+
+@timed_query
+def insert_proxy_checks(checks: List[Tuple]):
+    """Append ``(proxy_id, checked_at, ok, latency_ms, error)`` rows to the check history"""
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO proxy_checks (proxy_id, checked_at, ok, latency_ms, error)
             VALUES (?, ?, ?, ?, ?)
-        ''', (protocol, username, password, ip, port))
-        conn.commit()
+        ''', checks)
+
+# ``meta`` key holding the end of the last hour folded into ``proxy_checks_hourly``
+CHECKS_ROLLED_UP_KEY = 'checks_rolled_up_to'
+
+def _rolled_up_to() -> Optional[float]:
+    """End of the last hour folded into hourly buckets, if any"""
+    value = get_meta(CHECKS_ROLLED_UP_KEY)
+    return float(value) if value is not None else None
+
+@timed_query
+def rollup_check_hours(until: float) -> int:
+    """Fold the raw checks of hours that ended by ``until`` and were not
+    folded before into hourly buckets.
+
+    Returns the number of buckets written.
+    """
+    closed = int(until // 3600) * 3600
+    with transaction(immediate=True) as conn:
+        start = _rolled_up_to() or 0
+        if closed <= start:
+            return 0
+        # The bare column takes its value from the row with the latest failure
+        written = conn.execute('''
+            INSERT INTO proxy_checks_hourly
+                (proxy_id, hour, checks, successes, latency_sum, latency_count, last_error_at, last_error)
+            SELECT proxy_id, hour, checks, successes, latency_sum, latency_count, last_error_at,
+                   CASE WHEN last_error_at IS NOT NULL THEN error END
+            FROM (
+                SELECT proxy_id, CAST(checked_at / 3600 AS INTEGER) * 3600 AS hour, COUNT(*) AS checks,
+                       SUM(ok) AS successes,
+                       COALESCE(SUM(CASE WHEN ok THEN latency_ms END), 0) AS latency_sum,
+                       COUNT(CASE WHEN ok THEN latency_ms END) AS latency_count,
+                       MAX(CASE WHEN NOT ok THEN checked_at END) AS last_error_at, error
+                FROM proxy_checks
+                WHERE checked_at >= ? AND checked_at < ?
+                GROUP BY 1, 2
+            )
+            WHERE true
+            ON CONFLICT (proxy_id, hour) DO UPDATE SET
+                checks = checks + excluded.checks,
+                successes = successes + excluded.successes,
+                latency_sum = latency_sum + excluded.latency_sum,
+                latency_count = latency_count + excluded.latency_count,
+                last_error_at = COALESCE(MAX(last_error_at, excluded.last_error_at), last_error_at, excluded.last_error_at),
+                last_error = CASE WHEN last_error_at IS NULL OR excluded.last_error_at >= last_error_at
+                                  THEN COALESCE(excluded.last_error, last_error) ELSE last_error END
+        ''', (start, closed)).rowcount
+        set_meta(CHECKS_ROLLED_UP_KEY, str(closed))
+        return written
+
+@timed_query
+def compact_proxy_checks(before: float, hourly_before: float) -> Tuple[int, int]:
+    """Drop raw checks older than ``before`` that are already in hourly
+    buckets, and buckets older than ``hourly_before``.
+
+    Returns the number of raw rows and buckets deleted.
+    """
+    with transaction(immediate=True) as conn:
+        before = min(before, _rolled_up_to() or 0)
+        raw = conn.execute('DELETE FROM proxy_checks WHERE checked_at < ?', (before,)).rowcount
+        hourly = conn.execute('DELETE FROM proxy_checks_hourly WHERE hour < ?', (hourly_before,)).rowcount
+        return raw, hourly
+
+@timed_query
+def rollup_proxy_checks(now: float) -> int:
+    """Recompute ``proxy_stats`` from the hourly buckets of the last 24
+    rolled-up hours and return the number of proxies it covers.
+
+    The 1-hour columns cover the last rolled-up hour; latencies are
+    averages of successful checks.
+    """
+    with transaction(immediate=True) as conn:
+        end = _rolled_up_to()
+        conn.execute('DELETE FROM proxy_stats')
+        if end is None:
+            return 0
+        # The bare column takes its value from the bucket with the latest failure
+        return conn.execute('''
+            INSERT INTO proxy_stats
+            SELECT proxy_id,
+                   COALESCE(SUM(CASE WHEN hour = :last THEN checks END), 0),
+                   CAST(SUM(CASE WHEN hour = :last THEN successes END) AS REAL)
+                       / SUM(CASE WHEN hour = :last THEN checks END),
+                   SUM(CASE WHEN hour = :last THEN latency_sum END)
+                       / NULLIF(SUM(CASE WHEN hour = :last THEN latency_count END), 0),
+                   SUM(checks),
+                   CAST(SUM(successes) AS REAL) / SUM(checks),
+                   SUM(latency_sum) / NULLIF(SUM(latency_count), 0),
+                   CASE WHEN MAX(last_error_at) IS NOT NULL THEN last_error END,
+                   :now
+            FROM proxy_checks_hourly
+            WHERE hour >= :day AND hour < :end
+            GROUP BY proxy_id
+        ''', {"last": end - 3600, "day": end - 86400, "end": end, "now": now}).rowcount
+
+@timed_query
+def get_stats_success_rates(min_checks: int) -> dict:
+    """``{proxy_id: success_rate_24h}`` for proxies with at least ``min_checks`` checks in ``proxy_stats``"""
+    return dict(get_connection().execute('''
+        SELECT proxy_id, success_rate_24h FROM proxy_stats WHERE checks_24h >= ?
+    ''', (min_checks,)).fetchall())
+
+@timed_query
+def set_history_rates(rates: dict):
+    """Store ``{proxy_id: rate}`` in ``history_rate``, resetting other proxies to 1"""
+    with transaction() as conn:
+        conn.execute('UPDATE proxies SET history_rate = 1.0 WHERE history_rate != 1.0')
+        conn.executemany(
+            'UPDATE proxies SET history_rate = ? WHERE id = ?',
+            [(rate, proxy_id) for proxy_id, rate in rates.items()]
+        )
+
+@timed_query
+def get_proxy_stats(proxy_id: int) -> Optional[dict]:
+    """Latest rollup of one proxy's check history"""
+    row = get_connection().execute('SELECT * FROM proxy_stats WHERE proxy_id = ?', (proxy_id,)).fetchone()
+    return dict(zip(PROXY_STATS_COLUMNS, row)) if row else None
+
+@timed_query
+def list_proxy_stats(worst_first: bool = True, min_checks: int = 1, limit: int = 50) -> List[dict]:
+    """Rollups ordered by 24-hour success rate, then latency"""
+    direction = "ASC" if worst_first else "DESC"
+    rows = get_connection().execute(f'''
+        SELECT * FROM proxy_stats
+        WHERE checks_24h >= ?
+        ORDER BY success_rate_24h {direction}, avg_latency_ms_24h IS NULL, avg_latency_ms_24h {direction}
+        LIMIT ?
+    ''', (min_checks, limit)).fetchall()
+    return [dict(zip(PROXY_STATS_COLUMNS, row)) for row in rows]
+
+@timed_query
+def get_recent_checks(proxy_id: int, limit: int = 20) -> List[dict]:
+    """The latest raw checks of one proxy, newest first"""
+    rows = get_connection().execute('''
+        SELECT checked_at, ok, latency_ms, error FROM proxy_checks
+        WHERE proxy_id = ?
+        ORDER BY checked_at DESC LIMIT ?
+    ''', (proxy_id, limit)).fetchall()
+    return [
+        {"checked_at": checked_at, "ok": bool(ok), "latency_ms": latency_ms, "error": error}
+        for checked_at, ok, latency_ms, error in rows
+    ]
+
+@timed_query
+def get_check_summary(since: float, proxy_id: Optional[int] = None) -> dict:
+    """Checks, success rate and median latency since ``since`` from the raw history"""
+    where = "checked_at >= :since" + (" AND proxy_id = :proxy_id" if proxy_id is not None else "")
+    params = {"since": since, "proxy_id": proxy_id}
+    conn = get_connection()
+    checks, successes = conn.execute(
+        f'SELECT COUNT(*), COALESCE(SUM(ok), 0) FROM proxy_checks WHERE {where}', params
+    ).fetchone()
+    latency = conn.execute(f'''
+        SELECT latency_ms FROM proxy_checks
+        WHERE {where} AND ok AND latency_ms IS NOT NULL
+        ORDER BY latency_ms
+        LIMIT 1 OFFSET (
+            SELECT COUNT(*) / 2 FROM proxy_checks
+            WHERE {where} AND ok AND latency_ms IS NOT NULL
+        )
+    ''', params).fetchone()
+    return {
+        "checks": checks,
+        "success_rate": successes / checks if checks else None,
+        "p50_latency_ms": latency[0] if latency else None
+    }
+
+@timed_query
+def get_hourly_checks(since: float, proxy_id: Optional[int] = None) -> List[dict]:
+    """Per-hour check counts, success rate and mean latency from the hourly
+    buckets, and from raw checks for hours not yet rolled up
+    """
+    where = " AND proxy_id = :proxy_id" if proxy_id is not None else ""
+    rows = get_connection().execute(f'''
+        SELECT hour, SUM(checks), SUM(successes),
+               SUM(latency_sum) / NULLIF(SUM(latency_count), 0)
+        FROM (
+            SELECT CAST(checked_at / 3600 AS INTEGER) * 3600 AS hour, COUNT(*) AS checks,
+                   SUM(ok) AS successes,
+                   COALESCE(SUM(CASE WHEN ok THEN latency_ms END), 0) AS latency_sum,
+                   COUNT(CASE WHEN ok THEN latency_ms END) AS latency_count
+            FROM proxy_checks
+            WHERE checked_at >= MAX(:since, :rolled){where}
+            GROUP BY 1
+            UNION ALL
+            SELECT hour, checks, successes, latency_sum, latency_count
+            FROM proxy_checks_hourly
+            WHERE hour >= :since{where}
+        )
+        GROUP BY hour
+        ORDER BY hour
+    ''', {"since": since - since % 3600, "rolled": _rolled_up_to() or 0, "proxy_id": proxy_id}).fetchall()
+    return [
+        {"hour": hour, "checks": checks, "success_rate": successes / checks, "avg_latency_ms": latency}
+        for hour, checks, successes, latency in rows
+    ]
+
+@timed_query
+def add_proxy_to_db(
+    protocol: str,
+    ip: str,
+    port: int,
+    username: Optional[str],
+    password: Optional[str],
+    country: Optional[str] = None,
+    provider: Optional[str] = None,
+    tags: Optional[str] = None
+) -> Proxy:
+    """Add a new proxy to the database and return it; ``tags`` is comma-separated"""
+    try:
+        with transaction() as conn:
+            cursor = conn.execute('''
+                INSERT INTO proxies (protocol, username, password, ip, port, country, provider, tags, source)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'api')
+            ''', (protocol, username, password, ip, port, country, provider, tags))
+            _index_tags(conn, 'id = ?', (cursor.lastrowid,))
+        return get_proxy_by_id(cursor.lastrowid)
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="Proxy already exists")
-    finally:
-        conn.close()
 
-def clear_unused_proxies() -> int:
-    """Clear all proxies that are not locked and return count of deleted entries"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            DELETE FROM proxies 
-            WHERE status != 'locked'
-        ''')
-        deleted_count = cursor.rowcount
-        conn.commit()
-        logger.info(f"Cleared {deleted_count} unused proxies from database")
-        return deleted_count
-    except Exception as e:
-        logger.error(f"Error clearing unused proxies: {e}")
-        raise HTTPException(status_code=500, detail="Failed to clear unused proxies")
-    finally:
-        conn.close()
\ No newline at end of file
+@timed_query
+def bulk_insert_proxies(rows: Iterable[Tuple]) -> int:
+    """Insert ``(protocol, username, password, ip, port, country, provider, tags)``
+    rows in one transaction.
+
+    Rows whose address is already stored are skipped. Returns the number of
+    rows inserted.
+    """
+    with transaction() as conn:
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM proxies').fetchone()[0]
+        cursor = conn.executemany('''
+            INSERT OR IGNORE INTO proxies (protocol, username, password, ip, port, country, provider, tags)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        _index_tags(conn, 'id > ?', (last_id,))
+        return cursor.rowcount
+
+@timed_query
+def get_file_proxies() -> List[Tuple]:
+    """Get ``(id, protocol, username, password, ip, port, country, provider,
+    tags, retired)`` for proxies imported from a file
+    """
+    return get_connection().execute('''
+        SELECT id, protocol, username, password, ip, port, country, provider, tags, retired
+        FROM proxies
+        WHERE source = 'file'
+    ''').fetchall()
+
+@timed_query
+def apply_proxy_diff(
+    added: List[Tuple],
+    removed_ids: List[int],
+    updated: List[Tuple],
+    revived_ids: Iterable[int] = ()
+) -> List[Proxy]:
+    """Apply an incremental file refresh in one transaction.
+
+    ``added`` holds ``(protocol, username, password, ip, port, country,
+    provider, tags)`` rows, ``updated`` holds ``(username, password,
+    country, provider, tags, id)`` changes. Removed proxies are only marked
+    retired, since a lease may still hold them; the store drops them once
+    released (see ``ProxyStore.drop_retired``). ``revived_ids`` are retired
+    proxies listed again. Returns the inserted proxies.
+    """
+    with transaction(immediate=True) as conn:
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM proxies').fetchone()[0]
+        conn.executemany('''
+            UPDATE proxies SET retired = 1 WHERE id = ?
+        ''', [(proxy_id,) for proxy_id in removed_ids])
+        conn.executemany('''
+            UPDATE proxies SET retired = 0 WHERE id = ?
+        ''', [(proxy_id,) for proxy_id in revived_ids])
+        conn.executemany('''
+            UPDATE proxies SET username = ?, password = ?, country = ?, provider = ?, tags = ? WHERE id = ?
+        ''', updated)
+        conn.executemany('''
+            DELETE FROM proxy_tags WHERE proxy_id = ?
+        ''', [(row[-1],) for row in updated])
+        for row in updated:
+            _index_tags(conn, 'id = ?', (row[-1],))
+        conn.executemany('''
+            INSERT OR IGNORE INTO proxies (protocol, username, password, ip, port, country, provider, tags)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', added)
+        _index_tags(conn, 'id > ?', (last_id,))
+        return proxy_cursor(conn).execute(f'SELECT {PROXY_COLUMNS} FROM proxies WHERE id > ?', (last_id,)).fetchall()
+
+@timed_query
+def get_retired_proxy_ids() -> List[int]:
+    """IDs of proxies a refresh removed that are still in the table"""
+    cursor = get_connection().execute('SELECT id FROM proxies WHERE retired = 1')
+    return [row[0] for row in cursor.fetchall()]
+
+@timed_query
+def delete_proxies(proxy_ids: List[int]):
+    """Delete proxies by ID"""
+    with transaction() as conn:
+        conn.executemany('DELETE FROM proxies WHERE id = ?', [(proxy_id,) for proxy_id in proxy_ids])
+
+@timed_query
+def delete_retired_proxies() -> int:
+    """Delete retired proxies that no unexpired lease holds and return their count"""
+    with transaction(immediate=True) as conn:
+        _reclaim_expired_leases(conn, time.time())
+        return conn.execute(
+            "DELETE FROM proxies WHERE retired = 1 AND status != 'locked'"
+        ).rowcount
+
+@timed_query
+def heartbeat_worker(worker_id: str):
+    """Record that a worker process is alive"""
+    get_connection().execute('''
+        INSERT INTO workers (id, heartbeat_at) VALUES (?, ?)
+        ON CONFLICT (id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+    ''', (worker_id, time.time()))
+
+@timed_query
+def remove_worker(worker_id: str):
+    """Forget a worker that is shutting down"""
+    get_connection().execute('DELETE FROM workers WHERE id = ?', (worker_id,))
+
+@timed_query
+def count_live_workers(max_age: float, exclude: Optional[str] = None) -> int:
+    """Number of workers that sent a heartbeat in the last ``max_age`` seconds"""
+    cursor = get_connection().execute('''
+        SELECT COUNT(*) FROM workers
+        WHERE heartbeat_at > ? AND id != ?
+    ''', (time.time() - max_age, exclude or ''))
+    return cursor.fetchone()[0]
+
+@timed_query
+def acquire_lock(name: str, owner: str, ttl: float) -> bool:
+    """Take or renew the named lock for ``ttl`` seconds.
+
+    Succeeds if the lock is free, expired or already held by ``owner``.
+    """
+    now = time.time()
+    cursor = get_connection().execute('''
+        INSERT INTO locks (name, owner, expires_at) VALUES (?, ?, ?)
+        ON CONFLICT (name) DO UPDATE
+        SET owner = excluded.owner, expires_at = excluded.expires_at
+        WHERE locks.owner = excluded.owner OR locks.expires_at <= ?
+    ''', (name, owner, now + ttl, now))
+    return cursor.rowcount == 1
+
+@timed_query
+def release_lock(name: str, owner: str):
+    """Give up the named lock if ``owner`` holds it"""
+    get_connection().execute('''
+        DELETE FROM locks WHERE name = ? AND owner = ?
+    ''', (name, owner))
+
+def _job_dict(row) -> dict:
+    job = dict(zip(JOB_COLUMNS, row))
+    for key in ("params", "result"):
+        if job[key] is not None:
+            job[key] = json.loads(job[key])
+    return job
+
+@timed_query
+def insert_job(job_id: str, kind: str, params: dict, created_at: float):
+    """Record a queued background job"""
+    get_connection().execute('''
+        INSERT INTO jobs (id, kind, status, params, created_at) VALUES (?, ?, 'queued', ?, ?)
+    ''', (job_id, kind, json.dumps(params), created_at))
+
+@timed_query
+def start_job(job_id: str, started_at: float):
+    """Mark a job as running"""
+    get_connection().execute('''
+        UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?
+    ''', (started_at, job_id))
+
+@timed_query
+def finish_job(job_id: str, status: str, result: Optional[dict], error: Optional[str], finished_at: float):
+    """Store a job's outcome"""
+    get_connection().execute('''
+        UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?
+    ''', (status, None if result is None else json.dumps(result), error, finished_at, job_id))
+
+@timed_query
+def get_job(job_id: str) -> Optional[dict]:
+    """Get a job by its ID"""
+    row = get_connection().execute(
+        f'SELECT {", ".join(JOB_COLUMNS)} FROM jobs WHERE id = ?', (job_id,)
+    ).fetchone()
+    return _job_dict(row) if row else None
+
+@timed_query
+def list_jobs(kind: Optional[str] = None, limit: int = 20) -> List[dict]:
+    """The latest jobs, newest first"""
+    where = "WHERE kind = ?" if kind is not None else ""
+    params = ((kind,) if kind is not None else ()) + (limit,)
+    rows = get_connection().execute(
+        f'SELECT {", ".join(JOB_COLUMNS)} FROM jobs {where} ORDER BY created_at DESC LIMIT ?', params
+    ).fetchall()
+    return [_job_dict(row) for row in rows]
+
+@timed_query
+def prune_jobs(before: float) -> int:
+    """Delete jobs finished before ``before`` and return how many there were"""
+    cursor = get_connection().execute('''
+        DELETE FROM jobs WHERE finished_at < ?
+    ''', (before,))
+    return cursor.rowcount
+
+@timed_query
+def fail_unfinished_jobs(error: str, finished_at: float) -> int:
+    """Mark queued and running jobs as failed, e.g. after every worker restarted"""
+    cursor = get_connection().execute('''
+        UPDATE jobs SET status = 'failed', error = ?, finished_at = ?
+        WHERE status IN ('queued', 'running')
+    ''', (error, finished_at))
+    return cursor.rowcount
@@ -0,0 +1,28 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar
+
+T = TypeVar("T")
+
+# Threads running blocking database, Redis and file work for the event loop;
+# bounded so a burst of slow calls queues up instead of piling threads onto SQLite
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "8"))
+
+executor = ThreadPoolExecutor(BLOCKING_WORKERS, thread_name_prefix="proxy-api-blocking")
+
+def shutdown_executor():
+    """Wait for running blocking calls to finish and stop their threads.
+
+    A fresh executor takes over, so an app started again in the same
+    process, as in tests, can still run blocking calls.
+    """
+    global executor
+    stopped, executor = executor, ThreadPoolExecutor(BLOCKING_WORKERS, thread_name_prefix="proxy-api-blocking")
+    stopped.shutdown(wait=True)
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking call on the shared executor without stalling the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pydantic import BaseModel, Field
+
+from . import history, metrics
+from .background import next_check_delay
+from .database import schedule_checks
+from .executor import run_blocking
+from .pool import pool
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failed reports after which a proxy is quarantined (made
+# inactive until a health check passes); bans quarantine at once
+FEEDBACK_FAIL_THRESHOLD = int(os.getenv("FEEDBACK_FAIL_THRESHOLD", "3"))
+# HTTP statuses seen through a proxy that count as its failure
+FEEDBACK_FAILURE_STATUSES = {
+    int(status) for status in os.getenv("FEEDBACK_FAILURE_STATUSES", "403,407,429,502,503,504").split(",")
+    if status.strip()
+}
+# Seconds between applying buffered reports
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "1"))
+
+class ProxyReport(BaseModel):
+    """How a proxy fared for the client handing it back to /unlock_proxies.
+
+    Only ``id`` is required; a report without ``ok``, ``status``, ``error``
+    or ``banned`` just unlocks the proxy.
+    """
+    id: int
+    ok: Optional[bool] = None
+    latency_ms: Optional[float] = Field(None, ge=0)
+    # HTTP status the client got through the proxy
+    status: Optional[int] = None
+    error: Optional[str] = Field(None, max_length=100)
+    banned: bool = False
+
+    def outcome(self) -> Optional[bool]:
+        """Whether the proxy worked, or None when nothing was reported"""
+        if self.banned or self.error is not None:
+            return False
+        if self.ok is not None:
+            return self.ok
+        if self.status is not None:
+            return self.status not in FEEDBACK_FAILURE_STATUSES
+        return None
+
+    def error_class(self) -> Optional[str]:
+        if self.banned:
+            return "banned"
+        if self.error is not None:
+            return self.error
+        if self.status is not None and self.status in FEEDBACK_FAILURE_STATUSES:
+            return f"HTTP {self.status}"
+        return None
+
+class FeedbackBuffer:
+    """Outcome reports waiting to be folded into the pool.
+
+    Reports from every request are applied together every
+    ``FEEDBACK_FLUSH_INTERVAL`` seconds: failures raise ``fail_count`` and
+    lower the success rate like failed checks, but only quarantine a proxy
+    after ``FEEDBACK_FAIL_THRESHOLD`` in a row, since one failed request
+    may be the target's fault. Successes postpone the proxy's next health
+    check, so proxies in steady use are hardly probed at all.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reports: List[Tuple[ProxyReport, bool, float]] = []
+
+    def add(self, reports: Iterable[ProxyReport]):
+        now = time.time()
+        pending = []
+        for report in reports:
+            ok = report.outcome()
+            if ok is None:
+                continue
+            metrics.FEEDBACK_REPORTS.inc(1, "banned" if report.banned else "ok" if ok else "failed")
+            pending.append((report, ok, now))
+        if pending:
+            with self._lock:
+                self._reports.extend(pending)
+
+    def take(self) -> List[Tuple[ProxyReport, bool, float]]:
+        with self._lock:
+            reports, self._reports = self._reports, []
+        return reports
+
+    def flush(self) -> int:
+        """Apply buffered reports and return how many there were"""
+        reports = self.take()
+        if not reports:
+            return 0
+        results, bans, checks = [], [], []
+        schedule: Dict[int, float] = {}
+        failed = set()
+        for report, ok, reported_at in reports:
+            latency_ms = report.latency_ms if ok else None
+            (bans if report.banned else results).append((report.id, ok, latency_ms))
+            checks.append((report.id, reported_at, int(ok), latency_ms, report.error_class()))
+            if ok:
+                schedule[report.id] = reported_at + next_check_delay(True, 0)
+            else:
+                failed.add(report.id)
+        pool.record_checks(results, FEEDBACK_FAIL_THRESHOLD)
+        pool.record_checks(bans)
+        try:
+            history.record(checks)
+        except Exception as e:
+            logger.error(f"Error recording reported outcomes: {e}")
+        # Quarantined proxies are retried on the health check back-off
+        now = time.time()
+        for proxy_id in failed:
+            proxy = pool.get(proxy_id)
+            if proxy is not None and proxy.status == "inactive":
+                schedule[proxy_id] = now + next_check_delay(False, proxy.fail_count)
+        if schedule:
+            schedule_checks([(next_at, proxy_id) for proxy_id, next_at in schedule.items()])
+        return len(reports)
+
+    async def run(self, interval: float = FEEDBACK_FLUSH_INTERVAL):
+        """Background task applying reports every ``interval`` seconds"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_blocking(self.flush)
+            except Exception as e:
+                logger.error(f"Error applying proxy reports: {e}")
+
+feedback = FeedbackBuffer()
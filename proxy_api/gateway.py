@@ -0,0 +1,778 @@
+import asyncio
+import base64
+import binascii
+import ipaddress
+import logging
+import os
+import secrets
+import socket
+import ssl
+import struct
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from . import metrics
+from .background import CheckBatch, error_class
+from .clients import clients
+from .database import init_db
+from .executor import run_blocking
+from .feedback import FEEDBACK_FAIL_THRESHOLD
+from .pool import pool
+from .records import Proxy
+
+logger = logging.getLogger(__name__)
+
+# Address of the forwarding gateway started next to the API; port 0 leaves it off
+GATEWAY_HOST = os.getenv("GATEWAY_HOST", "127.0.0.1")
+GATEWAY_PORT = int(os.getenv("GATEWAY_PORT", "0"))
+# Seconds allowed to reach an upstream proxy and complete its handshake
+GATEWAY_CONNECT_TIMEOUT = float(os.getenv("GATEWAY_CONNECT_TIMEOUT", "10"))
+# Upstream proxies tried for one request before answering 502
+GATEWAY_MAX_ATTEMPTS = int(os.getenv("GATEWAY_MAX_ATTEMPTS", "3"))
+# Idle keep-alive connections kept per upstream proxy, and for how many seconds
+GATEWAY_POOL_SIZE = int(os.getenv("GATEWAY_POOL_SIZE", "8"))
+GATEWAY_POOL_IDLE = float(os.getenv("GATEWAY_POOL_IDLE", "30"))
+# Seconds a sticky session keeps its proxy after its last request
+GATEWAY_SESSION_TTL = float(os.getenv("GATEWAY_SESSION_TTL", "600"))
+# Seconds between refreshes of the available proxies the gateway rotates over
+GATEWAY_REFRESH_INTERVAL = float(os.getenv("GATEWAY_REFRESH_INTERVAL", "5"))
+# Seconds a splice waits for bytes a stream may still hold before taking over
+# its transport; the wait only runs out when nothing is buffered
+SPLICE_DRAIN_WAIT = 0.001
+
+# Upstream schemes the gateway can speak; socks5 and socks4 let the proxy resolve names
+SUPPORTED_PROTOCOLS = ("http", "https", "socks5", "socks5h", "socks4", "socks4a")
+# Longest request or response head accepted
+HEAD_LIMIT = 64 * 1024
+COPY_CHUNK = 64 * 1024
+# Headers that only concern a single hop and are never forwarded
+HOP_HEADERS = {"connection", "keep-alive", "proxy-authorization", "proxy-connection", "upgrade"}
+# Usernames that ask for a fresh proxy on every request instead of a sticky session
+ROTATING_SESSIONS = {"", "rotate"}
+
+class ProxyFailure(Exception):
+    """The upstream proxy itself could not be used"""
+
+class TargetFailure(Exception):
+    """The upstream proxy worked but could not reach the target"""
+
+class Head:
+    """Start line and headers of an HTTP/1.x message"""
+    __slots__ = ("start", "headers")
+
+    def __init__(self, start: List[str], headers: List[Tuple[str, str]]):
+        self.start = start
+        self.headers = headers
+
+    @classmethod
+    def parse(cls, data: bytes) -> "Head":
+        lines = data.decode("latin-1").split("\r\n")
+        start = lines[0].split(" ", 2)
+        headers = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep:
+                raise ValueError(f"Malformed header line {line!r}")
+            headers.append((name.strip(), value.strip()))
+        return cls(start, headers)
+
+    def get(self, name: str) -> Optional[str]:
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def tokens(self, name: str) -> Set[str]:
+        """Lowercased comma-separated values of every ``name`` header"""
+        return {
+            token.strip().lower()
+            for key, value in self.headers if key.lower() == name
+            for token in value.split(",") if token.strip()
+        }
+
+    def encode(self, start: str, extra: List[Tuple[str, str]] = ()) -> bytes:
+        """Serialize with ``start`` as start line, dropping hop-by-hop headers"""
+        lines = [start]
+        lines.extend(f"{key}: {value}" for key, value in self.headers if key.lower() not in HOP_HEADERS)
+        lines.extend(f"{key}: {value}" for key, value in extra)
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+async def read_head(reader: asyncio.StreamReader) -> Optional[Head]:
+    """Read the next message head, or None when the peer closed between messages"""
+    try:
+        data = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise
+    return Head.parse(data[:-4])
+
+def body_length(head: Head, method: Optional[str] = None, status: Optional[int] = None):
+    """How a message body is delimited: a byte count, ``"chunked"``, or
+    ``None`` when it runs until the connection closes
+    """
+    if status is not None and (method == "HEAD" or 100 <= status < 200 or status in (204, 304)):
+        return 0
+    if "chunked" in head.tokens("transfer-encoding"):
+        return "chunked"
+    length = head.get("content-length")
+    if length is not None:
+        return int(length)
+    # Requests without a length have no body; responses run until close
+    return 0 if status is None else None
+
+async def copy_body(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, length) -> bool:
+    """Relay a message body; returns whether it was delimited, so the
+    connection it came from can carry another message
+    """
+    if length == "chunked":
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            writer.write(line)
+            size = int(line.split(b";", 1)[0], 16)
+            if size == 0:
+                # Trailers up to the final empty line
+                while True:
+                    line = await reader.readuntil(b"\r\n")
+                    writer.write(line)
+                    if line == b"\r\n":
+                        break
+                await writer.drain()
+                return True
+            remaining = size + 2
+            while remaining:
+                data = await reader.readexactly(min(remaining, COPY_CHUNK))
+                writer.write(data)
+                remaining -= len(data)
+                await writer.drain()
+    if length is None:
+        while True:
+            data = await reader.read(COPY_CHUNK)
+            if not data:
+                return False
+            writer.write(data)
+            await writer.drain()
+    remaining = length
+    while remaining:
+        data = await reader.read(min(remaining, COPY_CHUNK))
+        if not data:
+            raise asyncio.IncompleteReadError(b"", remaining)
+        writer.write(data)
+        remaining -= len(data)
+        await writer.drain()
+    return True
+
+def _authority(host: str, port: int) -> str:
+    return f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+
+def _pool_key(proxy: Proxy, host: str, port: int) -> Tuple:
+    """Idle-pool key: HTTP proxies forward to any target, SOCKS tunnels to one"""
+    return (proxy.id, None) if proxy.protocol in ("http", "https") else (proxy.id, host, port)
+
+def _basic_auth(username: str, password: str) -> str:
+    return "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()
+
+class _Pipe(asyncio.Protocol):
+    """Forwards whatever one transport receives straight to its peer"""
+
+    def __init__(self, splice: "_Splice", peer: asyncio.Transport):
+        self.splice = splice
+        self.peer = peer
+
+    def data_received(self, data: bytes):
+        self.peer.write(data)
+
+    def eof_received(self):
+        self.splice.half_closed(self.peer)
+        return True
+
+    def connection_lost(self, exc):
+        self.splice.close()
+
+    def pause_writing(self):
+        # Our transport's buffer is full: stop reading from the one filling it
+        self.peer.pause_reading()
+
+    def resume_writing(self):
+        self.peer.resume_reading()
+
+async def _buffered(reader: asyncio.StreamReader, transport: asyncio.Transport) -> bytes:
+    """Bytes ``reader`` received but nobody read yet, leaving ``transport`` paused"""
+    chunks = []
+    while True:
+        # Reading may resume a transport the reader paused when its buffer filled
+        transport.pause_reading()
+        try:
+            data = await asyncio.wait_for(reader.read(COPY_CHUNK), SPLICE_DRAIN_WAIT)
+        except asyncio.TimeoutError:
+            break
+        if not data:
+            break
+        chunks.append(data)
+    transport.pause_reading()
+    return b"".join(chunks)
+
+class _Splice:
+    """Joins two connections so bytes flow between their transports directly.
+
+    Data received on one side is written to the other from the protocol
+    callback, without passing through ``StreamReader`` buffers or a copy
+    loop, and each side's write buffer pauses reading on the other.
+    """
+
+    def __init__(self, a: Tuple[asyncio.StreamReader, asyncio.StreamWriter],
+                 b: Tuple[asyncio.StreamReader, asyncio.StreamWriter]):
+        self.readers = (a[0], b[0])
+        self.transports = (a[1].transport, b[1].transport)
+        self.eofs = 0
+        self.done = asyncio.get_running_loop().create_future()
+
+    async def run(self):
+        """Hand both transports over to the splice and wait until it closes"""
+        pending = await asyncio.gather(*(
+            _buffered(reader, transport) for reader, transport in zip(self.readers, self.transports)
+        ))
+        for reader, transport, peer, data in zip(self.readers, self.transports, self.transports[::-1], pending):
+            if data:
+                peer.write(data)
+            transport.set_protocol(_Pipe(self, peer))
+            if transport.is_closing():
+                self.close()
+            elif reader.at_eof():
+                self.half_closed(peer)
+            else:
+                transport.resume_reading()
+        await self.done
+
+    def half_closed(self, peer: asyncio.Transport):
+        self.eofs += 1
+        if self.eofs == 2 or not peer.can_write_eof():
+            self.close()
+        else:
+            peer.write_eof()
+
+    def close(self):
+        for transport in self.transports:
+            transport.close()
+        if not self.done.done():
+            self.done.set_result(None)
+
+class Rotation:
+    """Available proxies the gateway spreads requests over.
+
+    The list is a periodic snapshot of the pool's available proxies; the
+    gateway shares them rather than leasing them, so API clients and the
+    gateway draw from the same pool. Sticky sessions pin a proxy until
+    they go ``GATEWAY_SESSION_TTL`` seconds unused or it fails.
+    """
+
+    def __init__(self):
+        self.proxies: List[Proxy] = []
+        self.by_id: Dict[int, Proxy] = {}
+        self.dropped: Set[int] = set()
+        self.sessions: Dict[str, Tuple[int, float]] = {}
+        self._next = 0
+
+    def refresh(self, proxies: List[Proxy]):
+        self.proxies = [proxy for proxy in proxies if proxy.protocol in SUPPORTED_PROTOCOLS]
+        self.by_id = {proxy.id: proxy for proxy in self.proxies}
+        self.dropped = set()
+        cutoff = time.monotonic() - GATEWAY_SESSION_TTL
+        self.sessions = {
+            session: pinned for session, pinned in self.sessions.items()
+            if pinned[1] >= cutoff and pinned[0] in self.by_id
+        }
+
+    def pick(self, session: Optional[str] = None, exclude: Set[int] = frozenset()) -> Optional[Proxy]:
+        now = time.monotonic()
+        if session is not None:
+            pinned = self.sessions.get(session)
+            if pinned is not None and now - pinned[1] < GATEWAY_SESSION_TTL:
+                proxy = self.by_id.get(pinned[0])
+                if proxy is not None and proxy.id not in self.dropped and proxy.id not in exclude:
+                    self.sessions[session] = (proxy.id, now)
+                    return proxy
+        for _ in range(len(self.proxies)):
+            proxy = self.proxies[self._next % len(self.proxies)]
+            self._next += 1
+            if proxy.id not in self.dropped and proxy.id not in exclude:
+                if session is not None:
+                    self.sessions[session] = (proxy.id, now)
+                return proxy
+        return None
+
+    def drop(self, proxy_id: int):
+        """Stop using a proxy that failed until the pool reports it available again"""
+        self.dropped.add(proxy_id)
+
+class UpstreamPool:
+    """Idle keep-alive connections to upstream proxies, most recent first.
+
+    Connections to HTTP proxies can carry requests for any target and are
+    keyed by proxy; SOCKS tunnels are keyed by proxy and target.
+    """
+
+    def __init__(self):
+        self.idle: Dict[Tuple, List[Tuple[asyncio.StreamReader, asyncio.StreamWriter, float]]] = {}
+
+    def get(self, key: Tuple) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]:
+        connections = self.idle.get(key)
+        while connections:
+            reader, writer, since = connections.pop()
+            if time.monotonic() - since < GATEWAY_POOL_IDLE and not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    def put(self, key: Tuple, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connections = self.idle.setdefault(key, [])
+        if len(connections) >= GATEWAY_POOL_SIZE or writer.is_closing():
+            writer.close()
+            return
+        connections.append((reader, writer, time.monotonic()))
+
+    def prune(self):
+        cutoff = time.monotonic() - GATEWAY_POOL_IDLE
+        for key in list(self.idle):
+            kept = []
+            for reader, writer, since in self.idle[key]:
+                if since >= cutoff and not writer.is_closing() and not reader.at_eof():
+                    kept.append((reader, writer, since))
+                else:
+                    writer.close()
+            if kept:
+                self.idle[key] = kept
+            else:
+                del self.idle[key]
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer, _ in connections:
+                writer.close()
+        self.idle.clear()
+
+async def _socks5_handshake(reader, writer, proxy: Proxy, host: str, port: int):
+    credentials = proxy.username is not None and proxy.password is not None
+    writer.write(b"\x05\x02\x00\x02" if credentials else b"\x05\x01\x00")
+    _, method = await reader.readexactly(2)
+    if method == 2 and credentials:
+        username, password = proxy.username.encode(), proxy.password.encode()
+        writer.write(b"\x01" + bytes([len(username)]) + username + bytes([len(password)]) + password)
+        _, status = await reader.readexactly(2)
+        if status != 0:
+            raise ProxyFailure("SOCKS authentication failed")
+    elif method != 0:
+        raise ProxyFailure("SOCKS method rejected")
+    try:
+        address = ipaddress.ip_address(host)
+        target = (b"\x01" if address.version == 4 else b"\x04") + address.packed
+    except ValueError:
+        name = host.encode("idna")
+        target = b"\x03" + bytes([len(name)]) + name
+    writer.write(b"\x05\x01\x00" + target + struct.pack("!H", port))
+    _, reply, _, address_type = await reader.readexactly(4)
+    if reply == 0:
+        length = {1: 4, 4: 16}.get(address_type)
+        if length is None:
+            length = (await reader.readexactly(1))[0]
+        await reader.readexactly(length + 2)
+        return
+    # Network or host unreachable, connection refused and TTL expired concern the target
+    if reply in (3, 4, 5, 6):
+        raise TargetFailure(f"SOCKS reply {reply}")
+    raise ProxyFailure(f"SOCKS reply {reply}")
+
+async def _socks4_handshake(reader, writer, proxy: Proxy, host: str, port: int):
+    try:
+        address, name = ipaddress.IPv4Address(host).packed, b""
+    except ValueError:
+        # SOCKS4a: an invalid address followed by the name for the proxy to resolve
+        address, name = b"\x00\x00\x00\x01", host.encode("idna") + b"\x00"
+    user = (proxy.username or "").encode() + b"\x00"
+    writer.write(struct.pack("!BBH", 4, 1, port) + address + user + name)
+    reply = (await reader.readexactly(8))[1]
+    if reply == 0x5B:
+        raise TargetFailure("SOCKS4 request rejected")
+    if reply != 0x5A:
+        raise ProxyFailure(f"SOCKS4 reply {reply}")
+
+async def _connect_handshake(reader, writer, proxy: Proxy, host: str, port: int):
+    authority = _authority(host, port)
+    lines = [f"CONNECT {authority} HTTP/1.1", f"Host: {authority}"]
+    if proxy.username is not None and proxy.password is not None:
+        lines.append(f"Proxy-Authorization: {_basic_auth(proxy.username, proxy.password)}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    head = await read_head(reader)
+    if head is None:
+        raise ProxyFailure("Connection closed")
+    if len(head.start) < 2 or not head.start[1].isdigit():
+        raise ProxyFailure("Malformed reply")
+    status = int(head.start[1])
+    if status == 200:
+        return
+    # Refusals of the target, e.g. a 403 for a blocked host, would be the
+    # same through any proxy; a 407 is about this proxy's credentials
+    if status in (502, 504) or (400 <= status < 500 and status != 407):
+        raise TargetFailure(f"HTTP {status}")
+    raise ProxyFailure(f"HTTP {status}")
+
+class Gateway:
+    """Local forwarding proxy that sends each request through a pool proxy.
+
+    Clients point their HTTP(S) proxy setting at the gateway and
+    authenticate with any username and an API key as password. The
+    username names a sticky session whose requests keep using one proxy;
+    ``rotate`` or an empty username picks the next proxy per request.
+
+    CONNECT requests are tunnelled through HTTP or SOCKS upstreams and then
+    spliced transport to transport. Plain HTTP requests are forwarded with
+    HTTP/1.1 framing, so connections to upstream proxies are kept alive and
+    reused. The outcome of reaching each upstream is fed to the pool, the
+    check history and the check schedule like a background check, so
+    proxies failing real traffic are taken out of rotation at once.
+    """
+
+    def __init__(self, api_key: Optional[str] = None):
+        # Any configured API key is accepted unless one is given
+        self.api_key = api_key
+        self.rotation = Rotation()
+        self.upstreams = UpstreamPool()
+        # Real traffic fails for the target's reasons too; quarantine like client reports
+        self.outcomes = CheckBatch(FEEDBACK_FAIL_THRESHOLD)
+        self.server: Optional[asyncio.AbstractServer] = None
+        self._ssl = ssl.create_default_context()
+        self._tasks: List[asyncio.Task] = []
+        self._clients: Set[asyncio.Task] = set()
+
+    async def start(self, host: str = GATEWAY_HOST, port: int = GATEWAY_PORT, reuse_port: bool = False):
+        await self.refresh()
+        self.server = await asyncio.start_server(
+            self._serve, host, port, limit=HEAD_LIMIT,
+            reuse_port=(reuse_port and hasattr(socket, "SO_REUSEPORT")) or None
+        )
+        self._tasks.append(asyncio.create_task(self._maintain()))
+        logger.info(f"Gateway listening on {_authority(host, self.port)} with {len(self.rotation.proxies)} proxies")
+
+    @property
+    def port(self) -> Optional[int]:
+        return self.server.sockets[0].getsockname()[1] if self.server else None
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+        for task in self._tasks + list(self._clients):
+            task.cancel()
+        self.upstreams.close()
+        await self.flush()
+
+    async def refresh(self):
+        proxies = await run_blocking(lambda: list(pool.iter_rows("available")))
+        self.rotation.refresh(proxies)
+
+    async def flush(self):
+        if self.outcomes.results:
+            batch = self.outcomes.take()
+            await run_blocking(batch.apply)
+
+    async def _maintain(self):
+        """Refresh the rotation, prune idle upstreams and apply outcomes"""
+        last_refresh = time.monotonic()
+        while True:
+            await asyncio.sleep(1)
+            try:
+                if self.outcomes.due():
+                    await self.flush()
+                self.upstreams.prune()
+                if time.monotonic() - last_refresh >= GATEWAY_REFRESH_INTERVAL:
+                    last_refresh = time.monotonic()
+                    await self.refresh()
+            except Exception as e:
+                logger.error(f"Gateway maintenance failed: {e}")
+
+    def _record(self, proxy: Proxy, ok: bool, latency_ms: Optional[float] = None, error: Optional[str] = None):
+        self.outcomes.add(proxy, ok, latency_ms, error)
+        metrics.GATEWAY_UPSTREAMS.inc(1, "ok" if ok else "failed")
+        if not ok:
+            logger.debug(f"Gateway: Proxy {proxy.id} failed: {error}")
+            self.rotation.drop(proxy.id)
+
+    async def _open(self, proxy: Proxy, host: str, port: int, tunnel: bool):
+        """Connect to an upstream proxy, tunnelling to ``host:port`` when
+        ``tunnel`` is set or the proxy only speaks SOCKS.
+
+        Returns the connection and how long opening it took in milliseconds;
+        failures are recorded here, success is left to the caller.
+        """
+        started = time.perf_counter()
+        try:
+            opened = await asyncio.wait_for(self._connect(proxy, host, port, tunnel), GATEWAY_CONNECT_TIMEOUT)
+        except ProxyFailure as e:
+            self._record(proxy, False, error=str(e))
+            raise
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            self._record(proxy, False, error=error_class(e))
+            raise ProxyFailure(error_class(e)) from e
+        return opened, (time.perf_counter() - started) * 1000
+
+    async def _connect(self, proxy: Proxy, host: str, port: int, tunnel: bool):
+        reader, writer = await asyncio.open_connection(
+            proxy.ip, proxy.port, limit=HEAD_LIMIT,
+            ssl=self._ssl if proxy.protocol == "https" else None
+        )
+        try:
+            if proxy.protocol.startswith("socks5"):
+                await _socks5_handshake(reader, writer, proxy, host, port)
+            elif proxy.protocol.startswith("socks4"):
+                await _socks4_handshake(reader, writer, proxy, host, port)
+            elif tunnel:
+                await _connect_handshake(reader, writer, proxy, host, port)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            while True:
+                head = await read_head(reader)
+                if head is None or not await self._handle(head, reader, writer):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError) as e:
+            logger.debug(f"Gateway: client connection ended: {e!r}")
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    def _session(self, head: Head) -> Tuple[bool, Optional[str]]:
+        """Check the client's credentials; returns whether they are valid and its session"""
+        value = head.get("proxy-authorization") or ""
+        scheme, _, encoded = value.partition(" ")
+        if scheme.lower() != "basic":
+            return False, None
+        try:
+            username, _, password = base64.b64decode(encoded.strip()).decode("latin-1").partition(":")
+        except (binascii.Error, ValueError):
+            return False, None
+        if self.api_key is not None:
+            if not secrets.compare_digest(password.encode("latin-1"), self.api_key.encode("latin-1")):
+                return False, None
+            client = "default"
+        else:
+            found = clients.authenticate(password)
+            if found is None:
+                return False, None
+            client = found.name
+        # Clients with different keys never share a session
+        return True, None if username in ROTATING_SESSIONS else f"{client}:{username}"
+
+    async def _handle(self, head: Head, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Serve one request; returns whether the client connection stays open"""
+        if len(head.start) != 3:
+            await _respond(writer, 400, "Bad Request")
+            return False
+        method, target, version = head.start
+        authorized, session = self._session(head)
+        if not authorized:
+            await _respond(writer, 407, "Proxy Authentication Required",
+                           [("Proxy-Authenticate", 'Basic realm="proxy_api"')])
+            return False
+        if method == "CONNECT":
+            metrics.GATEWAY_REQUESTS.inc(1, "connect")
+            await self._tunnel(target, reader, writer, session)
+            return False
+        metrics.GATEWAY_REQUESTS.inc(1, "http")
+        return await self._forward(head, reader, writer, session)
+
+    async def _attempts(self, writer: asyncio.StreamWriter, session: Optional[str], host: str, port: int,
+                        tunnel: bool, first: Optional[Proxy] = None):
+        """Open an upstream through up to ``GATEWAY_MAX_ATTEMPTS`` proxies,
+        starting with ``first`` when given.
+
+        Returns the proxy, its connection and the time opening it took, or
+        None after answering the client with an error.
+        """
+        tried: Set[int] = set()
+        while len(tried) < GATEWAY_MAX_ATTEMPTS:
+            proxy = first if first is not None and not tried else self.rotation.pick(session, tried)
+            if proxy is None:
+                break
+            tried.add(proxy.id)
+            try:
+                return (proxy, *await self._open(proxy, host, port, tunnel))
+            except ProxyFailure:
+                continue
+            except TargetFailure as e:
+                await _respond(writer, 502, "Bad Gateway", body=f"Target unreachable: {e}\n".encode())
+                return None
+        if not tried:
+            await _respond(writer, 503, "Service Unavailable", body=b"No available proxies\n")
+        else:
+            await _respond(writer, 502, "Bad Gateway", body=f"{len(tried)} upstream proxies failed\n".encode())
+        return None
+
+    async def _tunnel(self, target: str, reader, writer, session: Optional[str]):
+        host, _, port = target.rpartition(":")
+        host = host.strip("[]")
+        if not host or not port.isdigit() or not 0 < int(port) < 65536:
+            await _respond(writer, 400, "Bad Request")
+            return
+        opened = await self._attempts(writer, session, host, int(port), tunnel=True)
+        if opened is None:
+            return
+        proxy, upstream, latency_ms = opened
+        self._record(proxy, True, latency_ms)
+        writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n")
+        await _Splice((reader, writer), upstream).run()
+
+    async def _forward(self, head: Head, reader, writer, session: Optional[str]) -> bool:
+        method, target, version = head.start
+        url = urlsplit(target)
+        if url.scheme != "http" or not url.hostname:
+            await _respond(writer, 400, "Bad Request", body=b"Send absolute http:// URLs, or CONNECT for https\n")
+            return False
+        try:
+            port = url.port
+        except ValueError:
+            port = 0
+        if port == 0:
+            await _respond(writer, 400, "Bad Request", body=b"Invalid port\n")
+            return False
+        host, port = url.hostname, port or 80
+        connection = head.tokens("connection")
+        keep_alive = "close" not in connection if version == "HTTP/1.1" else "keep-alive" in connection
+        upgrade = "upgrade" in connection and head.get("upgrade")
+        request_length = body_length(head)
+
+        proxy = self.rotation.pick(session)
+        if proxy is None:
+            await _respond(writer, 503, "Service Unavailable", body=b"No available proxies\n")
+            return False
+        opened = self.upstreams.get(_pool_key(proxy, host, port))
+        if opened is not None:
+            metrics.GATEWAY_UPSTREAM_REUSED.inc()
+        response = None
+        attempts = 0
+        while response is None:
+            fresh = opened is None
+            if fresh:
+                attempts += 1
+                attempt = await self._attempts(writer, session, host, port, tunnel=False, first=proxy)
+                if attempt is None:
+                    return False
+                proxy, opened, latency_ms = attempt
+            key = _pool_key(proxy, host, port)
+            up_reader, up_writer = opened
+            extra = [("Connection", "Upgrade"), ("Upgrade", upgrade)] if upgrade else [("Connection", "keep-alive")]
+            if key[1] is None:
+                # HTTP proxies take the absolute URL and their own credentials
+                start = f"{method} {target} HTTP/1.1"
+                if proxy.username is not None and proxy.password is not None:
+                    extra.append(("Proxy-Authorization", _basic_auth(proxy.username, proxy.password)))
+            else:
+                path = url.path or "/"
+                start = f"{method} {path}?{url.query} HTTP/1.1" if url.query else f"{method} {path} HTTP/1.1"
+            try:
+                up_writer.write(head.encode(start, extra))
+                await copy_body(reader, up_writer, request_length)
+                response = await read_head(up_reader)
+                while response is not None and response.start[1].startswith("1") and response.start[1] != "101":
+                    # Interim responses such as 100 Continue
+                    writer.write(response.encode(" ".join(response.start)))
+                    response = await read_head(up_reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                response = None
+            if response is None:
+                up_writer.close()
+                if fresh:
+                    self._record(proxy, False, error="Connection closed")
+                    proxy = None
+                # A pooled connection may have been closed by the upstream
+                # while idle; bodiless requests are retried on a fresh one
+                if request_length != 0 or attempts >= GATEWAY_MAX_ATTEMPTS:
+                    await _respond(writer, 502, "Bad Gateway", body=b"Upstream closed the connection\n")
+                    return False
+                opened = None
+
+        status = int(response.start[1])
+        if status == 407 and key[1] is None:
+            # The upstream's own challenge would read as the gateway's
+            up_writer.close()
+            self._record(proxy, False, error="HTTP 407")
+            await _respond(writer, 502, "Bad Gateway", body=b"Upstream proxy rejected its credentials\n")
+            return False
+        if fresh:
+            # One outcome per opened upstream, once it has answered
+            self._record(proxy, True, latency_ms)
+        if status == 101:
+            upgraded = [("Connection", "Upgrade"), ("Upgrade", response.get("upgrade") or "")]
+            writer.write(response.encode(" ".join(response.start), upgraded))
+            await _Splice((reader, writer), (up_reader, up_writer)).run()
+            return False
+        response_length = body_length(response, method, status)
+        upstream_alive = response_length is not None and "close" not in response.tokens("connection")
+        keep_alive = keep_alive and response_length is not None
+        writer.write(response.encode(
+            f"{version} {response.start[1]} {response.start[2] if len(response.start) > 2 else ''}".rstrip(),
+            [("Connection", "keep-alive" if keep_alive else "close")]
+        ))
+        try:
+            await copy_body(up_reader, writer, response_length)
+        except Exception:
+            up_writer.close()
+            raise
+        if upstream_alive:
+            self.upstreams.put(key, up_reader, up_writer)
+        else:
+            up_writer.close()
+        return keep_alive
+
+async def _respond(writer: asyncio.StreamWriter, status: int, reason: str,
+                   headers: List[Tuple[str, str]] = (), body: bytes = b""):
+    lines = [f"HTTP/1.1 {status} {reason}", f"Content-Length: {len(body)}", "Connection: close"]
+    lines.extend(f"{key}: {value}" for key, value in headers)
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+
+gateway: Optional[Gateway] = None
+
+async def start_gateway(host: str = GATEWAY_HOST, port: int = GATEWAY_PORT, reuse_port: bool = False) -> Gateway:
+    """Start the process-wide gateway"""
+    global gateway
+    gateway = Gateway()
+    await gateway.start(host, port, reuse_port)
+    return gateway
+
+async def stop_gateway():
+    global gateway
+    if gateway is not None:
+        await gateway.close()
+        gateway = None
+
+async def serve(host: str, port: int):
+    """Run the gateway on its own until cancelled, e.g. from ``proxy-cli gateway``.
+
+    Meant for a shared pool (``STORAGE_BACKEND=sqlite`` or ``redis``) whose
+    health checks run in the API workers; an in-memory pool is private to
+    its process, so serve the gateway from the API with ``GATEWAY_PORT``.
+    """
+    init_db()
+    pool.load()
+    tasks = [] if pool.shared else [asyncio.create_task(pool.run_flusher()), asyncio.create_task(pool.run_reaper())]
+    await start_gateway(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stop_gateway()
+        for task in tasks:
+            task.cancel()
+        pool.flush()
@@ -1,18 +1,35 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from fastapi.security.api_key import APIKeyHeader
-from typing import Optional, List
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional, List, Set, Union
+from enum import Enum
+from itertools import islice
+from operator import attrgetter
+import aiohttp
+import json
 import logging
-import os
 from dotenv import load_dotenv
+from . import metrics
 from .database import (
-    init_db, get_proxy_by_id, update_proxy_status,
-    get_all_available_proxies, add_proxy_to_db
+    init_db, add_proxy_to_db, close_connections, fail_unfinished_jobs, get_check_summary,
+    get_hourly_checks, get_job, get_proxy_stats, get_recent_checks, list_jobs, list_proxy_stats
 )
-from .utils import construct_proxy_url, unlock_all_proxies, clear_and_repopulate_db
-from .background import check_proxies
-from .proxy_converter import convert_proxies
+from .utils import unlock_all_proxies, sync_proxy_file
+from .background import check_proxies, check_proxy, progress as check_progress, CHECK_TIMEOUT
+from .clients import clients, Client
+from .executor import run_blocking, shutdown_executor
+from .jobs import jobs
+from .pool import pool, ITER_CHUNK_SIZE, LEASE_TTL, SelectionStrategy
+from .records import PROXY_FIELDS, Proxy, ProxyFilter, join_tags, normalize_attribute
+from .sessions import sessions, SESSION_TTL
+from .watcher import watcher, WATCH_INTERVAL
 from .background_tasks import periodic_refresh
+from .coordination import coordinator
+from .history import run_rollups, HISTORY_MIN_CHECKS
+from .feedback import feedback, ProxyReport
+from .gateway import start_gateway, stop_gateway, GATEWAY_HOST, GATEWAY_PORT
 import asyncio
+import time
 
 # Initialize logging and load environment variables
 load_dotenv()
@@ -24,140 +41,442 @@ logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
 app = FastAPI()
+app.add_middleware(metrics.MetricsMiddleware)
 
-# API Key setup
-API_KEY = os.getenv("API_KEY", "your-default-api-key")
+# API Key setup; API_KEY and the keys in API_KEYS are accepted
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
-async def verify_api_key(api_key: str = Depends(api_key_header)):
-    if api_key != API_KEY:
+async def verify_api_key(api_key: str = Depends(api_key_header)) -> Client:
+    client = clients.authenticate(api_key)
+    if client is None:
         raise HTTPException(status_code=403, detail="Forbidden")
+    return client
+
+# Fields /available_proxies can return; "proxy" is the proxy URL
+OUTPUT_FIELDS = PROXY_FIELDS + ("proxy",)
+
+class OutputFormat(str, Enum):
+    """Body encoding of /available_proxies"""
+    json = "json"
+    ndjson = "ndjson"
+
+class StatsOrder(str, Enum):
+    """Ranking of /stats/proxies by 24-hour success rate"""
+    worst = "worst"
+    best = "best"
+
+def _projection(fields: Optional[str]) -> Callable[[Proxy], str]:
+    """Build a function encoding a proxy as a JSON object of the requested fields"""
+    names = PROXY_FIELDS if fields is None else tuple(f.strip() for f in fields.split(",") if f.strip())
+    unknown = [name for name in names if name not in OUTPUT_FIELDS]
+    if unknown or not names:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields {unknown}; choose from {', '.join(OUTPUT_FIELDS)}"
+        )
+    if names == ("id", "proxy"):
+        # Same shape as /get_proxies entries, cached on the record
+        return attrgetter("fragment")
+    getters = [(name, attrgetter("url" if name == "proxy" else name)) for name in names]
+    return lambda proxy: json.dumps({name: get(proxy) for name, get in getters}, separators=(",", ":"))
+
+def _encode_rows(proxies: Iterable[Proxy], encode: Callable[[Proxy], str], format: OutputFormat) -> Iterator[str]:
+    """Encode proxies ``ITER_CHUNK_SIZE`` at a time, so the body is never built in full"""
+    ndjson = format == OutputFormat.ndjson
+    proxies = iter(proxies)
+    first = True
+    if not ndjson:
+        yield "["
+    while True:
+        chunk = [encode(proxy) for proxy in islice(proxies, ITER_CHUNK_SIZE)]
+        if not chunk:
+            break
+        if ndjson:
+            yield "\n".join(chunk) + "\n"
+        else:
+            yield ("" if first else ",") + ",".join(chunk)
+        first = False
+    if not ndjson:
+        yield "]"
+
+async def _iterate_blocking(iterator: Iterator[str]) -> AsyncIterator[str]:
+    """Drive a generator that may query the store on the blocking executor"""
+    iterator = iter(iterator)
+    done = object()
+    while True:
+        chunk = await run_blocking(next, iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+async def _pool_call(func: Callable, *args):
+    """Call a pool method: inline for the in-memory pool, whose operations
+    take microseconds, on the blocking executor for stores that wait on
+    SQLite or Redis
+    """
+    if not pool.shared:
+        return func(*args)
+    return await run_blocking(func, *args)
+
+def _locked_among(proxy_ids: List[int]) -> Set[int]:
+    """Those of ``proxy_ids`` the store still has leased"""
+    locked = set()
+    for proxy_id in proxy_ids:
+        proxy = pool.get(proxy_id)
+        if proxy is not None and proxy.status == "locked":
+            locked.add(proxy_id)
+    return locked
+
+async def _leased_proxies(proxy_ids: List[int]) -> Set[int]:
+    return await _pool_call(_locked_among, proxy_ids)
 
 # Route definitions
 @app.post("/add_proxy", dependencies=[Depends(verify_api_key)])
-def add_proxy(
+async def add_proxy(
     protocol: str,
     ip: str,
     port: int,
     username: Optional[str] = None,
-    password: Optional[str] = None
+    password: Optional[str] = None,
+    country: Optional[str] = None,
+    provider: Optional[str] = None,
+    tags: Optional[List[str]] = Query(None)
 ):
-    add_proxy_to_db(protocol, ip, port, username, password)
+    """Add a proxy, optionally with the attributes /get_proxies filters on;
+    ``tags`` may be repeated or comma-separated
+    """
+    try:
+        country, provider = normalize_attribute(country), normalize_attribute(provider)
+        tags = join_tags(tags or ())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    row = await run_blocking(add_proxy_to_db, protocol, ip, port, username, password, country, provider, tags)
+    await _pool_call(pool.add, row)
     logger.info(f"Added proxy: {protocol}://{username}:{password}@{ip}:{port}")
     return {"message": "Proxy added successfully"}
 
 @app.get("/test_proxy/{proxy_id}", dependencies=[Depends(verify_api_key)])
-def test_proxy(proxy_id: int):
-    proxy = get_proxy_by_id(proxy_id)
+async def test_proxy(proxy_id: int):
+    proxy = await _pool_call(pool.get, proxy_id)
     if not proxy:
         raise HTTPException(status_code=404, detail="Proxy not found")
-    
-    proxy_url = construct_proxy_url(proxy)
-    try:
-        import requests
-        response = requests.get(
-            "https://httpbin.org/ip",
-            proxies={"http": proxy_url, "https": proxy_url},
-            timeout=5
-        )
-        response.raise_for_status()
-        update_proxy_status(proxy_id, "available")
+
+    # Same request as the background checks, awaited instead of blocking a thread
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=CHECK_TIMEOUT)) as session:
+        ok, _, error = await check_proxy(session, proxy)
+    # A leased proxy is taken back from its lease either way
+    clients.forget([proxy_id])
+    if ok:
+        await _pool_call(pool.set_status, [proxy_id], "available")
         logger.info(f"Proxy {proxy_id} is working")
         return {"message": "Proxy is working"}
-    except Exception as e:
-        update_proxy_status(proxy_id, "inactive")
-        logger.warning(f"Proxy {proxy_id} failed: {e}")
-        return {"message": "Proxy failed"}
-
-@app.get("/get_proxies", dependencies=[Depends(verify_api_key)])
-def get_proxies(count: int = 1):
-    proxies = get_all_available_proxies()[:count]
+    await _pool_call(pool.set_status, [proxy_id], "inactive")
+    logger.warning(f"Proxy {proxy_id} failed: {error}")
+    return {"message": "Proxy failed"}
+
+def _lease_response(proxies: List[Proxy], token: str, expires_at: Optional[float]) -> Response:
+    # Assembled from the records' cached JSON fragments
+    body = (
+        '{"proxies":[' + ",".join(proxy.fragment for proxy in proxies)
+        + '],"lease_token":' + json.dumps(token)
+        + ',"expires_at":' + json.dumps(expires_at) + "}"
+    )
+    return Response(body, media_type="application/json")
+
+@app.get("/get_proxies")
+async def get_proxies(
+    count: int = 1,
+    lease_seconds: Optional[float] = None,
+    strategy: SelectionStrategy = SelectionStrategy.round_robin,
+    session_id: Optional[str] = Query(None, min_length=1, max_length=128),
+    protocol: Optional[str] = None,
+    country: Optional[str] = None,
+    provider: Optional[str] = None,
+    tag: Optional[List[str]] = Query(None),
+    client: Client = Depends(verify_api_key)
+):
+    """Lease up to ``count`` proxies, within the API key's quota.
+
+    ``protocol``, ``country``, ``provider`` and ``tag`` (repeatable; every
+    tag must be present) restrict the lease to proxies with those
+    attributes, looked up through the pool's attribute indexes.
+
+    With a ``session_id``, the proxies stay with the session: later calls
+    for it return them again and extend their lease by ``lease_seconds``
+    (``SESSION_TTL`` by default), until they are unlocked or the lease
+    runs out. ``count``, ``strategy`` and the filters apply when the
+    session starts.
+    """
+    try:
+        match = ProxyFilter(protocol, country, provider, tag or ())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    clients.throttle(client)
+    if session_id is not None:
+        ttl = SESSION_TTL if lease_seconds is None else lease_seconds
+        session = sessions.get(client.name, session_id)
+        if session is not None:
+            lease = await _pool_call(pool.renew, session.token, ttl)
+            if lease is not None and sessions.touch(session, lease.proxy_ids, lease.expires_at):
+                clients.renew(lease.proxy_ids, lease.expires_at)
+                return _lease_response(session.proxies, session.token, lease.expires_at)
+            sessions.drop(session)
+    else:
+        ttl = LEASE_TTL if lease_seconds is None else lease_seconds
+
+    with clients.reserve(client, count) as allowed:
+        proxies, lease = await _pool_call(pool.lease, allowed, ttl, strategy, match or None)
+        if proxies:
+            clients.hold(client, proxies, lease.expires_at)
     if not proxies:
-        raise HTTPException(status_code=404, detail="No available proxies")
-    
-    result = []
-    for proxy in proxies:
-        proxy_id = proxy[0]
-        constructed_proxy = construct_proxy_url(proxy)
-        result.append({"id": proxy_id, "proxy": constructed_proxy})
-        update_proxy_status(proxy_id, "locked")
-    
-    return {"proxies": result}
-
-@app.post("/unlock_proxies", dependencies=[Depends(verify_api_key)])
-async def unlock_proxies_endpoint(proxy_ids: List[int]):
-    for proxy_id in proxy_ids:
-        update_proxy_status(proxy_id, "available")
+        detail = "No available proxies matching the filters" if match else "No available proxies"
+        raise HTTPException(status_code=404, detail=detail)
+
+    if session_id is not None:
+        session = sessions.bind(client.name, session_id, proxies, lease.token, lease.expires_at)
+        if session.token != lease.token:
+            # A concurrent request started the session first; hand back ours
+            proxy_ids = [proxy.id for proxy in proxies]
+            await _pool_call(pool.release, proxy_ids)
+            clients.release(client, proxy_ids)
+            return _lease_response(session.proxies, session.token, session.expires_at)
+    return _lease_response(proxies, lease.token, lease.expires_at)
+
+@app.post("/renew_lease", dependencies=[Depends(verify_api_key)])
+async def renew_lease(lease_token: str, lease_seconds: Optional[float] = None):
+    """Extend a lease returned by /get_proxies"""
+    ttl = LEASE_TTL if lease_seconds is None else lease_seconds
+    lease = await _pool_call(pool.renew, lease_token, ttl)
+    if lease is None:
+        raise HTTPException(status_code=404, detail="Lease not found or expired")
+    clients.renew(lease.proxy_ids, lease.expires_at)
+    sessions.renew(lease.proxy_ids, lease.expires_at)
+    return {"lease_token": lease.token, "expires_at": lease.expires_at, "proxy_ids": sorted(lease.proxy_ids)}
+
+@app.post("/unlock_proxies")
+async def unlock_proxies_endpoint(proxies: List[Union[int, ProxyReport]], client: Client = Depends(verify_api_key)):
+    """Return proxies given by ID or by ``ProxyReport``; reported outcomes
+    feed their health, and banned proxies are quarantined right away
+    """
+    reports = [proxy for proxy in proxies if isinstance(proxy, ProxyReport)]
+    banned = {report.id for report in reports if report.banned}
+    proxy_ids = [proxy if isinstance(proxy, int) else proxy.id for proxy in proxies]
+    if banned:
+        await _pool_call(pool.set_status, banned, "inactive")
+        proxy_ids = [proxy_id for proxy_id in proxy_ids if proxy_id not in banned]
+    await _pool_call(pool.release, proxy_ids)
+    returned = [proxy if isinstance(proxy, int) else proxy.id for proxy in proxies]
+    clients.release(client, returned)
+    sessions.release(returned)
+    feedback.add(reports)
     logger.info(f"Unlocked proxies: {proxy_ids}")
     return {"message": "Proxies unlocked successfully"}
 
-@app.get("/available_proxies", dependencies=[Depends(verify_api_key)], response_model=List[dict])
-async def available_proxies(auto_lock: bool = True):
-    proxies = get_all_available_proxies()
-    if not proxies:
-        logger.info("No available proxies found")
-        return []
-    
-    formatted_proxies = []
-    proxy_ids = []
-    for proxy in proxies:
-        proxy_id = proxy[0]
-        proxy_ids.append(proxy_id)
-        formatted_proxy = {
-            "id": proxy_id,
-            "protocol": proxy[1],
-            "username": proxy[2],
-            "password": proxy[3],
-            "ip": proxy[4],
-            "port": proxy[5],
-            "status": proxy[6],
-            "last_tested": proxy[7],
-            "fail_count": proxy[8]
-        }
-        formatted_proxies.append(formatted_proxy)
-    
-    if auto_lock and proxy_ids:
-        for proxy_id in proxy_ids:
-            update_proxy_status(proxy_id, "locked")
-        logger.info(f"Locked {len(proxy_ids)} proxies: {proxy_ids}")
-    
-    return formatted_proxies
+@app.get("/available_proxies")
+async def available_proxies(
+    auto_lock: bool = True,
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    fields: Optional[str] = None,
+    format: OutputFormat = OutputFormat.json,
+    lease_seconds: Optional[float] = None,
+    client: Client = Depends(verify_api_key)
+):
+    """List available proxies, locking them unless ``auto_lock`` is false.
+
+    Locked proxies form one lease, expiring after ``lease_seconds``
+    (``LEASE_TTL`` by default) like those from /get_proxies; its token and
+    expiry are returned in the ``X-Lease-Token`` and ``X-Lease-Expires-At``
+    headers.
+
+    Without locking, pages are taken in ID order: pass the last ``id`` seen
+    as ``after_id`` to get the next ``limit`` proxies. ``fields`` is a
+    comma-separated subset of ``OUTPUT_FIELDS`` to return. The body is
+    streamed as it is encoded, as a JSON array or, with ``format=ndjson``,
+    one JSON object per line.
+    """
+    if auto_lock and after_id is not None:
+        raise HTTPException(status_code=400, detail="after_id requires auto_lock=false")
+    encode = _projection(fields)
+
+    headers = {}
+    if auto_lock:
+        ttl = LEASE_TTL if lease_seconds is None else lease_seconds
+        clients.throttle(client)
+        with clients.reserve(client, limit) as allowed:
+            proxies, lease = await _pool_call(pool.lease, allowed, ttl)
+            if proxies:
+                clients.hold(client, proxies, lease.expires_at)
+        if proxies:
+            logger.info(f"Locked {len(proxies)} proxies")
+            headers["X-Lease-Token"] = lease.token
+            if lease.expires_at is not None:
+                headers["X-Lease-Expires-At"] = str(lease.expires_at)
+        else:
+            logger.info("No available proxies found")
+    else:
+        proxies = pool.iter_rows("available", after_id, limit)
+
+    media_type = "application/x-ndjson" if format == OutputFormat.ndjson else "application/json"
+    return StreamingResponse(
+        _iterate_blocking(_encode_rows(proxies, encode, format)), media_type=media_type, headers=headers
+    )
 
 @app.get("/health", dependencies=[Depends(verify_api_key)])
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/check_status", dependencies=[Depends(verify_api_key)])
+async def check_status():
+    """Progress and throughput of the background health check"""
+    return check_progress.as_dict()
+
+@app.get("/stats", dependencies=[Depends(verify_api_key)])
+async def stats(hours: int = Query(24, ge=1)):
+    """Pool-wide check results over the last hour and day, and per hour
+    for the last ``hours`` hours to spot provider-wide outages
+    """
+    now = time.time()
+    return {
+        "last_1h": await run_blocking(get_check_summary, now - 3600),
+        "last_24h": await run_blocking(get_check_summary, now - 86400),
+        "hourly": await run_blocking(get_hourly_checks, now - hours * 3600)
+    }
+
+@app.get("/stats/proxies", dependencies=[Depends(verify_api_key)])
+async def stats_proxies(
+    order: StatsOrder = StatsOrder.worst,
+    min_checks: int = Query(HISTORY_MIN_CHECKS, ge=0),
+    limit: int = Query(50, ge=1, le=1000)
+):
+    """Per-proxy rollups ranked by 24-hour success rate; ``worst`` first
+    lists candidates for retirement
+    """
+    return await run_blocking(list_proxy_stats, order == StatsOrder.worst, min_checks, limit)
+
+@app.get("/stats/{proxy_id}", dependencies=[Depends(verify_api_key)])
+async def stats_proxy(proxy_id: int, hours: int = Query(24, ge=1)):
+    """One proxy's rollup, recent checks and hourly history"""
+    if await _pool_call(pool.get, proxy_id) is None:
+        raise HTTPException(status_code=404, detail="Proxy not found")
+    return {
+        "rollup": await run_blocking(get_proxy_stats, proxy_id),
+        "recent_checks": await run_blocking(get_recent_checks, proxy_id),
+        "hourly": await run_blocking(get_hourly_checks, time.time() - hours * 3600, proxy_id)
+    }
+
+@app.get("/metrics", dependencies=[Depends(verify_api_key)], response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Request, database, pool, health check and gateway metrics in the Prometheus text format"""
+    # Pool gauges query shared stores
+    return PlainTextResponse(await run_blocking(metrics.render), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.post("/refresh_proxies", dependencies=[Depends(verify_api_key)])
-async def refresh_proxies():
-    """Clear unused proxies and repopulate from proxies.txt"""
-    try:
-        cleared_count = clear_and_repopulate_db()
-        return {
-            "message": "Successfully refreshed proxy database",
-            "cleared_count": cleared_count
-        }
-    except Exception as e:
-        logger.error(f"Error refreshing proxies: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+async def refresh_proxies(response: Response, force: bool = False, wait: bool = False):
+    """Apply changes in proxies.txt to the pool as a background job; ``force``
+    re-reads an unchanged file.
+
+    Returns the job at once (202) for polling ``/jobs/{job_id}``, or with
+    ``wait`` the refresh summary once it has finished.
+    """
+    job = await jobs.submit("refresh", sync_proxy_file, force, params={"force": force, "trigger": "api"})
+    if not wait:
+        response.status_code = 202
+        return job
+    job = await jobs.wait(job["id"])
+    if job["status"] != "succeeded":
+        raise HTTPException(status_code=500, detail=job["error"])
+    summary = job["result"]
+    return {
+        "message": "Successfully refreshed proxy database",
+        "cleared_count": summary["removed"],
+        "job_id": job["id"],
+        **summary
+    }
+
+@app.get("/jobs", dependencies=[Depends(verify_api_key)])
+async def jobs_list(kind: Optional[str] = None, limit: int = Query(20, ge=1, le=100)):
+    """The latest background jobs, newest first"""
+    return await run_blocking(list_jobs, kind, limit)
+
+@app.get("/jobs/{job_id}", dependencies=[Depends(verify_api_key)])
+async def job_status(job_id: str):
+    """Status, parameters and outcome of a background job"""
+    job = await run_blocking(get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
 # Startup and shutdown events
+async def start_leader_tasks():
+    """Start the maintenance tasks only one worker should run"""
+    tasks = [asyncio.create_task(periodic_refresh())]
+    if pool.shared:
+        tasks.append(asyncio.create_task(pool.run_reaper()))
+    # Hot-reload proxies.txt
+    if WATCH_INTERVAL > 0:
+        tasks.append(asyncio.create_task(watcher.run()))
+    # Start background health checks and roll up their history
+    tasks.append(asyncio.create_task(check_proxies()))
+    tasks.append(asyncio.create_task(run_rollups()))
+    app.state.leader_tasks = tasks
+
+def stop_leader_tasks():
+    for task in getattr(app.state, "leader_tasks", []):
+        task.cancel()
+    app.state.leader_tasks = []
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize background tasks on startup"""
-    # Perform initial refresh
-    try:
-        clear_and_repopulate_db()
-    except Exception as e:
-        logger.error(f"Initial refresh failed: {e}")
-    
-    # Start periodic refresh task
-    asyncio.create_task(periodic_refresh())
-    init_db()
-    convert_proxies()
-    unlock_all_proxies()
-    background_tasks = BackgroundTasks()
-    background_tasks.add_task(check_proxies)
+    await run_blocking(init_db)
+    await run_blocking(coordinator.heartbeat)
+    # A per-process pool must not serve next to other workers
+    if not pool.shared:
+        await coordinator.ensure_alone()
+
+    # Locks and jobs left over from a previous run belong to nobody, unless
+    # other workers are still serving their clients
+    if coordinator.is_leader and await run_blocking(coordinator.alone):
+        await run_blocking(unlock_all_proxies)
+        await run_blocking(fail_unfinished_jobs, "Interrupted by a restart", time.time())
+
+    # Load the in-memory pool and persist its changes in the background;
+    # the leader's first refresh job then applies proxies.txt to it
+    await run_blocking(pool.load)
+    app.state.background_tasks = []
+    if not pool.shared:
+        app.state.background_tasks.append(asyncio.create_task(pool.run_flusher()))
+        app.state.background_tasks.append(asyncio.create_task(pool.run_reaper()))
+    # Every worker applies the outcome reports it received and keeps its
+    # quota counts in step with the store
+    app.state.background_tasks.append(asyncio.create_task(feedback.run()))
+    app.state.background_tasks.append(asyncio.create_task(clients.run_reconcile(_leased_proxies)))
+
+    # Refresh, file watching and health checks run on the elected leader only
+    app.state.background_tasks.append(
+        asyncio.create_task(coordinator.run(start_leader_tasks, stop_leader_tasks))
+    )
+
+    # Every worker serves the forwarding gateway on the same shared port
+    if GATEWAY_PORT:
+        await start_gateway(GATEWAY_HOST, GATEWAY_PORT, reuse_port=True)
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    unlock_all_proxies()
\ No newline at end of file
+    tasks = getattr(app.state, "background_tasks", []) + getattr(app.state, "leader_tasks", [])
+    for task in tasks:
+        task.cancel()
+    stop_leader_tasks()
+    await stop_gateway()
+    # Let cancelled tasks save what they hold, e.g. pending check results
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await jobs.stop()
+    await run_blocking(feedback.flush)
+    await run_blocking(pool.flush)
+    if await run_blocking(coordinator.alone):
+        await run_blocking(unlock_all_proxies)
+    await run_blocking(coordinator.leave)
+    # Connections are closed only once no executor thread can still use them
+    shutdown_executor()
+    close_connections()
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import os
+import time
+from typing import List, Tuple
+
+from .database import (
+    compact_proxy_checks, get_stats_success_rates, insert_proxy_checks, rollup_check_hours, rollup_proxy_checks
+)
+from .executor import run_blocking
+from .pool import pool
+
+logger = logging.getLogger(__name__)
+
+# Seconds between rollups of the check history into per-proxy statistics
+HISTORY_ROLLUP_INTERVAL = float(os.getenv("HISTORY_ROLLUP_INTERVAL", "300"))
+# Seconds after an hour ends before its checks are rolled up, so late check writes still land in it
+HISTORY_ROLLUP_GRACE = float(os.getenv("HISTORY_ROLLUP_GRACE", "60"))
+# Seconds raw checks are kept after being rolled up into hourly buckets;
+# never less than the 24 hours the check summaries read
+CHECK_RETENTION = max(float(os.getenv("CHECK_RETENTION", str(48 * 3600))), 24 * 3600)
+# Seconds hourly buckets are kept
+CHECK_HOURLY_RETENTION = float(os.getenv("CHECK_HOURLY_RETENTION", str(30 * 24 * 3600)))
+# Checks a proxy needs in the last 24 hours before its success rate affects selection
+HISTORY_MIN_CHECKS = int(os.getenv("HISTORY_MIN_CHECKS", "3"))
+
+def record(checks: List[Tuple]):
+    """Append ``(proxy_id, checked_at, ok, latency_ms, error)`` check results to the history"""
+    if checks:
+        insert_proxy_checks(checks)
+
+def rollup(now: float = None) -> dict:
+    """Fold newly closed hours into hourly buckets, compact old checks,
+    recompute per-proxy statistics and feed their 24-hour success rates to
+    the pool's selection
+    """
+    now = time.time() if now is None else now
+    buckets = rollup_check_hours(now - HISTORY_ROLLUP_GRACE)
+    compacted, expired = compact_proxy_checks(now - CHECK_RETENTION, now - CHECK_HOURLY_RETENTION)
+    proxies = rollup_proxy_checks(now)
+    rates = get_stats_success_rates(HISTORY_MIN_CHECKS)
+    pool.apply_history(rates)
+    return {
+        "proxies": proxies, "weighted": len(rates), "buckets": buckets,
+        "compacted": compacted, "expired_buckets": expired
+    }
+
+async def run_rollups(interval: float = HISTORY_ROLLUP_INTERVAL):
+    """Background task that rolls up the check history every ``interval`` seconds"""
+    while True:
+        try:
+            summary = await run_blocking(rollup)
+            logger.info(f"Rolled up check history: {summary}")
+        except Exception as e:
+            logger.error(f"Error rolling up check history: {e}")
+        await asyncio.sleep(interval)
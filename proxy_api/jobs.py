@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+from typing import Callable, Dict, Optional
+
+from .database import finish_job, get_job, insert_job, prune_jobs, start_job
+from .executor import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# Seconds finished jobs stay queryable through /jobs
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(7 * 24 * 3600)))
+
+class JobRunner:
+    """Runs long blocking work, such as refreshes, as background jobs.
+
+    Each job is recorded in the ``jobs`` table, so its status can be read
+    from any worker, and runs on the shared blocking executor, so requests
+    keep being served meanwhile. A worker runs one job of each kind at a
+    time; submitting another while one is queued or running returns that one.
+    """
+
+    def __init__(self):
+        self._active: Dict[str, str] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def submit(self, kind: str, func: Callable[..., dict], *args, params: Optional[dict] = None) -> dict:
+        """Start ``func(*args)`` as a job of ``kind`` and return the job"""
+        job_id = self._active.get(kind)
+        if job_id is not None:
+            return await run_blocking(get_job, job_id)
+        job_id = secrets.token_hex(8)
+        self._active[kind] = job_id
+        try:
+            await run_blocking(insert_job, job_id, kind, params or {}, time.time())
+        except Exception:
+            del self._active[kind]
+            raise
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id, kind, func, args))
+        return await run_blocking(get_job, job_id)
+
+    async def _run(self, job_id: str, kind: str, func: Callable[..., dict], args: tuple):
+        try:
+            await run_blocking(start_job, job_id, time.time())
+            try:
+                result = await run_blocking(func, *args)
+            except Exception as e:
+                logger.error(f"Job {kind} {job_id} failed: {e}")
+                await run_blocking(finish_job, job_id, "failed", None, str(e), time.time())
+            else:
+                await run_blocking(finish_job, job_id, "succeeded", result, None, time.time())
+            await run_blocking(prune_jobs, time.time() - JOB_RETENTION)
+        finally:
+            self._active.pop(kind, None)
+            self._tasks.pop(job_id, None)
+
+    async def wait(self, job_id: str) -> Optional[dict]:
+        """Wait for a job started by this worker to finish and return it"""
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await asyncio.shield(task)
+        return await run_blocking(get_job, job_id)
+
+    async def stop(self):
+        """Wait for the jobs started by this worker to finish and record how
+        they ended; their work could not be interrupted anyway
+        """
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+jobs = JobRunner()
@@ -0,0 +1,253 @@
+import bisect
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds, suited to sub-millisecond pool operations up to slow proxies
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# Every metric created in this process, in creation order
+REGISTRY: List["Metric"] = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base class for metrics rendered in the Prometheus text format"""
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing count, optionally split by labels"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        # Unlabelled counters are exported as 0 before their first increment
+        self._values: Dict[Tuple, float] = {} if self.labelnames else {(): 0}
+
+    def inc(self, amount: float = 1, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+class Gauge(Metric):
+    """Current value read from a callback when metrics are collected.
+
+    The callback returns a mapping of label value to number for a gauge with
+    one label, or a plain number for a gauge without labels.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function: Optional[Callable] = None
+
+    def set_function(self, function: Callable):
+        self._function = function
+
+    def samples(self) -> Iterable[str]:
+        if self._function is None:
+            return
+        value = self._function()
+        if not self.labelnames:
+            yield f"{self.name} {_format_value(value)}"
+            return
+        for label, number in value.items():
+            yield f"{self.name}{_format_labels(self.labelnames, (label,))} {_format_value(number)}"
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed cumulative buckets"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts (last one is +Inf), sum]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+class InstrumentedLock:
+    """``threading.Lock`` that records how long contended acquisitions wait"""
+    __slots__ = ("_lock", "_histogram")
+
+    def __init__(self, histogram: Histogram):
+        self._lock = threading.Lock()
+        self._histogram = histogram
+
+    def __enter__(self):
+        if not self._lock.acquire(False):
+            started = time.perf_counter()
+            self._lock.acquire()
+            self._histogram.observe(time.perf_counter() - started)
+        return self
+
+    def __exit__(self, *exc):
+        self._lock.release()
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+# HTTP
+REQUEST_DURATION = Histogram(
+    "proxy_api_request_duration_seconds",
+    "Time spent handling HTTP requests",
+    ("method", "route", "status")
+)
+
+# Database
+DB_QUERY_DURATION = Histogram(
+    "proxy_api_db_query_duration_seconds",
+    "Time spent in database helpers",
+    ("query",)
+)
+
+# Pool
+PROXIES = Gauge("proxy_api_proxies", "Proxies in each state", ("status",))
+ACTIVE_LEASES = Gauge("proxy_api_active_leases", "Leases holding at least one proxy")
+PROXIES_LEASED = Counter(
+    "proxy_api_proxies_leased_total", "Proxies handed out by lease calls", ("strategy",)
+)
+PROXIES_RELEASED = Counter("proxy_api_proxies_released_total", "Proxies returned to the pool by clients")
+PROXIES_EXPIRED = Counter("proxy_api_proxies_expired_total", "Proxies reclaimed from expired leases")
+LEASE_MISSES = Counter("proxy_api_lease_misses_total", "Lease calls that found no available proxy")
+POOL_LOCK_WAIT = Histogram(
+    "proxy_api_pool_lock_wait_seconds",
+    "Time threads waited for the pool lock when it was contended"
+)
+
+# Health checks
+CHECKS = Counter("proxy_api_checks_total", "Background proxy checks by result", ("result",))
+CHECK_DURATION = Histogram(
+    "proxy_api_check_duration_seconds",
+    "Duration of background proxy checks",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 10.0, 30.0)
+)
+
+# Outcome reports from clients
+FEEDBACK_REPORTS = Counter(
+    "proxy_api_feedback_reports_total", "Proxy outcome reports received with unlocks", ("outcome",)
+)
+
+# Clients and sticky sessions
+CLIENT_LEASED_PROXIES = Gauge("proxy_api_client_leased_proxies", "Proxies leased by each API key", ("client",))
+CLIENT_THROTTLED = Counter(
+    "proxy_api_client_throttled_total", "Lease requests refused by a client's rate limit or quota", ("client", "reason")
+)
+STICKY_SESSIONS = Gauge("proxy_api_sticky_sessions", "Sticky sessions holding proxies in this worker")
+
+# Forwarding gateway
+GATEWAY_REQUESTS = Counter("proxy_api_gateway_requests_total", "Requests received by the gateway", ("kind",))
+GATEWAY_UPSTREAMS = Counter(
+    "proxy_api_gateway_upstream_connections_total", "Connections the gateway opened to upstream proxies", ("result",)
+)
+GATEWAY_UPSTREAM_REUSED = Counter(
+    "proxy_api_gateway_upstream_reused_total", "Requests sent over a pooled keep-alive upstream connection"
+)
+
+def timed_query(func):
+    """Decorator recording a database helper's duration under its name"""
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            DB_QUERY_DURATION.observe(time.perf_counter() - started, name)
+    return wrapper
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request.
+
+    Requests are labelled with the matched route's path template (e.g.
+    ``/test_proxy/{proxy_id}``) rather than the raw path, so IDs in URLs do
+    not create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            REQUEST_DURATION.observe(
+                time.perf_counter() - started, scope["method"], path, str(status)
+            )
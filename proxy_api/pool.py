@@ -0,0 +1,805 @@
+import asyncio
+import heapq
+from abc import ABC, abstractmethod
+import logging
+import math
+import os
+import random
+import secrets
+import time
+from collections import OrderedDict
+from enum import Enum
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .database import (
+    count_active_leases,
+    count_proxies_by_status,
+    delete_proxies,
+    delete_retired_proxies,
+    get_all_proxies,
+    get_proxy_by_id,
+    get_retired_proxy_ids,
+    iter_proxies,
+    lease_proxies,
+    reclaim_expired_leases,
+    record_proxy_checks,
+    release_locked_proxies,
+    renew_lease,
+    save_proxy_states,
+    set_history_rates,
+    update_proxy_statuses,
+)
+from .executor import run_blocking
+from .records import Proxy, ProxyFilter
+
+logger = logging.getLogger(__name__)
+
+# Seconds between write-behind flushes to the proxies table
+FLUSH_INTERVAL = float(os.getenv("POOL_FLUSH_INTERVAL", "1"))
+# Default lease duration in seconds for /get_proxies and locking /available_proxies,
+# so proxies held by a crashed client come back; 0 means leases never expire
+LEASE_TTL = float(os.getenv("LEASE_TTL", "300"))
+# Seconds between sweeps that return expired leases to the pool
+LEASE_REAP_INTERVAL = float(os.getenv("LEASE_REAP_INTERVAL", "1"))
+# Where lease state lives: "memory" (this process), "sqlite" (the database,
+# shared by every worker using it) or "redis" (a Redis server)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "memory")
+# Weight of the newest sample in the latency and success-rate moving averages
+HEALTH_EWMA_ALPHA = float(os.getenv("HEALTH_EWMA_ALPHA", "0.3"))
+
+STATUSES = ("available", "locked", "inactive")
+
+# Lowest score a proxy can have, so weighted-random never starves it entirely
+MIN_SCORE = 0.01
+# Rejection-sampling attempts before weighted-random settles for a candidate
+MAX_SAMPLES = 64
+# Rows copied per step when iterating the pool, bounding time spent holding its lock
+ITER_CHUNK_SIZE = 1000
+
+class SelectionStrategy(str, Enum):
+    """How ``ProxyPool.lease`` picks among available proxies"""
+    round_robin = "round_robin"
+    least_recently_used = "lru"
+    lowest_latency = "lowest_latency"
+    weighted_random = "weighted_random"
+
+class PoolEntry(Proxy):
+    """In-memory state of a single proxy.
+
+    Entries live as long as their proxy stays in the pool, so the URL and
+    JSON fragment cached on them are built once per proxy, not per lease.
+    """
+    __slots__ = ("last_leased", "lease", "history_rate", "terms")
+
+    def __init__(self, proxy: Proxy):
+        super().__init__(*proxy.as_tuple())
+        self.last_leased = 0.0
+        self.lease: Optional["Lease"] = None
+        # 24-hour success rate from the check history rollups
+        self.history_rate = 1.0
+        # Attribute index keys, kept for the life of the entry
+        self.terms = self.attribute_terms()
+
+    def set_attributes(self, country: Optional[str], provider: Optional[str], tags):
+        super().set_attributes(country, provider, tags)
+        self.terms = self.attribute_terms()
+
+    @property
+    def score(self) -> float:
+        """Health score in ``(0, 1]``: success rate, long-term and recent,
+        discounted by latency
+        """
+        score = self.success_rate * self.history_rate
+        if self.latency_ms is not None:
+            score *= 1000.0 / (1000.0 + self.latency_ms)
+        return max(score, MIN_SCORE)
+
+    def latency_key(self) -> float:
+        return float("inf") if self.latency_ms is None else self.latency_ms
+
+    def record(self, ok: bool, latency_ms: Optional[float]):
+        """Fold one observation into the moving averages"""
+        self.success_rate += HEALTH_EWMA_ALPHA * ((1.0 if ok else 0.0) - self.success_rate)
+        if ok and latency_ms is not None:
+            if self.latency_ms is None:
+                self.latency_ms = latency_ms
+            else:
+                self.latency_ms += HEALTH_EWMA_ALPHA * (latency_ms - self.latency_ms)
+        self.fail_count = 0 if ok else self.fail_count + 1
+
+    def snapshot(self) -> Proxy:
+        """Detached copy of the current state, sharing the entry's cached strings"""
+        # Build them on the entry, where they outlive this call
+        self._fragment = self.fragment
+        return self.copy()
+
+# Sort keys of the strategies backed by a min-heap
+HEAP_KEYS = {
+    SelectionStrategy.least_recently_used: lambda entry: entry.last_leased,
+    SelectionStrategy.lowest_latency: PoolEntry.latency_key,
+}
+
+class Lease:
+    """A group of proxies locked by one ``lease`` call"""
+    __slots__ = ("token", "proxy_ids", "expires_at")
+
+    def __init__(self, proxy_ids: Iterable[int], expires_at: Optional[float]):
+        self.token = secrets.token_urlsafe(16)
+        self.proxy_ids = set(proxy_ids)
+        self.expires_at = expires_at
+
+class ProxyStore(ABC):
+    """Interface of the proxy pool backends.
+
+    The ``proxies`` table stays the catalogue of known proxies: imports and
+    ``/add_proxy`` write it first and then hand the new rows to the store
+    through ``add`` and ``apply_changes``. The store owns the mutable state
+    (status, leases and health statistics) and serves every lease. Proxies
+    are handed out as ``Proxy`` records.
+    """
+
+    #: Whether several processes can use the same store concurrently
+    shared = False
+
+    def load(self):
+        """Pick up proxies already in the catalogue on startup"""
+
+    def add(self, row: Proxy):
+        """Track a proxy that has just been inserted into the catalogue"""
+
+    def apply_changes(self, added: List[Proxy], removed: List[int], updated: List[Tuple]):
+        """Apply an incremental import: new rows, deleted IDs and
+        ``(username, password, country, provider, tags, id)`` changes
+        """
+
+    @abstractmethod
+    def get(self, proxy_id: int) -> Optional[Proxy]:
+        """Get a proxy row with its current state"""
+
+    @abstractmethod
+    def lease(
+        self,
+        count: Optional[int] = None,
+        ttl: Optional[float] = None,
+        strategy: SelectionStrategy = SelectionStrategy.round_robin,
+        match: Optional[ProxyFilter] = None
+    ) -> Tuple[List[Proxy], Optional["Lease"]]:
+        """Lock up to ``count`` available proxies (all of them if ``None``),
+        only among those ``match`` accepts if given
+        """
+
+    @abstractmethod
+    def renew(self, token: str, ttl: float) -> Optional["Lease"]:
+        """Push a lease's expiry ``ttl`` seconds into the future"""
+
+    @abstractmethod
+    def expire_leases(self) -> int:
+        """Return proxies from expired leases to the pool and return their count"""
+
+    @abstractmethod
+    def set_status(self, proxy_ids: Iterable[int], status: str) -> int:
+        """Move proxies to ``status`` and return how many were known"""
+
+    def release(self, proxy_ids: Iterable[int]) -> int:
+        """Return proxies to the available set"""
+        released = self.set_status(proxy_ids, "available")
+        metrics.PROXIES_RELEASED.inc(released)
+        return released
+
+    @abstractmethod
+    def unlock_all(self) -> int:
+        """Release every locked proxy and return how many there were"""
+
+    @abstractmethod
+    def drop_retired(self) -> int:
+        """Delete proxies a refresh removed, once no lease holds them, and
+        return how many went
+        """
+
+    @abstractmethod
+    def record_checks(self, results: Iterable[Tuple[int, bool, Optional[float]]], fail_threshold: int = 1):
+        """Apply ``(proxy_id, ok, latency_ms)`` health check results; a proxy
+        turns inactive once it has failed ``fail_threshold`` times in a row
+        """
+
+    @abstractmethod
+    def apply_history(self, rates: Dict[int, float]):
+        """Weight selection by long-term success rates from the check
+        history; proxies missing from ``rates`` count as fully healthy
+        """
+
+    @abstractmethod
+    def iter_rows(
+        self,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> Iterator[Proxy]:
+        """Yield up to ``limit`` rows with IDs above ``after_id``, in ID order,
+        a chunk at a time
+        """
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Number of proxies in each state"""
+
+    @abstractmethod
+    def lease_count(self) -> int:
+        """Number of leases still holding proxies"""
+
+    def flush(self) -> int:
+        """Persist buffered changes and return how many there were"""
+        return 0
+
+    async def run_reaper(self):
+        """Background task that reclaims expired leases every ``LEASE_REAP_INTERVAL`` seconds"""
+        while True:
+            await asyncio.sleep(LEASE_REAP_INTERVAL)
+            try:
+                expired = await run_blocking(self.expire_leases)
+                if expired:
+                    logger.info(f"Reclaimed {expired} proxies from expired leases")
+                dropped = await run_blocking(self.drop_retired)
+                if dropped:
+                    logger.info(f"Dropped {dropped} released proxies no longer in the proxy file")
+            except Exception as e:
+                logger.error(f"Error reclaiming expired leases: {e}")
+
+class ProxyPool(ProxyStore):
+    """Owns proxy state in memory; the ``proxies`` table is write-behind storage.
+
+    Every state is kept in an insertion-ordered set, so leasing pops from the
+    front of ``available`` and releasing appends to the back, giving O(1)
+    round-robin without touching the database. Changed entries are marked
+    dirty and persisted in batches by ``flush``.
+
+    Leases with a TTL sit in a min-heap keyed by expiry, so reclaiming
+    abandoned proxies only looks at leases that are actually due.
+
+    Besides round-robin order, available proxies are indexed for the other
+    selection strategies: lazily-invalidated min-heaps keyed by last lease
+    time and by latency (built the first time their strategy is used), and
+    an array for O(1) uniform sampling that weighted-random selection
+    rejection-samples by score.
+
+    Available proxies are also indexed by attribute (protocol, country,
+    provider and each tag) in round-robin order, so a filtered lease only
+    looks at the proxies under its most selective term.
+    """
+
+    def __init__(self):
+        self._lock = metrics.InstrumentedLock(metrics.POOL_LOCK_WAIT)
+        self._entries: Dict[int, PoolEntry] = {}
+        self._dirty: Dict[int, PoolEntry] = {}
+        self._leases: Dict[str, Lease] = {}
+        self._expiry: List[Tuple[float, str]] = []
+        self._reset_indexes()
+
+    def _reset_indexes(self):
+        self._by_status: Dict[str, "OrderedDict[int, None]"] = {s: OrderedDict() for s in STATUSES}
+        self._heaps: Dict[SelectionStrategy, List[Tuple[float, int]]] = {}
+        self._sample: List[int] = []
+        self._sample_pos: Dict[int, int] = {}
+        self._by_term: Dict[Tuple[str, str], "OrderedDict[int, None]"] = {}
+
+    def _enter(self, proxy_id: int, entry: PoolEntry):
+        """Add an entry to the indexes for its current status"""
+        self._by_status.setdefault(entry.status, OrderedDict())[proxy_id] = None
+        if entry.status == "available":
+            for term in entry.terms:
+                members = self._by_term.get(term)
+                if members is None:
+                    members = self._by_term[term] = OrderedDict()
+                members[proxy_id] = None
+            self._sample_pos[proxy_id] = len(self._sample)
+            self._sample.append(proxy_id)
+            for strategy, heap in self._heaps.items():
+                heapq.heappush(heap, (HEAP_KEYS[strategy](entry), proxy_id))
+                # Stale entries are skipped on pop; rebuild once they dominate
+                if len(heap) > 4 * len(self._sample) + 1024:
+                    self._build_heap(strategy)
+
+    def _leave(self, proxy_id: int, entry: PoolEntry):
+        """Remove an entry from the indexes for its current status"""
+        self._by_status[entry.status].pop(proxy_id, None)
+        pos = self._sample_pos.pop(proxy_id, None)
+        if pos is not None:
+            for term in entry.terms:
+                members = self._by_term[term]
+                del members[proxy_id]
+                if not members:
+                    del self._by_term[term]
+            last = self._sample.pop()
+            if last != proxy_id:
+                self._sample[pos] = last
+                self._sample_pos[last] = pos
+
+    def _build_heap(self, strategy: SelectionStrategy) -> List[Tuple[float, int]]:
+        key = HEAP_KEYS[strategy]
+        heap = [(key(self._entries[i]), i) for i in self._sample]
+        heapq.heapify(heap)
+        self._heaps[strategy] = heap
+        return heap
+
+    def _pop_heap(self, strategy: SelectionStrategy) -> Optional[int]:
+        heap = self._heaps.get(strategy)
+        if heap is None:
+            heap = self._build_heap(strategy)
+        key = HEAP_KEYS[strategy]
+        while heap:
+            value, proxy_id = heapq.heappop(heap)
+            entry = self._entries.get(proxy_id)
+            if entry is not None and entry.status == "available" and key(entry) == value:
+                return proxy_id
+        return None
+
+    def _pick(self, strategy: SelectionStrategy) -> Optional[int]:
+        """Choose the next available proxy according to ``strategy``"""
+        if not self._sample:
+            return None
+        if strategy in HEAP_KEYS:
+            return self._pop_heap(strategy)
+        if strategy == SelectionStrategy.weighted_random:
+            for _ in range(MAX_SAMPLES):
+                proxy_id = random.choice(self._sample)
+                if random.random() < self._entries[proxy_id].score:
+                    break
+            return proxy_id
+        return next(iter(self._by_status["available"]))
+
+    def _pick_matching(self, count: Optional[int], strategy: SelectionStrategy, match: ProxyFilter) -> List[int]:
+        """Choose up to ``count`` available proxies accepted by ``match``,
+        looking only at those indexed under its most selective term
+        """
+        postings = [self._by_term.get(term) for term in match.terms()]
+        if not all(postings):
+            return []
+        smallest = min(postings, key=len)
+        if count is None:
+            count = len(smallest)
+        candidates = (i for i in smallest if match.matches(self._entries[i]))
+        if strategy in HEAP_KEYS:
+            key = HEAP_KEYS[strategy]
+            return heapq.nsmallest(count, candidates, key=lambda i: key(self._entries[i]))
+        if strategy == SelectionStrategy.weighted_random:
+            # Exponential keys over the score: the smallest form a weighted sample
+            return heapq.nsmallest(
+                count, candidates,
+                key=lambda i: -math.log(1.0 - random.random()) / self._entries[i].score
+            )
+        return list(islice(candidates, count))
+
+    def _detach(self, proxy_id: int, entry: PoolEntry):
+        lease = entry.lease
+        if lease is not None:
+            entry.lease = None
+            lease.proxy_ids.discard(proxy_id)
+            if not lease.proxy_ids:
+                self._leases.pop(lease.token, None)
+
+    def _place(self, proxy_id: int, entry: PoolEntry, status: str):
+        if status != "locked":
+            self._detach(proxy_id, entry)
+        self._leave(proxy_id, entry)
+        entry.status = status
+        self._enter(proxy_id, entry)
+        self._dirty[proxy_id] = entry
+
+    def _expire(self, now: float) -> int:
+        expired = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, token = heapq.heappop(self._expiry)
+            lease = self._leases.get(token)
+            # Renewed or released leases leave stale heap entries behind
+            if lease is None or lease.expires_at != expires_at:
+                continue
+            for proxy_id in list(lease.proxy_ids):
+                self._place(proxy_id, self._entries[proxy_id], "available")
+                expired += 1
+            self._leases.pop(token, None)
+        if expired:
+            metrics.PROXIES_EXPIRED.inc(expired)
+        return expired
+
+    def load(self):
+        """(Re)load every proxy from the database.
+
+        Proxies leased in memory keep their lock even if the table has not
+        caught up yet; pending changes for proxies that still exist are kept.
+        Rows locked without a lease in this process become available.
+        """
+        rows = get_all_proxies()
+        with self._lock:
+            old_entries = self._entries
+            self._entries = {}
+            self._reset_indexes()
+            dirty = {}
+            for row in rows:
+                proxy_id = row.id
+                old = old_entries.pop(proxy_id, None)
+                if old is not None and proxy_id in self._dirty:
+                    # In-memory state is newer than the table
+                    entry = old
+                    if (entry.username, entry.password) != (row.username, row.password):
+                        entry.set_credentials(row.username, row.password)
+                    if entry.terms != row.attribute_terms():
+                        entry.set_attributes(row.country, row.provider, row.tags)
+                    dirty[proxy_id] = entry
+                else:
+                    entry = PoolEntry(row)
+                    if old is not None:
+                        entry.last_leased = old.last_leased
+                        if old.status == "locked":
+                            entry.status = "locked"
+                            entry.lease, old.lease = old.lease, None
+                    if entry.status == "locked" and entry.lease is None:
+                        # Locked by a process that is gone; no lease here can release it
+                        entry.status = "available"
+                        dirty[proxy_id] = entry
+                self._entries[proxy_id] = entry
+                self._enter(proxy_id, entry)
+            # Proxies that disappeared from the table drop out of their leases
+            for proxy_id, old in old_entries.items():
+                self._detach(proxy_id, old)
+            self._dirty = dirty
+        logger.info(f"Loaded {len(rows)} proxies into the pool")
+
+    def add(self, row: Proxy):
+        """Track a proxy that has just been inserted into the database"""
+        with self._lock:
+            entry = PoolEntry(row)
+            self._entries[row.id] = entry
+            self._enter(row.id, entry)
+
+    def apply_changes(self, added: List[Proxy], removed: List[int], updated: List[Tuple]):
+        """Apply an incremental refresh: new rows, deleted IDs and
+        ``(username, password, country, provider, tags, id)`` changes. Other
+        proxies keep their state untouched.
+
+        Changes are applied ``ITER_CHUNK_SIZE`` at a time and the lock is
+        released in between, so leases served inline on the event loop wait
+        for one chunk at most, not for the whole refresh.
+        """
+        def add(row: Proxy):
+            entry = PoolEntry(row)
+            self._entries[row.id] = entry
+            self._enter(row.id, entry)
+
+        def update(change: Tuple):
+            username, password, country, provider, tags, proxy_id = change
+            entry = self._entries.get(proxy_id)
+            if entry is not None:
+                entry.set_credentials(username, password)
+                # Re-index under the new attributes
+                self._leave(proxy_id, entry)
+                entry.set_attributes(country, provider, tags)
+                self._enter(proxy_id, entry)
+
+        for items, apply in ((added, add), (removed, self._remove), (updated, update)):
+            for start in range(0, len(items), ITER_CHUNK_SIZE):
+                with self._lock:
+                    for item in items[start:start + ITER_CHUNK_SIZE]:
+                        apply(item)
+                # Give threads waiting on the lock a chance to take it first
+                time.sleep(0)
+
+    def _remove(self, proxy_id: int):
+        """Forget a proxy; the caller holds the lock"""
+        entry = self._entries.pop(proxy_id, None)
+        if entry is not None:
+            self._detach(proxy_id, entry)
+            self._leave(proxy_id, entry)
+            self._dirty.pop(proxy_id, None)
+
+    def get(self, proxy_id: int) -> Optional[Proxy]:
+        """Get a proxy row with its current in-memory state"""
+        entry = self._entries.get(proxy_id)
+        return entry.snapshot() if entry else None
+
+    def lease(
+        self,
+        count: Optional[int] = None,
+        ttl: Optional[float] = None,
+        strategy: SelectionStrategy = SelectionStrategy.round_robin,
+        match: Optional[ProxyFilter] = None
+    ) -> Tuple[List[Proxy], Optional[Lease]]:
+        """Lock up to ``count`` available proxies (all of them if ``None``),
+        only among those ``match`` accepts if given.
+
+        Returns the leased rows and the ``Lease`` that groups them, or
+        ``None`` if nothing was available. With a positive ``ttl`` the
+        proxies return to the pool automatically unless the lease is renewed.
+        """
+        now = time.time()
+        leased = []
+        with self._lock:
+            self._expire(now)
+            available = self._by_status["available"]
+            if count is None:
+                count = len(available)
+            matching = self._pick_matching(count, strategy, match) if match and count > 0 else None
+            if not available or count <= 0 or matching == []:
+                metrics.LEASE_MISSES.inc()
+                return [], None
+            picks = iter(matching) if matching is not None else None
+            lease = Lease((), now + ttl if ttl and ttl > 0 else None)
+            while len(leased) < count:
+                proxy_id = self._pick(strategy) if picks is None else next(picks, None)
+                if proxy_id is None:
+                    break
+                entry = self._entries[proxy_id]
+                self._leave(proxy_id, entry)
+                entry.status = "locked"
+                entry.last_leased = now
+                entry.lease = lease
+                lease.proxy_ids.add(proxy_id)
+                self._enter(proxy_id, entry)
+                self._dirty[proxy_id] = entry
+                leased.append(entry.snapshot())
+            self._leases[lease.token] = lease
+            if lease.expires_at is not None:
+                heapq.heappush(self._expiry, (lease.expires_at, lease.token))
+        metrics.PROXIES_LEASED.inc(len(leased), strategy.value)
+        return leased, lease
+
+    def renew(self, token: str, ttl: float) -> Optional[Lease]:
+        """Push a lease's expiry ``ttl`` seconds into the future.
+
+        Returns ``None`` if the lease is unknown, fully released or has
+        already expired. A ``ttl`` of 0 or less makes the lease permanent.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            lease = self._leases.get(token)
+            if lease is None:
+                return None
+            lease.expires_at = now + ttl if ttl > 0 else None
+            if lease.expires_at is not None:
+                heapq.heappush(self._expiry, (lease.expires_at, token))
+            return lease
+
+    def expire_leases(self) -> int:
+        """Return proxies from expired leases to the pool and return their count"""
+        with self._lock:
+            return self._expire(time.time())
+
+    def set_status(self, proxy_ids: Iterable[int], status: str) -> int:
+        """Move proxies to ``status`` and return how many were known"""
+        updated = 0
+        # Copied first: callers may pass ``lease.proxy_ids``, which _place shrinks
+        proxy_ids = list(proxy_ids)
+        with self._lock:
+            for proxy_id in proxy_ids:
+                entry = self._entries.get(proxy_id)
+                if entry is not None:
+                    self._place(proxy_id, entry, status)
+                    updated += 1
+        return updated
+
+    def unlock_all(self) -> int:
+        """Release every locked proxy, in memory and in the table"""
+        with self._lock:
+            locked = list(self._by_status["locked"])
+            for proxy_id in locked:
+                self._place(proxy_id, self._entries[proxy_id], "available")
+        release_locked_proxies()
+        return len(locked)
+
+    def drop_retired(self) -> int:
+        """Forget and delete retired proxies that are not leased in memory"""
+        retired = get_retired_proxy_ids()
+        if not retired:
+            return 0
+        with self._lock:
+            dropped = []
+            for proxy_id in retired:
+                entry = self._entries.get(proxy_id)
+                if entry is None or entry.status != "locked":
+                    self._remove(proxy_id)
+                    dropped.append(proxy_id)
+        delete_proxies(dropped)
+        return len(dropped)
+
+    def record_checks(self, results: Iterable[Tuple[int, bool, Optional[float]]], fail_threshold: int = 1):
+        """Apply ``(proxy_id, ok, latency_ms)`` health check results.
+
+        Proxies leased while the check ran keep their lock; only their
+        health statistics change. Proxies failing fewer than
+        ``fail_threshold`` times in a row keep their status.
+        """
+        tested_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        with self._lock:
+            for proxy_id, ok, latency_ms in results:
+                entry = self._entries.get(proxy_id)
+                if entry is None:
+                    continue
+                entry.last_tested = tested_at
+                entry.record(ok, latency_ms)
+                if entry.status == "locked":
+                    self._dirty[proxy_id] = entry
+                else:
+                    # Re-entering refreshes the latency index
+                    if ok:
+                        status = "available"
+                    else:
+                        status = "inactive" if entry.fail_count >= fail_threshold else entry.status
+                    self._place(proxy_id, entry, status)
+
+    def apply_history(self, rates: Dict[int, float]):
+        with self._lock:
+            for proxy_id, entry in self._entries.items():
+                entry.history_rate = rates.get(proxy_id, 1.0)
+
+    def iter_rows(
+        self,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> Iterator[Proxy]:
+        """Yield up to ``limit`` rows with IDs above ``after_id``, in ID order.
+
+        The matching IDs are collected up front; rows are copied
+        ``ITER_CHUNK_SIZE`` at a time with their state at that moment, and
+        proxies that have since left ``status`` are skipped.
+        """
+        with self._lock:
+            members = self._by_status.get(status, ()) if status is not None else self._entries
+            ids = [i for i in members if after_id is None or i > after_id]
+        ids = sorted(ids) if limit is None else heapq.nsmallest(limit, ids)
+        for start in range(0, len(ids), ITER_CHUNK_SIZE):
+            with self._lock:
+                chunk = [self._entries.get(i) for i in ids[start:start + ITER_CHUNK_SIZE]]
+                rows = [
+                    entry.snapshot() for entry in chunk
+                    if entry is not None and (status is None or entry.status == status)
+                ]
+            yield from rows
+
+    def counts(self) -> Dict[str, int]:
+        """Number of proxies in each state"""
+        with self._lock:
+            return {status: len(members) for status, members in self._by_status.items()}
+
+    def flush(self) -> int:
+        """Persist pending state changes in one transaction"""
+        with self._lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, {}
+            states = [
+                (e.status, e.last_tested, e.fail_count, e.latency_ms, e.success_rate, i)
+                for i, e in dirty.items()
+            ]
+        try:
+            save_proxy_states(states)
+        except Exception:
+            with self._lock:
+                for proxy_id, entry in dirty.items():
+                    self._dirty.setdefault(proxy_id, entry)
+            raise
+        return len(states)
+
+    async def run_reaper(self):
+        """Background task that reclaims expired leases every ``LEASE_REAP_INTERVAL`` seconds"""
+        while True:
+            await asyncio.sleep(LEASE_REAP_INTERVAL)
+            try:
+                expired = self.expire_leases()
+                if expired:
+                    logger.info(f"Reclaimed {expired} proxies from expired leases")
+                dropped = await run_blocking(self.drop_retired)
+                if dropped:
+                    logger.info(f"Dropped {dropped} released proxies no longer in the proxy file")
+            except Exception as e:
+                logger.error(f"Error reclaiming expired leases: {e}")
+
+    async def run_flusher(self):
+        """Background task that flushes the pool every ``FLUSH_INTERVAL`` seconds"""
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                await run_blocking(self.flush)
+            except Exception as e:
+                logger.error(f"Error flushing proxy pool: {e}")
+
+    def lease_count(self) -> int:
+        """Number of leases still holding proxies"""
+        return len(self._leases)
+
+class SQLiteProxyPool(ProxyStore):
+    """``ProxyPool`` counterpart whose state lives only in the database.
+
+    Every operation is a single SQLite transaction, so any number of worker
+    processes sharing ``proxies.db`` see one pool and never lease the same
+    proxy twice. Lease expiry is stored per proxy and enforced by whichever
+    process touches the pool next. Round-robin and LRU both hand out the
+    proxy leased longest ago.
+    """
+
+    shared = True
+
+    def get(self, proxy_id: int) -> Optional[Proxy]:
+        return get_proxy_by_id(proxy_id)
+
+    def lease(
+        self,
+        count: Optional[int] = None,
+        ttl: Optional[float] = None,
+        strategy: SelectionStrategy = SelectionStrategy.round_robin,
+        match: Optional[ProxyFilter] = None
+    ) -> Tuple[List[Proxy], Optional[Lease]]:
+        lease = Lease((), time.time() + ttl if ttl and ttl > 0 else None)
+        leased = lease_proxies(count, strategy.value, lease.token, lease.expires_at, match)
+        if not leased:
+            metrics.LEASE_MISSES.inc()
+            return [], None
+        lease.proxy_ids.update(proxy.id for proxy in leased)
+        metrics.PROXIES_LEASED.inc(len(leased), strategy.value)
+        return leased, lease
+
+    def renew(self, token: str, ttl: float) -> Optional[Lease]:
+        expires_at = time.time() + ttl if ttl > 0 else None
+        proxy_ids = renew_lease(token, expires_at)
+        if not proxy_ids:
+            return None
+        lease = Lease(proxy_ids, expires_at)
+        lease.token = token
+        return lease
+
+    def expire_leases(self) -> int:
+        expired = reclaim_expired_leases()
+        if expired:
+            metrics.PROXIES_EXPIRED.inc(expired)
+        return expired
+
+    def set_status(self, proxy_ids: Iterable[int], status: str) -> int:
+        return update_proxy_statuses(list(proxy_ids), status)
+
+    def unlock_all(self) -> int:
+        return release_locked_proxies()
+
+    def drop_retired(self) -> int:
+        return delete_retired_proxies()
+
+    def record_checks(self, results: Iterable[Tuple[int, bool, Optional[float]]], fail_threshold: int = 1):
+        results = list(results)
+        if results:
+            tested_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+            record_proxy_checks(results, tested_at, HEALTH_EWMA_ALPHA, fail_threshold)
+
+    def apply_history(self, rates: Dict[int, float]):
+        set_history_rates(rates)
+
+    def iter_rows(
+        self,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> Iterator[Proxy]:
+        return iter_proxies(status, after_id or 0, limit, ITER_CHUNK_SIZE)
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(count_proxies_by_status())
+        return counts
+
+    def lease_count(self) -> int:
+        return count_active_leases()
+
+def create_store(backend: str = STORAGE_BACKEND) -> ProxyStore:
+    """Instantiate the ``ProxyStore`` named by ``backend``"""
+    if backend == "memory":
+        return ProxyPool()
+    if backend == "sqlite":
+        return SQLiteProxyPool()
+    if backend == "redis":
+        from .redis_pool import RedisProxyPool
+        return RedisProxyPool()
+    raise ValueError(f"Unknown storage backend: {backend!r}")
+
+pool = create_store()
+metrics.PROXIES.set_function(pool.counts)
+metrics.ACTIVE_LEASES.set_function(pool.lease_count)
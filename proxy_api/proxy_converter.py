@@ -1,96 +1,198 @@
+import hashlib
 import os
-import sqlite3
+import re
 import logging
+from typing import Iterable, Iterator, Optional, Tuple
 from urllib.parse import urlparse
+from .database import (
+    apply_proxy_diff, bulk_insert_proxies, get_file_proxies, get_meta, init_db, set_meta
+)
+from .records import join_tags, normalize_attribute
 
 logger = logging.getLogger(__name__)
-db_path = "proxies.db"
+
+# Common ``scheme://[user[:password]@]host:port`` form; anything else goes through urlparse
+_PROXY_RE = re.compile(
+    r'^([A-Za-z][A-Za-z0-9+.-]*)://(?:([^:@/]*)(?::([^@/]*))?@)?([^:@/\[\]]+):(\d{1,5})/?$'
+)
+
+# Attributes of a line with nothing after its URL
+NO_ATTRIBUTES = {'country': None, 'provider': None, 'tags': None}
 
 def parse_proxy(proxy_string):
-    try:
-        parsed = urlparse(proxy_string)
-        protocol = parsed.scheme
-        username = parsed.username
-        password = parsed.password
-        ip = parsed.hostname
-        port = parsed.port
-
-        return {
-            'protocol': protocol,
-            'username': username,
-            'password': password,
-            'ip': ip,
-            'port': port
-        }
-    except Exception as e:
-        logger.error(f"Failed to parse proxy: {proxy_string}, error: {e}")
-        return None
+    """Split a proxy URL into its parts, or return ``None`` if it cannot be parsed.
+
+    Protocol and host are lowercased whichever way the URL is parsed, so
+    the same proxy written in another case or form imports as one row.
+    """
+    match = _PROXY_RE.match(proxy_string)
+    if match and int(match.group(5)) <= 65535:
+        protocol, username, password, ip, port = match.groups()
+    else:
+        try:
+            parsed = urlparse(proxy_string)
+            protocol, username, password = parsed.scheme, parsed.username, parsed.password
+            ip, port = parsed.hostname, parsed.port
+        except Exception as e:
+            logger.error(f"Failed to parse proxy: {proxy_string}, error: {e}")
+            return None
+    return {
+        'protocol': protocol.lower() if protocol else protocol,
+        'username': username,
+        'password': password,
+        'ip': ip.lower() if ip else ip,
+        'port': int(port) if port is not None else None
+    }
+
+def parse_attributes(words: Iterable[str]) -> dict:
+    """Parse the words after a proxy URL into its ``country``, ``provider``
+    and ``tags``.
+
+    ``country=`` and ``provider=`` set those attributes, ``tags=`` takes
+    comma-separated labels and any bare word is a label too, e.g.
+    ``socks5://1.2.3.4:1080 country=us provider=acme residential``.
+    Raises ``ValueError`` for other keys and invalid values.
+    """
+    attributes = {'country': None, 'provider': None}
+    tags = []
+    for word in words:
+        key, sep, value = word.partition('=')
+        if not sep:
+            tags.append(word)
+        elif key in attributes:
+            attributes[key] = normalize_attribute(value)
+        elif key == 'tags':
+            tags.append(value)
+        else:
+            raise ValueError(f"Unknown proxy attribute: {key!r}")
+    attributes['tags'] = join_tags(tags)
+    return attributes
+
+def iter_proxy_rows(lines: Iterable[str], counts: dict) -> Iterator[Tuple]:
+    """Parse lines into ``(protocol, username, password, ip, port, country,
+    provider, tags)`` rows.
 
-def init_db():
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS proxies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            protocol TEXT NOT NULL,
-            username TEXT,
-            password TEXT,
-            ip TEXT NOT NULL,
-            port INTEGER NOT NULL,
-            status TEXT DEFAULT 'available',
-            last_tested TIMESTAMP,
-            fail_count INTEGER DEFAULT 0
+    Each line is a proxy URL, optionally followed by attributes (see
+    ``parse_attributes``). Blank lines and lines starting with ``#`` are
+    ignored; unparseable lines are counted in ``counts["malformed"]``.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        url, *words = line.split()
+        proxy = parse_proxy(url)
+        if not proxy or not proxy['protocol'] or not proxy['ip'] or not proxy['port']:
+            counts["malformed"] += 1
+            continue
+        try:
+            attributes = parse_attributes(words) if words else NO_ATTRIBUTES
+        except ValueError as e:
+            logger.warning(f"Skipping proxy line with bad attributes: {e}")
+            counts["malformed"] += 1
+            continue
+        yield (
+            proxy['protocol'], proxy['username'], proxy['password'], proxy['ip'], proxy['port'],
+            attributes['country'], attributes['provider'], attributes['tags']
         )
-    ''')
-    conn.commit()
-    conn.close()
-
-def insert_proxy(proxy):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            INSERT INTO proxies (protocol, username, password, ip, port)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            proxy['protocol'],
-            proxy.get('username'),
-            proxy.get('password'),
-            proxy['ip'],
-            proxy['port']
-        ))
-        conn.commit()
-        logger.info(f"Inserted proxy: {proxy['protocol']}://{proxy.get('username', '')}:{proxy.get('password', '')}@{proxy['ip']}:{proxy['port']}")
-    except sqlite3.IntegrityError:
-        logger.warning(f"Proxy already exists: {proxy}")
-    finally:
-        conn.close()
-
-def convert_proxies(file_path="proxies.txt"):
+
+def convert_proxies(file_path="proxies.txt") -> dict:
+    """Import ``file_path`` into the database in a single transaction.
+
+    Lines are parsed as they are streamed into ``executemany``; addresses
+    that already exist are skipped by the unique index. Returns counts of
+    inserted, skipped and malformed lines.
+    """
+    summary = {"inserted": 0, "skipped": 0, "malformed": 0}
     if not os.path.exists(file_path):
         logger.error(f"Proxy file not found: {file_path}")
-        return
-    
+        return summary
+
+    valid = 0
+
+    def counted(rows):
+        nonlocal valid
+        for row in rows:
+            valid += 1
+            yield row
+
     with open(file_path, 'r') as f:
-        for line in f:
-            proxy = parse_proxy(line.strip())
-            if proxy:
-                if not proxy_exists(proxy):
-                    insert_proxy(proxy)
-                else:
-                    logger.info(f"Proxy already exists: {proxy['protocol']}://{proxy.get('username', '')}:{proxy.get('password', '')}@{proxy['ip']}:{proxy['port']}")
-    logger.info("Proxy conversion completed.")
-
-def proxy_exists(proxy):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT COUNT(*) FROM proxies
-        WHERE ip = ? AND port = ? AND protocol = ?
-    ''', (proxy['ip'], proxy['port'], proxy['protocol']))
-    exists = cursor.fetchone()[0] > 0
-    conn.close()
-    return exists
+        summary["inserted"] = bulk_insert_proxies(counted(iter_proxy_rows(f, summary)))
+    summary["skipped"] = valid - summary["inserted"]
+    logger.info(
+        f"Proxy conversion completed: {summary['inserted']} inserted, "
+        f"{summary['skipped']} already present, {summary['malformed']} malformed"
+    )
+    return summary
+
+def file_stamp(file_path: str) -> str:
+    """Cheap ``mtime:size`` change marker for ``file_path``"""
+    stat = os.stat(file_path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+def file_hash(file_path: str) -> str:
+    """SHA-256 of ``file_path``"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def sync_proxies(file_path="proxies.txt", force: bool = False) -> Optional[dict]:
+    """Bring the file-sourced proxies in the database in line with ``file_path``.
+
+    Only new lines are inserted, proxies no longer listed are retired (deleted
+    once no lease holds them) and changed credentials and attributes are updated; unchanged proxies keep
+    their IDs, state and health history. Proxies added through the API are
+    never touched. Unless ``force`` is set, nothing is done when the file's
+    mtime and size, or failing that its hash, match the last sync.
+
+    Returns ``None`` when skipped, otherwise a dict with the ``inserted``
+    rows, ``removed`` IDs, ``updated`` ``(username, password, country,
+    provider, tags, id)`` tuples and ``unchanged``/``malformed`` counts.
+    """
+    if not os.path.exists(file_path):
+        logger.error(f"Proxy file not found: {file_path}")
+        return None
+
+    stamp = file_stamp(file_path)
+    if not force and get_meta(f"file_stamp:{file_path}") == stamp:
+        return None
+    digest = file_hash(file_path)
+    if not force and get_meta(f"file_hash:{file_path}") == digest:
+        set_meta(f"file_stamp:{file_path}", stamp)
+        return None
+
+    counts = {"malformed": 0}
+    with open(file_path, 'r') as f:
+        wanted = {(row[0], row[3], row[4]): row for row in iter_proxy_rows(f, counts)}
+
+    removed, updated, revived, unchanged = [], [], [], 0
+    for proxy_id, protocol, username, password, ip, port, country, provider, tags, retired in get_file_proxies():
+        row = wanted.pop((protocol, ip, port), None)
+        if row is None:
+            if not retired:
+                removed.append(proxy_id)
+            continue
+        if retired:
+            # Listed again before its lease ended
+            revived.append(proxy_id)
+        if (row[1], row[2], row[5], row[6], row[7]) != (username, password, country, provider, tags):
+            updated.append((row[1], row[2], row[5], row[6], row[7], proxy_id))
+        else:
+            unchanged += 1
+    # Whatever is left in ``wanted`` is new
+    inserted = apply_proxy_diff(list(wanted.values()), removed, updated, revived)
+
+    set_meta(f"file_stamp:{file_path}", stamp)
+    set_meta(f"file_hash:{file_path}", digest)
+    return {
+        "inserted": inserted,
+        "removed": removed,
+        "updated": updated,
+        "unchanged": unchanged,
+        "malformed": counts["malformed"]
+    }
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,194 @@
+import json
+import re
+from typing import Iterable, List, Optional, Tuple, Union
+
+from .utils import format_proxy_url
+
+# Proxy row fields in ``PROXY_COLUMNS`` order
+PROXY_FIELDS = (
+    "id", "protocol", "username", "password", "ip", "port", "status",
+    "last_tested", "fail_count", "latency_ms", "success_rate",
+    "country", "provider", "tags"
+)
+
+# Characters allowed in countries, providers and tags
+_ATTRIBUTE_RE = re.compile(r'^[a-z0-9][a-z0-9_.:-]*$')
+
+def normalize_attribute(value: Optional[str]) -> Optional[str]:
+    """Lowercase a country, provider or tag; ``None`` for an empty value.
+
+    Raises ``ValueError`` for values with separators or other unexpected
+    characters.
+    """
+    if value is None:
+        return None
+    value = value.strip().lower()
+    if not value:
+        return None
+    if not _ATTRIBUTE_RE.match(value):
+        raise ValueError(f"Invalid attribute value: {value!r}")
+    return value
+
+def join_tags(tags: Iterable[str]) -> Optional[str]:
+    """Normalize tags into the sorted, comma-separated form stored in the ``tags`` column"""
+    normalized = {normalize_attribute(tag) for value in tags for tag in value.split(",")}
+    normalized.discard(None)
+    return ",".join(sorted(normalized)) or None
+
+class Proxy:
+    """One proxy: its catalogue fields and its state when it was read.
+
+    SQLite queries hydrate rows straight into ``Proxy`` objects through
+    ``from_row`` as the cursor's ``row_factory``. The proxy URL and the
+    ``{"id": ..., "proxy": ...}`` JSON fragment returned by lease endpoints
+    are built on first use and cached on the record; ``copy`` carries them
+    over and ``set_credentials`` invalidates them.
+
+    ``tags`` is a tuple of labels; rows read from SQLite hold the column's
+    comma-separated text, which is split on construction.
+    """
+    __slots__ = PROXY_FIELDS + ("_url", "_fragment")
+
+    def __init__(
+        self,
+        id: int,
+        protocol: str,
+        username: Optional[str],
+        password: Optional[str],
+        ip: str,
+        port: int,
+        status: str = "available",
+        last_tested: Optional[str] = None,
+        fail_count: Optional[int] = 0,
+        latency_ms: Optional[float] = None,
+        success_rate: Optional[float] = 1.0,
+        country: Optional[str] = None,
+        provider: Optional[str] = None,
+        tags: Union[str, Tuple[str, ...], None] = ()
+    ):
+        self.id = id
+        self.protocol = protocol
+        self.username = username
+        self.password = password
+        self.ip = ip
+        self.port = port
+        self.status = status
+        self.last_tested = last_tested
+        self.fail_count = fail_count or 0
+        self.latency_ms = latency_ms
+        self.success_rate = 1.0 if success_rate is None else success_rate
+        self.country = country
+        self.provider = provider
+        self.tags = tuple(tags.split(",")) if isinstance(tags, str) else tags or ()
+        self._url: Optional[str] = None
+        self._fragment: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, cursor, row: Tuple) -> "Proxy":
+        """``sqlite3`` row factory for ``SELECT {PROXY_COLUMNS}`` queries"""
+        return cls(*row)
+
+    @property
+    def url(self) -> str:
+        url = self._url
+        if url is None:
+            url = self._url = format_proxy_url(self.protocol, self.username, self.password, self.ip, self.port)
+        return url
+
+    @property
+    def fragment(self) -> str:
+        """Compact JSON object with the proxy's ID and URL"""
+        fragment = self._fragment
+        if fragment is None:
+            fragment = self._fragment = json.dumps({"id": self.id, "proxy": self.url}, separators=(",", ":"))
+        return fragment
+
+    def set_credentials(self, username: Optional[str], password: Optional[str]):
+        self.username = username
+        self.password = password
+        self._url = self._fragment = None
+
+    def set_attributes(self, country: Optional[str], provider: Optional[str], tags: Union[str, Tuple[str, ...], None]):
+        self.country = country
+        self.provider = provider
+        self.tags = tuple(tags.split(",")) if isinstance(tags, str) else tags or ()
+
+    def attribute_terms(self) -> List[Tuple[str, str]]:
+        """``(field, value)`` pairs this proxy is indexed under for ``ProxyFilter``"""
+        terms = [("protocol", self.protocol)]
+        if self.country is not None:
+            terms.append(("country", self.country))
+        if self.provider is not None:
+            terms.append(("provider", self.provider))
+        terms.extend(("tag", tag) for tag in self.tags)
+        return terms
+
+    def copy(self) -> "Proxy":
+        """Detached ``Proxy`` with the same fields and cached strings"""
+        proxy = Proxy(
+            self.id, self.protocol, self.username, self.password, self.ip, self.port, self.status,
+            self.last_tested, self.fail_count, self.latency_ms, self.success_rate,
+            self.country, self.provider, self.tags
+        )
+        proxy._url = self._url
+        proxy._fragment = self._fragment
+        return proxy
+
+    def as_tuple(self) -> Tuple:
+        """Fields in ``PROXY_COLUMNS`` order"""
+        return (
+            self.id, self.protocol, self.username, self.password, self.ip, self.port, self.status,
+            self.last_tested, self.fail_count, self.latency_ms, self.success_rate,
+            self.country, self.provider, self.tags
+        )
+
+    def as_dict(self) -> dict:
+        return dict(zip(PROXY_FIELDS, self.as_tuple()))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Proxy):
+            return NotImplemented
+        return self.as_tuple() == other.as_tuple()
+
+    def __repr__(self) -> str:
+        return f"Proxy(id={self.id}, address='{self.protocol}://{self.ip}:{self.port}', status={self.status!r})"
+
+class ProxyFilter:
+    """Attributes a leased proxy must have; unset fields match anything and
+    every tag must be present
+    """
+    __slots__ = ("protocol", "country", "provider", "tags")
+
+    def __init__(
+        self,
+        protocol: Optional[str] = None,
+        country: Optional[str] = None,
+        provider: Optional[str] = None,
+        tags: Iterable[str] = ()
+    ):
+        self.protocol = protocol.strip().lower() if protocol else None
+        self.country = normalize_attribute(country)
+        self.provider = normalize_attribute(provider)
+        tags = join_tags(tags)
+        self.tags = tuple(tags.split(",")) if tags else ()
+
+    def terms(self) -> List[Tuple[str, str]]:
+        """``(field, value)`` pairs a matching proxy is indexed under"""
+        terms = []
+        for field in ("protocol", "country", "provider"):
+            value = getattr(self, field)
+            if value is not None:
+                terms.append((field, value))
+        terms.extend(("tag", tag) for tag in self.tags)
+        return terms
+
+    def matches(self, proxy: Proxy) -> bool:
+        return (
+            (self.protocol is None or proxy.protocol == self.protocol)
+            and (self.country is None or proxy.country == self.country)
+            and (self.provider is None or proxy.provider == self.provider)
+            and all(tag in proxy.tags for tag in self.tags)
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.protocol or self.country or self.provider or self.tags)
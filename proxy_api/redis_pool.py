@@ -0,0 +1,659 @@
+import logging
+import os
+import random
+import re
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from . import metrics
+from .database import delete_proxies, get_all_proxies, get_retired_proxy_ids
+from .pool import HEALTH_EWMA_ALPHA, MAX_SAMPLES, STATUSES, Lease, ProxyStore, SelectionStrategy
+from .records import Proxy, ProxyFilter, join_tags
+
+logger = logging.getLogger(__name__)
+
+# Connection URL of the Redis server holding the pool
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Prefix of every key the pool uses, so several pools can share one server.
+# Its {hash tag} keeps all of a pool's keys in one Redis Cluster slot; a
+# prefix without one is wrapped in braces.
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "{proxy_api}:")
+
+# Oldest server the scripts run on (ZRANDMEMBER arrived in 6.2)
+MIN_REDIS_VERSION = (6, 2)
+
+# Rows sent to Redis per script call when loading or importing
+LOAD_CHUNK_SIZE = 1000
+
+# Hash fields of a proxy, in ``PROXY_COLUMNS`` order after the ID
+FIELDS = (
+    "protocol", "username", "password", "ip", "port", "status",
+    "last_tested", "fail_count", "latency_ms", "success_rate",
+    "country", "provider", "tags"
+)
+
+# Keys every script gets as KEYS[1..7], in this order, after the prefix.
+# A proxy is a hash under ``proxy:<id>``; the ``available`` sorted set is
+# ordered by when each proxy became available (round-robin), using scores
+# drawn from the ``seq`` counter, ``latency`` indexes the same proxies by
+# latency, ``locked`` is ordered by lease expiry and ``lease:<token>`` holds
+# the proxies of one lease. Available proxies are also indexed by attribute
+# in ``available:<field>:<value>`` sorted sets (``available:tag:<tag>`` for
+# each tag), scored like ``available``.
+BASE_KEYS = ("available", "latency", "locked", "inactive", "leases", "ids", "seq")
+
+# Shared by every script: ARGV[1] is the key prefix, ARGV[2] the current time,
+# KEYS[1..7] are ``BASE_KEYS``. Keys known to the caller (proxy hashes for
+# ID lists, a lease's set, filter indexes) follow in KEYS; those found while
+# running, such as the proxies a lease picks, are derived from the prefix,
+# whose hash tag keeps them in the same cluster slot as the declared keys.
+_PRELUDE = """
+local P = ARGV[1]
+local now = tonumber(ARGV[2])
+local unpack = table.unpack or unpack
+local AVAILABLE, LATENCY, LOCKED, INACTIVE, LEASES, IDS, SEQ = unpack(KEYS, 1, 7)
+local NO_LATENCY = 1e18
+
+local function proxy_key(id)
+    return P .. 'proxy:' .. id
+end
+
+local function terms(key)
+    local fields = redis.call('HMGET', key, 'protocol', 'country', 'provider', 'tags')
+    local keys = {}
+    for i, name in ipairs({'protocol', 'country', 'provider'}) do
+        if fields[i] then
+            table.insert(keys, P .. 'available:' .. name .. ':' .. fields[i])
+        end
+    end
+    if fields[4] then
+        for tag in string.gmatch(fields[4], '[^,]+') do
+            table.insert(keys, P .. 'available:tag:' .. tag)
+        end
+    end
+    return keys
+end
+
+local function index(id, key, score)
+    for _, term in ipairs(terms(key)) do
+        redis.call('ZADD', term, score, id)
+    end
+end
+
+local function unindex(id, key)
+    for _, term in ipairs(terms(key)) do
+        redis.call('ZREM', term, id)
+    end
+end
+
+local function detach(id, key)
+    local status = redis.call('HGET', key, 'status')
+    if status == 'available' then
+        redis.call('ZREM', AVAILABLE, id)
+        redis.call('ZREM', LATENCY, id)
+        unindex(id, key)
+    elseif status == 'locked' then
+        redis.call('ZREM', LOCKED, id)
+        local token = redis.call('HGET', key, 'lease')
+        if token then
+            local lease = P .. 'lease:' .. token
+            redis.call('SREM', lease, id)
+            if redis.call('SCARD', lease) == 0 then
+                redis.call('SREM', LEASES, token)
+            end
+            redis.call('HDEL', key, 'lease')
+        end
+    elseif status == 'inactive' then
+        redis.call('SREM', INACTIVE, id)
+    end
+end
+
+local function place(id, status, key)
+    key = key or proxy_key(id)
+    detach(id, key)
+    redis.call('HSET', key, 'status', status)
+    if status == 'available' then
+        -- Sequence numbers keep round-robin order without ties between members
+        local seq = redis.call('INCR', SEQ)
+        redis.call('ZADD', AVAILABLE, seq, id)
+        local latency = tonumber(redis.call('HGET', key, 'latency_ms'))
+        redis.call('ZADD', LATENCY, latency or NO_LATENCY, id)
+        index(id, key, seq)
+    elseif status == 'inactive' then
+        redis.call('SADD', INACTIVE, id)
+    end
+end
+
+local function reclaim()
+    local expired = redis.call('ZRANGEBYSCORE', LOCKED, '-inf', now)
+    for _, id in ipairs(expired) do
+        place(id, 'available')
+    end
+    return #expired
+end
+"""
+
+# KEYS: base keys, the lease's set, then ``available:<field>:<value>`` indexes
+# a proxy must be in. ARGV: prefix, now, count (-1 for all), strategy, token,
+# expires_at, max_samples, random seed
+_LEASE = _PRELUDE + """
+reclaim()
+local lease = KEYS[8]
+local count = tonumber(ARGV[3])
+local strategy = ARGV[4]
+local token = ARGV[5]
+local expires_at = ARGV[6]
+-- Before Redis 7 scripts start from a fixed random seed
+math.randomseed(tonumber(ARGV[8]))
+local available = redis.call('ZCARD', AVAILABLE)
+if count < 0 or count > available then
+    count = available
+end
+if count == 0 then
+    return {}
+end
+
+local function lock(id)
+    local key = proxy_key(id)
+    detach(id, key)
+    redis.call('HSET', key, 'status', 'locked', 'lease', token, 'last_leased', now)
+    redis.call('ZADD', LOCKED, expires_at, id)
+    redis.call('SADD', lease, id)
+end
+
+local function weight(id)
+    local stats = redis.call('HMGET', proxy_key(id), 'success_rate', 'latency_ms', 'history_rate')
+    local score = (tonumber(stats[1]) or 1.0) * (tonumber(stats[3]) or 1.0)
+    local latency = tonumber(stats[2])
+    if latency then
+        score = score * 1000.0 / (1000.0 + latency)
+    end
+    return math.max(score, 0.01)
+end
+
+local picked = {}
+if #KEYS > 8 then
+    -- Walk the smallest term index, checking the others for each member
+    local smallest, size
+    local others = {}
+    for i = 9, #KEYS do
+        local n = redis.call('ZCARD', KEYS[i])
+        if smallest == nil or n < size then
+            if smallest then
+                table.insert(others, smallest)
+            end
+            smallest, size = KEYS[i], n
+        else
+            table.insert(others, KEYS[i])
+        end
+    end
+    local candidates = {}
+    local ordered = strategy == 'round_robin' or strategy == 'lru'
+    local start = 0
+    while start < size and not (ordered and #candidates >= count) do
+        for _, id in ipairs(redis.call('ZRANGE', smallest, start, start + 255)) do
+            local ok = true
+            for _, key in ipairs(others) do
+                if not redis.call('ZSCORE', key, id) then
+                    ok = false
+                    break
+                end
+            end
+            if ok then
+                table.insert(candidates, id)
+            end
+        end
+        start = start + 256
+    end
+    if not ordered then
+        local keys = {}
+        for _, id in ipairs(candidates) do
+            if strategy == 'lowest_latency' then
+                keys[id] = tonumber(redis.call('ZSCORE', LATENCY, id))
+            else
+                -- Exponential keys over the weight: the smallest form a weighted sample
+                keys[id] = -math.log(1.0 - math.random()) / weight(id)
+            end
+        end
+        table.sort(candidates, function(a, b) return keys[a] < keys[b] end)
+    end
+    for i = 1, math.min(count, #candidates) do
+        lock(candidates[i])
+        table.insert(picked, candidates[i])
+    end
+    if #picked == 0 then
+        return {}
+    end
+elseif strategy == 'weighted_random' then
+    local samples = tonumber(ARGV[7])
+    while #picked < count do
+        local id
+        for _ = 1, samples do
+            id = redis.call('ZRANDMEMBER', AVAILABLE, 1)[1]
+            if math.random() < weight(id) then
+                break
+            end
+        end
+        lock(id)
+        table.insert(picked, id)
+    end
+else
+    picked = redis.call('ZRANGE', strategy == 'lowest_latency' and LATENCY or AVAILABLE, 0, count - 1)
+    for _, id in ipairs(picked) do
+        lock(id)
+    end
+end
+redis.call('SADD', LEASES, token)
+
+local rows = {}
+for _, id in ipairs(picked) do
+    local row = redis.call(
+        'HMGET', proxy_key(id), 'protocol', 'username', 'password', 'ip', 'port',
+        'status', 'last_tested', 'fail_count', 'latency_ms', 'success_rate',
+        'country', 'provider', 'tags'
+    )
+    table.insert(row, 1, id)
+    table.insert(rows, row)
+end
+return rows
+"""
+
+# KEYS: base keys, the lease's set. ARGV: prefix, now, expires_at
+_RENEW = _PRELUDE + """
+reclaim()
+local ids = redis.call('SMEMBERS', KEYS[8])
+for _, id in ipairs(ids) do
+    redis.call('ZADD', LOCKED, ARGV[3], id)
+end
+return ids
+"""
+
+# KEYS: base keys. ARGV: prefix, now
+_EXPIRE = _PRELUDE + """
+return reclaim()
+"""
+
+# KEYS: base keys, then the hash of each proxy. ARGV: prefix, now, status, id...
+_SET_STATUS = _PRELUDE + """
+local updated = 0
+for i = 4, #ARGV do
+    local key = KEYS[i + 4]
+    if redis.call('EXISTS', key) == 1 then
+        place(ARGV[i], ARGV[3], key)
+        updated = updated + 1
+    end
+end
+return updated
+"""
+
+# KEYS: base keys. ARGV: prefix, now
+_UNLOCK_ALL = _PRELUDE + """
+local ids = redis.call('ZRANGE', LOCKED, 0, -1)
+for _, id in ipairs(ids) do
+    place(id, 'available')
+end
+return #ids
+"""
+
+# KEYS: base keys, then the hash of each proxy. ARGV: prefix, now, alpha,
+# tested_at, fail_threshold, then (id, ok, latency_ms) triples
+_RECORD = _PRELUDE + """
+local alpha = tonumber(ARGV[3])
+local threshold = tonumber(ARGV[5])
+for i = 6, #ARGV, 3 do
+    local id = ARGV[i]
+    local key = KEYS[8 + (i - 6) / 3]
+    if redis.call('EXISTS', key) == 1 then
+        local ok = ARGV[i + 1] == '1'
+        local sample = tonumber(ARGV[i + 2])
+        local stats = redis.call('HMGET', key, 'success_rate', 'latency_ms', 'fail_count', 'status')
+        local rate = tonumber(stats[1]) or 1.0
+        rate = rate + alpha * ((ok and 1.0 or 0.0) - rate)
+        local latency = tonumber(stats[2])
+        if ok and sample then
+            latency = latency and (latency + alpha * (sample - latency)) or sample
+        end
+        local fails = ok and 0 or (tonumber(stats[3]) or 0) + 1
+        redis.call('HSET', key, 'success_rate', rate, 'fail_count', fails, 'last_tested', ARGV[4])
+        if latency then
+            redis.call('HSET', key, 'latency_ms', latency)
+        end
+        -- Locked proxies keep their lease; the others move (and refresh their latency index)
+        if stats[4] ~= 'locked' then
+            if ok then
+                place(id, 'available', key)
+            elseif fails >= threshold then
+                place(id, 'inactive', key)
+            else
+                place(id, stats[4], key)
+            end
+        end
+    end
+end
+"""
+
+# KEYS: base keys, then the hash of each proxy. ARGV: prefix, now, then rows
+# of 1 + len(FIELDS) values ('' for NULL)
+_ADD = _PRELUDE + """
+local width = 14
+local names = {'protocol', 'username', 'password', 'ip', 'port', 'status',
+               'last_tested', 'fail_count', 'latency_ms', 'success_rate',
+               'country', 'provider', 'tags'}
+local added = 0
+for i = 3, #ARGV, width do
+    local id = ARGV[i]
+    local key = KEYS[8 + (i - 3) / width]
+    if redis.call('EXISTS', key) == 0 then
+        local fields = {}
+        for j, name in ipairs(names) do
+            if ARGV[i + j] ~= '' and name ~= 'status' then
+                table.insert(fields, name)
+                table.insert(fields, ARGV[i + j])
+            end
+        end
+        redis.call('HSET', key, unpack(fields))
+        redis.call('SADD', IDS, id)
+        place(id, ARGV[i + 6] == 'inactive' and 'inactive' or 'available', key)
+        added = added + 1
+    end
+end
+return added
+"""
+
+# Like _REMOVE, but skips proxies held by an unexpired lease and returns the
+# IDs it removed
+_DROP = _PRELUDE + """
+reclaim()
+local dropped = {}
+for i = 3, #ARGV do
+    if not redis.call('ZSCORE', LOCKED, ARGV[i]) then
+        local key = KEYS[i + 5]
+        detach(ARGV[i], key)
+        redis.call('DEL', key)
+        redis.call('SREM', IDS, ARGV[i])
+        table.insert(dropped, ARGV[i])
+    end
+end
+return dropped
+"""
+
+# KEYS: base keys, then the hash of each proxy. ARGV: prefix, now, id...
+_REMOVE = _PRELUDE + """
+for i = 3, #ARGV do
+    local key = KEYS[i + 5]
+    detach(ARGV[i], key)
+    redis.call('DEL', key)
+    redis.call('SREM', IDS, ARGV[i])
+end
+"""
+
+# KEYS: base keys, then the hash of each proxy. ARGV: prefix, now, then
+# (id, username, password, country, provider, tags) rows ('' for NULL)
+_UPDATE = _PRELUDE + """
+local names = {'username', 'password', 'country', 'provider', 'tags'}
+for i = 3, #ARGV, 6 do
+    local id = ARGV[i]
+    local key = KEYS[8 + (i - 3) / 6]
+    if redis.call('EXISTS', key) == 1 then
+        -- Re-index an available proxy without losing its place in line
+        local score = redis.call('ZSCORE', AVAILABLE, id)
+        if score then
+            unindex(id, key)
+        end
+        for j, name in ipairs(names) do
+            if ARGV[i + j] == '' then
+                redis.call('HDEL', key, name)
+            else
+                redis.call('HSET', key, name, ARGV[i + j])
+            end
+        end
+        if score then
+            index(id, key, score)
+        end
+    end
+end
+"""
+
+def _float(value: Optional[str]) -> Optional[float]:
+    return None if value is None else float(value)
+
+def _row(proxy_id, values: List[Optional[str]]) -> Proxy:
+    (protocol, username, password, ip, port, status, last_tested, fail_count, latency_ms, success_rate,
+     country, provider, tags) = values
+    return Proxy(
+        int(proxy_id), protocol, username, password, ip, int(port), status, last_tested,
+        int(fail_count or 0), _float(latency_ms), _float(success_rate), country, provider, tags
+    )
+
+def _encode(row: Proxy) -> List:
+    values = row.as_tuple()[:-1] + (join_tags(row.tags),)
+    return ["" if value is None else value for value in values]
+
+def _hash_tagged(prefix: str) -> str:
+    """``prefix`` if it carries a Redis Cluster hash tag, else wrapped in one"""
+    return prefix if re.search(r"\{[^}]+\}", prefix) else "{" + prefix + "}"
+
+class RedisProxyPool(ProxyStore):
+    """Pool whose state lives in Redis, shared by every process using the server.
+
+    Each operation is one Lua script, which Redis runs atomically, so
+    workers on any number of hosts can lease from the same pool without
+    handing out a proxy twice. Every key shares the prefix's hash tag, so a
+    pool lives in one slot and also runs on Redis Cluster. Requires Redis
+    6.2 or later. Round-robin and LRU both hand out the proxy that has been
+    available the longest.
+    """
+
+    shared = True
+
+    def __init__(self, client=None, prefix: str = REDIS_PREFIX):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("STORAGE_BACKEND=redis requires the redis package: pip install redis")
+            client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
+        self.client = client
+        self.prefix = _hash_tagged(prefix)
+        self._base_keys = [self._key(name) for name in BASE_KEYS]
+        self._lease = client.register_script(_LEASE)
+        self._renew = client.register_script(_RENEW)
+        self._expire = client.register_script(_EXPIRE)
+        self._set_status = client.register_script(_SET_STATUS)
+        self._unlock_all = client.register_script(_UNLOCK_ALL)
+        self._record = client.register_script(_RECORD)
+        self._add = client.register_script(_ADD)
+        self._remove = client.register_script(_REMOVE)
+        self._drop = client.register_script(_DROP)
+        self._update = client.register_script(_UPDATE)
+
+    def _call(self, script, *args, keys: Iterable[str] = ()):
+        return script(keys=[*self._base_keys, *keys], args=[self.prefix, time.time(), *args])
+
+    def _key(self, name: str) -> str:
+        return self.prefix + name
+
+    def _proxy_keys(self, proxy_ids: Iterable) -> List[str]:
+        return [self._key(f"proxy:{proxy_id}") for proxy_id in proxy_ids]
+
+    def _add_rows(self, rows: List[Proxy]) -> int:
+        added = 0
+        for start in range(0, len(rows), LOAD_CHUNK_SIZE):
+            chunk = rows[start:start + LOAD_CHUNK_SIZE]
+            args = [value for row in chunk for value in _encode(row)]
+            added += self._call(self._add, *args, keys=self._proxy_keys(row.id for row in chunk))
+        return added
+
+    def _remove_ids(self, proxy_ids: List[int]):
+        for start in range(0, len(proxy_ids), LOAD_CHUNK_SIZE):
+            chunk = proxy_ids[start:start + LOAD_CHUNK_SIZE]
+            self._call(self._remove, *chunk, keys=self._proxy_keys(chunk))
+
+    def _check_version(self):
+        try:
+            version = self.client.info("server")["redis_version"]
+        except Exception as e:
+            # Some hosted servers disable INFO; the scripts then fail on use instead
+            logger.warning(f"Could not read the Redis server version: {e}")
+            return
+        if tuple(int(part) for part in re.findall(r"\d+", str(version))[:2]) < MIN_REDIS_VERSION:
+            raise RuntimeError(
+                f"STORAGE_BACKEND=redis requires Redis {'.'.join(map(str, MIN_REDIS_VERSION))} "
+                f"or later, the server runs {version}"
+            )
+
+    def load(self):
+        """Add catalogue proxies Redis does not know yet and drop deleted ones.
+
+        Proxies already in Redis keep their state, so a worker starting up
+        does not disturb leases handed out by the others.
+        """
+        self._check_version()
+        rows = get_all_proxies()
+        self._add_rows(rows)
+        known = {int(proxy_id) for proxy_id in self.client.smembers(self._key("ids"))}
+        self._remove_ids(sorted(known - {row.id for row in rows}))
+
+    def add(self, row: Proxy):
+        self._add_rows([row])
+
+    def apply_changes(self, added: List[Proxy], removed: List[int], updated: List[Tuple]):
+        self._add_rows(added)
+        self._remove_ids(list(removed))
+        for start in range(0, len(updated), LOAD_CHUNK_SIZE):
+            chunk = updated[start:start + LOAD_CHUNK_SIZE]
+            args = []
+            for *values, proxy_id in chunk:
+                args += [proxy_id, *("" if value is None else value for value in values)]
+            self._call(self._update, *args, keys=self._proxy_keys(row[-1] for row in chunk))
+
+    def _fetch(self, proxy_ids: Iterable) -> List[Proxy]:
+        rows = []
+        proxy_ids = list(proxy_ids)
+        for start in range(0, len(proxy_ids), LOAD_CHUNK_SIZE):
+            chunk = proxy_ids[start:start + LOAD_CHUNK_SIZE]
+            with self.client.pipeline(transaction=False) as pipe:
+                for proxy_id in chunk:
+                    pipe.hmget(self._key(f"proxy:{proxy_id}"), FIELDS)
+                for proxy_id, values in zip(chunk, pipe.execute()):
+                    if values[0] is not None:
+                        rows.append(_row(proxy_id, values))
+        return rows
+
+    def get(self, proxy_id: int) -> Optional[Proxy]:
+        rows = self._fetch([proxy_id])
+        return rows[0] if rows else None
+
+    def lease(
+        self,
+        count: Optional[int] = None,
+        ttl: Optional[float] = None,
+        strategy: SelectionStrategy = SelectionStrategy.round_robin,
+        match: Optional[ProxyFilter] = None
+    ) -> Tuple[List[Proxy], Optional[Lease]]:
+        lease = Lease((), time.time() + ttl if ttl and ttl > 0 else None)
+        if count is not None and count <= 0:
+            metrics.LEASE_MISSES.inc()
+            return [], None
+        expires_at = "+inf" if lease.expires_at is None else lease.expires_at
+        terms = [self._key(f"available:{field}:{value}") for field, value in match.terms()] if match else []
+        result = self._call(
+            self._lease, -1 if count is None else count, strategy.value, lease.token,
+            expires_at, MAX_SAMPLES, random.getrandbits(31),
+            keys=[self._key(f"lease:{lease.token}"), *terms]
+        )
+        if not result:
+            metrics.LEASE_MISSES.inc()
+            return [], None
+        leased = [_row(values[0], values[1:]) for values in result]
+        lease.proxy_ids.update(proxy.id for proxy in leased)
+        metrics.PROXIES_LEASED.inc(len(leased), strategy.value)
+        return leased, lease
+
+    def renew(self, token: str, ttl: float) -> Optional[Lease]:
+        expires_at = time.time() + ttl if ttl > 0 else None
+        proxy_ids = self._call(
+            self._renew, "+inf" if expires_at is None else expires_at, keys=[self._key(f"lease:{token}")]
+        )
+        if not proxy_ids:
+            return None
+        lease = Lease((int(proxy_id) for proxy_id in proxy_ids), expires_at)
+        lease.token = token
+        return lease
+
+    def expire_leases(self) -> int:
+        expired = self._call(self._expire)
+        if expired:
+            metrics.PROXIES_EXPIRED.inc(expired)
+        return expired
+
+    def set_status(self, proxy_ids: Iterable[int], status: str) -> int:
+        proxy_ids = list(proxy_ids)
+        if not proxy_ids:
+            return 0
+        return self._call(self._set_status, status, *proxy_ids, keys=self._proxy_keys(proxy_ids))
+
+    def unlock_all(self) -> int:
+        return self._call(self._unlock_all)
+
+    def drop_retired(self) -> int:
+        retired = get_retired_proxy_ids()
+        dropped = []
+        for start in range(0, len(retired), LOAD_CHUNK_SIZE):
+            chunk = retired[start:start + LOAD_CHUNK_SIZE]
+            dropped += [int(proxy_id) for proxy_id in self._call(self._drop, *chunk, keys=self._proxy_keys(chunk))]
+        delete_proxies(dropped)
+        return len(dropped)
+
+    def record_checks(self, results: Iterable[Tuple[int, bool, Optional[float]]], fail_threshold: int = 1):
+        args, proxy_ids = [], []
+        for proxy_id, ok, latency_ms in results:
+            args += [proxy_id, 1 if ok else 0, "" if latency_ms is None else latency_ms]
+            proxy_ids.append(proxy_id)
+        if args:
+            tested_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+            self._call(
+                self._record, HEALTH_EWMA_ALPHA, tested_at, fail_threshold, *args,
+                keys=self._proxy_keys(proxy_ids)
+            )
+
+    def apply_history(self, rates: Dict[int, float]):
+        proxy_ids = sorted(int(proxy_id) for proxy_id in self.client.smembers(self._key("ids")))
+        for start in range(0, len(proxy_ids), LOAD_CHUNK_SIZE):
+            with self.client.pipeline(transaction=False) as pipe:
+                for proxy_id in proxy_ids[start:start + LOAD_CHUNK_SIZE]:
+                    rate = rates.get(proxy_id)
+                    if rate is None:
+                        pipe.hdel(self._key(f"proxy:{proxy_id}"), "history_rate")
+                    else:
+                        pipe.hset(self._key(f"proxy:{proxy_id}"), "history_rate", rate)
+                pipe.execute()
+
+    def iter_rows(
+        self,
+        status: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None
+    ) -> Iterator[Proxy]:
+        if status is None:
+            members = self.client.smembers(self._key("ids"))
+        elif status == "inactive":
+            members = self.client.smembers(self._key(status))
+        else:
+            members = self.client.zrange(self._key(status), 0, -1)
+        ids = sorted(i for i in map(int, members) if after_id is None or i > after_id)
+        if limit is not None:
+            ids = ids[:limit]
+        for start in range(0, len(ids), LOAD_CHUNK_SIZE):
+            rows = self._fetch(ids[start:start + LOAD_CHUNK_SIZE])
+            yield from (row for row in rows if status is None or row.status == status)
+
+    def counts(self) -> Dict[str, int]:
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.zcard(self._key("available"))
+            pipe.zcard(self._key("locked"))
+            pipe.scard(self._key("inactive"))
+            return dict(zip(STATUSES, pipe.execute()))
+
+    def lease_count(self) -> int:
+        return self.client.scard(self._key("leases"))
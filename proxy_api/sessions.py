@@ -0,0 +1,118 @@
+import heapq
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from . import metrics
+from .records import Proxy
+
+# Seconds a sticky session keeps its proxies after the last request for it,
+# unless /get_proxies asks for another lease_seconds
+SESSION_TTL = float(os.getenv("SESSION_TTL", "600"))
+
+class Session:
+    """Proxies leased for a client's ``session_id``, and the lease holding them"""
+    __slots__ = ("key", "token", "proxies", "expires_at")
+
+    def __init__(self, key: Tuple[str, str], token: str, proxies: List[Proxy], expires_at: Optional[float]):
+        self.key = key
+        self.token = token
+        self.proxies = proxies
+        self.expires_at = expires_at
+
+class SessionMap:
+    """Sticky sessions of this process, keyed by client name and session ID.
+
+    A session keeps its proxies leased for as long as it is used: every
+    request for it renews the lease and returns the same proxies. Sessions
+    end when their lease expires or their proxies are unlocked. Lookups are
+    O(1); expired sessions are found through a lazily-invalidated heap, like
+    expired pool leases.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[Tuple[str, str], Session] = {}
+        self._by_proxy: Dict[int, Session] = {}
+        self._expiry: List[Tuple[float, Tuple[str, str]]] = []
+
+    def _expire(self, now: float):
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            session = self._sessions.get(key)
+            if session is not None and session.expires_at == expires_at:
+                self.drop(session)
+
+    def get(self, client: str, session_id: str) -> Optional[Session]:
+        self._expire(time.time())
+        return self._sessions.get((client, session_id))
+
+    def bind(self, client: str, session_id: str, proxies: List[Proxy], token: str,
+             expires_at: Optional[float]) -> Session:
+        """Start a session on freshly leased proxies; returns the session
+        already bound by a concurrent request instead, if there is one
+        """
+        key = (client, session_id)
+        existing = self.get(client, session_id)
+        if existing is not None:
+            return existing
+        session = Session(key, token, proxies, expires_at)
+        self._sessions[key] = session
+        for proxy in proxies:
+            self._by_proxy[proxy.id] = session
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, key))
+        return session
+
+    def touch(self, session: Session, proxy_ids: Iterable[int], expires_at: Optional[float]) -> bool:
+        """Apply a renewal of the session's lease, keeping the proxies it
+        still holds; returns whether any are left
+        """
+        proxy_ids = set(proxy_ids)
+        for proxy in session.proxies:
+            if proxy.id not in proxy_ids and self._by_proxy.get(proxy.id) is session:
+                del self._by_proxy[proxy.id]
+        session.proxies = [proxy for proxy in session.proxies if proxy.id in proxy_ids]
+        if not session.proxies:
+            self.drop(session)
+            return False
+        session.expires_at = expires_at
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, session.key))
+        return True
+
+    def renew(self, proxy_ids: Iterable[int], expires_at: Optional[float]):
+        """Follow a /renew_lease of a lease that may belong to a session"""
+        proxy_ids = set(proxy_ids)
+        for proxy_id in proxy_ids:
+            session = self._by_proxy.get(proxy_id)
+            if session is not None:
+                self.touch(session, proxy_ids, expires_at)
+                return
+
+    def drop(self, session: Session):
+        if self._sessions.get(session.key) is session:
+            del self._sessions[session.key]
+        for proxy in session.proxies:
+            if self._by_proxy.get(proxy.id) is session:
+                del self._by_proxy[proxy.id]
+
+    def release(self, proxy_ids: Iterable[int]):
+        """Take unlocked proxies out of their sessions, ending sessions left empty"""
+        for proxy_id in proxy_ids:
+            session = self._by_proxy.pop(proxy_id, None)
+            if session is None:
+                continue
+            session.proxies = [proxy for proxy in session.proxies if proxy.id != proxy_id]
+            if not session.proxies:
+                self.drop(session)
+
+    def count(self) -> int:
+        """Live sessions; only reads, as metrics are collected off the event loop"""
+        now = time.time()
+        return sum(
+            session.expires_at is None or session.expires_at > now
+            for session in list(self._sessions.values())
+        )
+
+sessions = SessionMap()
+metrics.STICKY_SESSIONS.set_function(sessions.count)
@@ -1,29 +1,37 @@
-from typing import Tuple
+from typing import Optional, Tuple
 
-def construct_proxy_url(proxy: Tuple) -> str:
-    """Construct a proxy URL from proxy data"""
-    protocol, username, password, ip, port = proxy[1], proxy[2], proxy[3], proxy[4], proxy[5]
+def format_proxy_url(protocol: str, username: Optional[str], password: Optional[str], ip: str, port: int) -> str:
+    """Format a proxy URL, with credentials only when both are set"""
     if username and password:
         return f"{protocol}://{username}:{password}@{ip}:{port}"
     return f"{protocol}://{ip}:{port}"
 
+def construct_proxy_url(proxy: Tuple) -> str:
+    """Construct a proxy URL from a ``proxies`` table row tuple"""
+    return format_proxy_url(proxy[1], proxy[2], proxy[3], proxy[4], proxy[5])
+
 def unlock_all_proxies():
-    """Unlock all proxies in the database"""
-    from .database import get_all_proxy_ids, update_proxy_status
-    proxy_ids = get_all_proxy_ids()
-    if proxy_ids:
-        for proxy_id in proxy_ids:
-            update_proxy_status(proxy_id, "available")
+    """Unlock all proxies in the storage backend"""
+    from .pool import pool
+    return pool.unlock_all()
+
+def sync_proxy_file(force: bool = False) -> dict:
+    """Incrementally refresh the pool from proxies.txt and return a summary"""
+    from .proxy_converter import sync_proxies
+    from .pool import pool
+
+    diff = sync_proxies(force=force)
+    if diff is None:
+        return {"skipped": True, "inserted": 0, "removed": 0, "updated": 0, "unchanged": 0, "malformed": 0}
 
-def clear_and_repopulate_db():
-    """Clear unused proxies and repopulate from proxies.txt"""
-    from .database import clear_unused_proxies
-    from .proxy_converter import convert_proxies
-    
-    # Clear unused proxies
-    cleared_count = clear_unused_proxies()
-    
-    # Repopulate from proxies.txt
-    convert_proxies()
-    
-    return cleared_count 
\ No newline at end of file
+    pool.apply_changes(diff["inserted"], [], diff["updated"])
+    # Removed proxies still leased stay until released; the reaper drops them then
+    pool.drop_retired()
+    return {
+        "skipped": False,
+        "inserted": len(diff["inserted"]),
+        "removed": len(diff["removed"]),
+        "updated": len(diff["updated"]),
+        "unchanged": diff["unchanged"],
+        "malformed": diff["malformed"]
+    }
@@ -0,0 +1,126 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Optional
+
+from .database import apply_proxy_diff, set_meta
+from .executor import run_blocking
+from .jobs import jobs
+from .pool import pool
+from .proxy_converter import file_stamp, iter_proxy_rows
+from .utils import sync_proxy_file
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of proxies.txt; 0 disables watching
+WATCH_INTERVAL = float(os.getenv("PROXY_FILE_WATCH_INTERVAL", "2"))
+
+class ProxyFileWatcher:
+    """Hot-reloads proxies.txt by polling its mtime and size.
+
+    The watcher remembers how many bytes of the file it has consumed (up to
+    the last complete line) and a running SHA-256 of them. When the file
+    grows and that prefix is unchanged, only the appended lines are parsed
+    and inserted. Any other change (edits, deletions, truncation) falls back
+    to the incremental diff of ``sync_proxy_file``, run as a ``refresh`` job
+    so it never overlaps a refresh started through the API or the schedule.
+    """
+
+    def __init__(self, file_path: str = "proxies.txt"):
+        self.file_path = file_path
+        self._stamp: Optional[str] = None
+        self._offset = 0
+        self._digest = hashlib.sha256()
+        # Set by ``poll`` when the change needs a full sync
+        self.needs_sync = False
+
+    def _read_prefix(self):
+        """Consume the file up to its last complete line"""
+        self._offset = 0
+        self._digest = hashlib.sha256()
+        with open(self.file_path, 'rb') as f:
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        self._digest.update(data[:end])
+        self._offset = end
+
+    def _prefix_unchanged(self, f) -> bool:
+        digest = hashlib.sha256()
+        remaining = self._offset
+        while remaining:
+            chunk = f.read(min(remaining, 1 << 20))
+            if not chunk:
+                return False
+            digest.update(chunk)
+            remaining -= len(chunk)
+        return digest.digest() == self._digest.digest()
+
+    def poll(self) -> Optional[dict]:
+        """Apply lines appended since the last poll and return a summary, or
+        ``None``; other changes set ``needs_sync`` instead
+        """
+        if not os.path.exists(self.file_path):
+            return None
+        stamp = file_stamp(self.file_path)
+        if stamp == self._stamp:
+            return None
+
+        first_poll = self._stamp is None
+        self._stamp = stamp
+        if not first_poll and os.path.getsize(self.file_path) >= self._offset:
+            with open(self.file_path, 'rb') as f:
+                if self._prefix_unchanged(f):
+                    return self._apply_append(f.read(), stamp)
+
+        self.needs_sync = True
+        return None
+
+    async def sync(self) -> Optional[dict]:
+        """Run the full sync ``poll`` asked for and return its summary"""
+        changed_at = time.time()
+        while True:
+            job = await jobs.submit("refresh", sync_proxy_file, params={"force": False, "trigger": "watch"})
+            job = await jobs.wait(job["id"])
+            # A refresh already running may have read the file before the change
+            if job["created_at"] >= changed_at:
+                break
+        self.needs_sync = False
+        await run_blocking(self._read_prefix)
+        if job["status"] != "succeeded":
+            raise RuntimeError(job["error"])
+        return job["result"]
+
+    def _apply_append(self, appended: bytes, stamp: str) -> Optional[dict]:
+        end = appended.rfind(b'\n') + 1
+        if not end:
+            # Only a partial line so far; wait for its newline
+            return None
+        counts = {"malformed": 0}
+        lines = appended[:end].decode().splitlines()
+        inserted = apply_proxy_diff(list(iter_proxy_rows(lines, counts)), [], [])
+        pool.apply_changes(inserted, [], [])
+
+        self._digest.update(appended[:end])
+        self._offset += end
+        if end == len(appended):
+            # The whole file has been consumed, so the periodic refresh can skip it
+            set_meta(f"file_stamp:{self.file_path}", stamp)
+            set_meta(f"file_hash:{self.file_path}", self._digest.hexdigest())
+        return {"appended": True, "inserted": len(inserted), "malformed": counts["malformed"]}
+
+    async def run(self, interval: float = WATCH_INTERVAL):
+        """Background task that polls the file every ``interval`` seconds"""
+        while True:
+            try:
+                summary = await run_blocking(self.poll)
+                if self.needs_sync:
+                    summary = await self.sync()
+                if summary and (summary.get("inserted") or summary.get("removed") or summary.get("updated")):
+                    logger.info(f"Applied changes from {self.file_path}: {summary}")
+            except Exception as e:
+                logger.error(f"Error watching {self.file_path}: {e}")
+            await asyncio.sleep(interval)
+
+watcher = ProxyFileWatcher()
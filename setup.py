@@ -6,11 +6,16 @@ setup(
     packages=find_packages(),
     install_requires=[
         'requests',
+        'aiohttp',
         'fastapi',
         'uvicorn',
         'python-dotenv',
         'typer'
     ],
+    extras_require={
+        'redis': ['redis'],
+        'test': ['pytest', 'httpx', 'redis', 'fakeredis[lua]'],
+    },
     package_data={
         'proxy_api': ['handler.py', 'proxy_converter.py', 'proxies.txt'],
     },
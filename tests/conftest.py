@@ -0,0 +1,43 @@
+import pytest
+
+from proxy_api import database
+from proxy_api.pool import ProxyPool, SQLiteProxyPool
+
+
+def seed_proxies(count: int, protocol: str = "http", port: int = 8080, **attributes):
+    """Insert ``count`` proxies on 10.x.y.z addresses into the catalogue"""
+    database.bulk_insert_proxies(
+        (
+            protocol, None, None, f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", port,
+            attributes.get("country"), attributes.get("provider"), attributes.get("tags")
+        )
+        for i in range(1, count + 1)
+    )
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Fresh ``proxies.db`` in a temporary directory"""
+    monkeypatch.setattr(database, "db_path", str(tmp_path / "proxies.db"))
+    database.init_db()
+    yield database
+    database.close_connections()
+
+
+@pytest.fixture
+def redis_client():
+    """Client of a private in-process Redis server"""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa", reason="fakeredis needs lupa to run Lua scripts")
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, db):
+    """Each ``ProxyStore`` backend, empty until ``load`` is called"""
+    if request.param == "memory":
+        return ProxyPool()
+    if request.param == "sqlite":
+        return SQLiteProxyPool()
+    from proxy_api.redis_pool import RedisProxyPool
+    return RedisProxyPool(client=request.getfixturevalue("redis_client"))
@@ -0,0 +1,50 @@
+import asyncio
+import time
+
+from proxy_api import api as client_api
+from proxy_api.api import AsyncProxyAPI, ProxyAPI
+
+
+def lease_body(ids, expires_at):
+    return {
+        "proxies": [{"id": i, "proxy": f"http://10.0.0.{i}:8080"} for i in ids],
+        "lease_token": "token",
+        "expires_at": expires_at,
+    }
+
+
+def test_buffer_drops_expired_leases(monkeypatch):
+    now = time.time()
+    batches = [lease_body([1, 2], now + 1), lease_body([3, 4], now + 600)]
+    unlocked = []
+    api = ProxyAPI(api_key="k", prefetch=2)
+    monkeypatch.setattr(api, "_lease_batch", lambda count: client_api._lease_entries(batches.pop(0)))
+    monkeypatch.setattr(api, "unlock_proxies", unlocked.extend)
+
+    # The first batch expires within LEASE_EXPIRY_MARGIN: it is replaced, not handed out
+    api._buffer.extend(api._lease_batch(2))
+    proxy = api.acquire()
+    assert proxy["id"] == 3 and proxy["lease_token"] == "token"
+    api.release(proxy)
+    api.close()
+    assert sorted(unlocked) == [3, 4]
+
+
+def test_async_buffer_drops_expired_leases(monkeypatch):
+    now = time.time()
+    batches = [lease_body([1], now - 10), lease_body([2], None)]
+    api = AsyncProxyAPI(api_key="k", prefetch=1)
+
+    async def lease_batch(count):
+        return client_api._lease_entries(batches.pop(0))
+
+    async def run():
+        monkeypatch.setattr(api, "_lease_batch", lease_batch)
+        api._buffer.extend(await api._lease_batch(1))
+        proxy = await api.acquire()
+        await api.release(proxy)
+        return proxy, list(api._buffer)
+
+    proxy, buffered = asyncio.run(run())
+    assert proxy["id"] == 2
+    assert [p["id"] for p in buffered] == [2]
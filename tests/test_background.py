@@ -0,0 +1,43 @@
+import asyncio
+
+import pytest
+
+from proxy_api import background
+from proxy_api.database import get_connection
+from proxy_api.pool import ProxyPool
+
+from .conftest import seed_proxies
+
+
+@pytest.fixture
+def store(db, monkeypatch):
+    seed_proxies(30)
+    store = ProxyPool()
+    store.load()
+    monkeypatch.setattr(background, "pool", store)
+    monkeypatch.setattr(background, "progress", background.CheckProgress())
+    monkeypatch.setattr(background, "CHECK_RATE", 0)
+    monkeypatch.setattr(background, "CHECK_CONCURRENCY", 10)
+
+    async def check_proxy(session, proxy):
+        return (True, 10.0, None) if proxy.id % 2 else (False, None, "TimeoutError")
+
+    monkeypatch.setattr(background, "check_proxy", check_proxy)
+    return store
+
+
+def test_check_round_counts_every_due_proxy_and_saves_results_on_cancel(store):
+    async def run():
+        task = asyncio.create_task(background.check_proxies())
+        while background.progress.finished_at is None:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    progress = background.progress.as_dict()
+    assert (progress["total"], progress["checked"], progress["available"], progress["inactive"]) == (30, 30, 15, 15)
+    # Results still pending when the checker stops are saved on the way out
+    assert get_connection().execute("SELECT COUNT(*) FROM proxy_checks").fetchone()[0] == 30
+    assert store.get(2).status == "inactive" and store.get(1).status == "available"
@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+from proxy_api.clients import Client, ClientRegistry
+
+
+def registry():
+    first, second = Client("first", "key-1", max_leases=3), Client("second", "key-2", max_leases=3)
+    return ClientRegistry([first, second]), first, second
+
+
+def proxies(*ids):
+    return [SimpleNamespace(id=proxy_id) for proxy_id in ids]
+
+
+def test_clients_only_release_their_own_proxies():
+    clients, first, second = registry()
+    clients.hold(first, proxies(1, 2), None)
+    clients.release(second, [1, 2])
+    assert first.remaining(0) == 1
+    clients.release(first, [1])
+    assert first.remaining(0) == 2 and list(first.held) == [2]
+
+
+def test_reconcile_forgets_proxies_the_store_no_longer_leases():
+    clients, first, second = registry()
+    clients.hold(first, proxies(1, 2), None)
+    clients.hold(second, proxies(3), None)
+
+    async def leased(proxy_ids):
+        return {2}
+
+    async def run():
+        task = asyncio.create_task(clients.run_reconcile(leased, interval=0.01))
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    asyncio.run(run())
+    assert list(first.held) == [2] and second.held == {}
+    assert first.remaining(0) == 2 and second.remaining(0) == 3
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+
+import pytest
+
+from proxy_api import coordination
+from proxy_api.coordination import Coordinator
+from proxy_api.database import update_proxy_statuses
+from proxy_api.pool import ProxyPool
+
+from .conftest import seed_proxies
+
+
+def test_one_leader_per_database_with_memory_pool(db, caplog):
+    first, second = Coordinator(), Coordinator()
+    assert first.heartbeat()
+    assert first.alone()
+
+    with caplog.at_level(logging.ERROR, logger="proxy_api.coordination"):
+        assert not second.heartbeat()
+    assert "may lease the same proxies" in caplog.text
+    assert not first.alone() and not second.alone()
+
+    first.leave()
+    assert second.heartbeat()
+    assert second.alone()
+
+
+def test_memory_pool_frees_rows_locked_by_a_dead_process(db):
+    seed_proxies(2)
+    update_proxy_statuses([1], "locked")
+    pool = ProxyPool()
+    pool.load()
+    assert pool.get(1).status == "available"
+    leased, _ = pool.lease(2)
+    assert len(leased) == 2
+
+
+def test_memory_pool_refuses_to_start_next_to_live_workers(db, monkeypatch):
+    monkeypatch.setattr(coordination, "LEADER_TTL", 0.3)
+    running, starting = Coordinator(), Coordinator()
+    running.heartbeat()
+    starting.heartbeat()
+
+    async def start_while_running_heartbeats():
+        async def keep_alive():
+            while True:
+                running.heartbeat()
+                await asyncio.sleep(0.05)
+
+        beating = asyncio.create_task(keep_alive())
+        try:
+            await starting.ensure_alone()
+        finally:
+            beating.cancel()
+
+    with pytest.raises(RuntimeError, match="STORAGE_BACKEND=sqlite or redis"):
+        asyncio.run(start_while_running_heartbeats())
+    # The refused worker deregistered itself
+    assert running.alone()
+
+
+def test_memory_pool_starts_once_a_crashed_worker_goes_silent(db, monkeypatch):
+    monkeypatch.setattr(coordination, "LEADER_TTL", 0.3)
+    crashed, starting = Coordinator(), Coordinator()
+    crashed.heartbeat()
+    starting.heartbeat()
+    asyncio.run(starting.ensure_alone())
+    assert starting.alone()
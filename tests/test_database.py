@@ -0,0 +1,16 @@
+from proxy_api.database import LEASE_ORDER, PROXY_COLUMNS, get_connection
+
+
+def query_plan(sql: str, *params) -> str:
+    return " | ".join(row[3] for row in get_connection().execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def test_lease_orders_are_served_from_indexes(db):
+    for strategy in ("round_robin", "lru", "lowest_latency"):
+        plan = query_plan(f'''
+            SELECT {PROXY_COLUMNS} FROM proxies
+            WHERE status = 'available'
+            ORDER BY {LEASE_ORDER[strategy]}
+            LIMIT ?
+        ''', 10)
+        assert "USING INDEX" in plan and "TEMP B-TREE" not in plan, (strategy, plan)
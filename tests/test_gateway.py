@@ -0,0 +1,206 @@
+import asyncio
+import base64
+
+import pytest
+
+from proxy_api import background, database, gateway
+from proxy_api.feedback import FEEDBACK_FAIL_THRESHOLD
+from proxy_api.pool import ProxyPool
+
+API_KEY = "gateway-test-key"
+
+
+class StandInProxy:
+    """HTTP proxy on localhost answering with its own name instead of
+    reaching the target; CONNECT tunnels echo what they receive uppercased,
+    unless ``connect_status`` refuses them. With ``hang_up`` it closes
+    connections without a reply.
+    """
+
+    def __init__(self, name: str, connect_status: int = 200, hang_up: bool = False):
+        self.name = name.encode()
+        self.connect_status = connect_status
+        self.hang_up = hang_up
+        self.connections = 0
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        head = await gateway.read_head(reader)
+        if self.hang_up:
+            pass
+        elif head is not None and head.start[0] == "CONNECT" and self.connect_status != 200:
+            writer.write(b"HTTP/1.1 %d Refused\r\nContent-Length: 0\r\n\r\n" % self.connect_status)
+        elif head is not None and head.start[0] == "CONNECT":
+            # The greeting rides along with the reply, so the gateway has it buffered
+            writer.write(b"HTTP/1.1 200 Connection established\r\n\r\n" + self.name + b"\n")
+            while True:
+                data = await reader.read(1024)
+                if not data:
+                    break
+                writer.write(data.upper())
+        elif head is not None:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\nConnection: close\r\n\r\n" % len(self.name) + self.name
+            )
+        await writer.drain()
+        writer.close()
+
+
+async def closed_port() -> int:
+    """A localhost port nothing listens on"""
+    server = await asyncio.start_server(lambda reader, writer: None, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    server.close()
+    await server.wait_closed()
+    return port
+
+
+def proxy_authorization(session: str = "rotate") -> str:
+    return "Basic " + base64.b64encode(f"{session}:{API_KEY}".encode()).decode()
+
+
+async def exchange(port: int, request: bytes) -> bytes:
+    """Whole response to ``request``, authenticated, sent to the gateway"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    start, _, rest = request.partition(b"\r\n")
+    writer.write(start + b"\r\nProxy-Authorization: " + proxy_authorization().encode() + b"\r\n" + rest)
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+async def fetch(port: int) -> bytes:
+    """Body of a plain HTTP request sent through the gateway"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        b"GET http://target.test/ HTTP/1.1\r\nHost: target.test\r\n"
+        b"Proxy-Authorization: " + proxy_authorization().encode() + b"\r\nConnection: close\r\n\r\n"
+    )
+    response = await reader.read()
+    writer.close()
+    return response.partition(b"\r\n\r\n")[2]
+
+
+@pytest.fixture
+def store(db, monkeypatch):
+    store = ProxyPool()
+    monkeypatch.setattr(gateway, "pool", store)
+    monkeypatch.setattr(background, "pool", store)
+    return store
+
+
+def serve(store, names, scenario, dead: int = 0):
+    """Run ``scenario(gateway)`` against a gateway over stand-in proxies
+    called ``names`` (or given as ``StandInProxy``), after ``dead`` proxies
+    on closed ports
+    """
+    async def run():
+        upstreams = [name if isinstance(name, StandInProxy) else StandInProxy(name) for name in names]
+        ports = [await closed_port() for _ in range(dead)] + [await upstream.start() for upstream in upstreams]
+        database.bulk_insert_proxies(("http", None, None, "127.0.0.1", port, None, None, None) for port in ports)
+        store.load()
+        served = gateway.Gateway(api_key=API_KEY)
+        await served.start("127.0.0.1", 0)
+        try:
+            return await asyncio.wait_for(scenario(served), 10)
+        finally:
+            await served.close()
+            for upstream in upstreams:
+                upstream.server.close()
+
+    return asyncio.run(run())
+
+
+def test_requests_rotate_over_available_proxies(store):
+    async def scenario(served):
+        return [await fetch(served.port) for _ in range(4)]
+
+    assert serve(store, ["a", "b"], scenario) == [b"a", b"b", b"a", b"b"]
+
+
+def test_failed_proxy_fails_over_and_leaves_the_rotation(store):
+    async def scenario(served):
+        return [await fetch(served.port) for _ in range(3)]
+
+    assert serve(store, ["b"], scenario, dead=1) == [b"b", b"b", b"b"]
+    # Only the first request tried the dead proxy
+    assert store.get(1).fail_count == 1
+
+
+def test_gateway_failures_quarantine_after_the_feedback_threshold(store):
+    async def scenario(served):
+        statuses = []
+        for _ in range(FEEDBACK_FAIL_THRESHOLD):
+            assert await fetch(served.port) == b"b"
+            await served.flush()
+            await served.refresh()
+            statuses.append(store.get(1).status)
+        return statuses
+
+    statuses = serve(store, ["b"], scenario, dead=1)
+    assert statuses == ["available"] * (FEEDBACK_FAIL_THRESHOLD - 1) + ["inactive"]
+
+
+def test_connect_tunnel_relays_bytes_buffered_before_the_splice(store):
+    async def scenario(served):
+        reader, writer = await asyncio.open_connection("127.0.0.1", served.port)
+        # Tunnel data sent together with the CONNECT request is already buffered
+        writer.write(
+            b"CONNECT target.test:443 HTTP/1.1\r\nHost: target.test:443\r\n"
+            b"Proxy-Authorization: " + proxy_authorization().encode() + b"\r\n\r\nping\n"
+        )
+        assert await reader.readuntil(b"\r\n\r\n") == b"HTTP/1.1 200 Connection established\r\n\r\n"
+        greeting = await reader.readline()
+        echoed = await reader.readline()
+        writer.write(b"again\n")
+        again = await reader.readline()
+        writer.close()
+        return greeting, echoed, again
+
+    assert serve(store, ["a"], scenario) == (b"a\n", b"PING\n", b"AGAIN\n")
+
+
+def test_connect_refused_by_the_target_is_not_retried_or_blamed_on_the_proxy(store):
+    upstreams = [StandInProxy("a", connect_status=403), StandInProxy("b", connect_status=403)]
+
+    async def scenario(served):
+        response = await exchange(served.port, b"CONNECT target.test:443 HTTP/1.1\r\nHost: target.test:443\r\n\r\n")
+        return response, list(served.outcomes.results)
+
+    response, outcomes = serve(store, upstreams, scenario)
+    assert response.startswith(b"HTTP/1.1 502 ") and b"HTTP 403" in response
+    assert sum(upstream.connections for upstream in upstreams) == 1
+    assert outcomes == []
+
+
+@pytest.mark.parametrize("request_bytes", [
+    b"CONNECT target.test:70000 HTTP/1.1\r\nHost: target.test:70000\r\n\r\n",
+    b"CONNECT target.test:0 HTTP/1.1\r\nHost: target.test:0\r\n\r\n",
+    b"GET http://target.test:70000/ HTTP/1.1\r\nHost: target.test:70000\r\nConnection: close\r\n\r\n"
+])
+def test_out_of_range_ports_are_rejected_before_dialing(store, request_bytes):
+    upstream = StandInProxy("a")
+
+    async def scenario(served):
+        return await exchange(served.port, request_bytes), list(served.outcomes.results)
+
+    response, outcomes = serve(store, [upstream], scenario)
+    assert response.startswith(b"HTTP/1.1 400 ")
+    assert upstream.connections == 0 and outcomes == []
+
+
+def test_fresh_upstream_closing_records_a_single_failure(store):
+    async def scenario(served):
+        response = await exchange(
+            served.port, b"GET http://target.test/ HTTP/1.1\r\nHost: target.test\r\nConnection: close\r\n\r\n"
+        )
+        return response, list(served.outcomes.results)
+
+    response, outcomes = serve(store, [StandInProxy("a", hang_up=True), "b"], scenario)
+    assert response.endswith(b"\r\n\r\nb")
+    assert [(proxy_id, ok) for proxy_id, ok, _ in outcomes] == [(1, False), (2, True)]
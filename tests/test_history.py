@@ -0,0 +1,47 @@
+import pytest
+
+from proxy_api import database, history
+from proxy_api.pool import ProxyPool
+
+from .conftest import seed_proxies
+
+HOUR = 3600
+START = 1_000 * HOUR
+
+
+@pytest.fixture
+def store(db, monkeypatch):
+    seed_proxies(2)
+    store = ProxyPool()
+    store.load()
+    monkeypatch.setattr(history, "pool", store)
+    return store
+
+
+def test_rollups_fold_each_closed_hour_once(store):
+    history.record([
+        (1, START + 10, 1, 100.0, None),
+        (1, START + 20, 0, None, "TimeoutError"),
+        (1, START + HOUR + 10, 1, 300.0, None),
+        (1, START + HOUR + 20, 0, None, "HTTP 503"),
+        (2, START + HOUR + 30, 1, 50.0, None),
+        # Still open when the rollups run
+        (1, START + 2 * HOUR + 10, 0, None, "ConnectionError")
+    ])
+    now = START + 2 * HOUR + history.HISTORY_ROLLUP_GRACE + 60
+    assert history.rollup(now)["buckets"] == 3
+    # Closed hours are not folded again
+    assert history.rollup(now + 60)["buckets"] == 0
+
+    stats = database.get_proxy_stats(1)
+    assert (stats["checks_1h"], stats["success_rate_1h"], stats["avg_latency_ms_1h"]) == (2, 0.5, 300.0)
+    assert (stats["checks_24h"], stats["success_rate_24h"], stats["avg_latency_ms_24h"]) == (4, 0.5, 200.0)
+    assert stats["last_error"] == "HTTP 503"
+    assert database.get_proxy_stats(2)["checks_24h"] == 1
+    # Only proxy 1 has enough checks to weigh on selection
+    assert store._entries[1].history_rate == 0.5 and store._entries[2].history_rate == 1.0
+
+    hourly = database.get_hourly_checks(START)
+    assert [(row["hour"], row["checks"]) for row in hourly] == [
+        (START, 2), (START + HOUR, 3), (START + 2 * HOUR, 1)
+    ]
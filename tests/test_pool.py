@@ -0,0 +1,162 @@
+import asyncio
+import gc
+import threading
+import time
+
+from proxy_api import pool as pool_module
+from proxy_api import utils
+from proxy_api.database import get_connection, get_proxy_by_id
+from proxy_api.pool import ProxyPool, SelectionStrategy
+from proxy_api.records import Proxy, ProxyFilter
+from proxy_api.redis_pool import RedisProxyPool
+
+from .conftest import seed_proxies
+
+
+def test_unlock_all_keeps_inactive_proxies(store):
+    seed_proxies(3)
+    store.load()
+    store.set_status([1], "inactive")
+    store.flush()
+    leased, _ = store.lease(1)
+    assert [proxy.id for proxy in leased] == [2]
+
+    assert store.unlock_all() == 1
+
+    assert store.get(1).status == "inactive"
+    assert store.get(2).status == "available"
+    if not isinstance(store, RedisProxyPool):
+        # The table follows the pool, except for Redis which keeps state to itself
+        store.flush()
+        assert get_proxy_by_id(1).status == "inactive"
+        assert get_proxy_by_id(2).status == "available"
+
+
+def test_round_robin_follows_id_order_past_ten(store):
+    seed_proxies(12)
+    store.load()
+    leased, _ = store.lease(12)
+    assert [proxy.id for proxy in leased] == list(range(1, 13))
+
+    store.release([12, 3, 10])
+    leased, _ = store.lease(3)
+    assert sorted(proxy.id for proxy in leased) == [3, 10, 12]
+
+
+def test_filtered_lease_only_takes_matching_proxies(store):
+    seed_proxies(4, "http", country="us")
+    seed_proxies(4, "socks5", port=1080, country="us", tags="residential")
+    seed_proxies(4, "socks5", port=1081, country="de", tags="residential")
+    store.load()
+
+    for strategy in SelectionStrategy:
+        match = ProxyFilter(protocol="socks5", country="us", tags=["residential"])
+        leased, lease = store.lease(10, strategy=strategy, match=match)
+        assert len(leased) == 4
+        assert all(p.protocol == "socks5" and p.country == "us" and p.port == 1080 for p in leased)
+        store.release(lease.proxy_ids)
+
+    assert store.lease(1, match=ProxyFilter(country="fr")) == ([], None)
+
+
+def test_expired_leases_return_to_the_pool(store):
+    seed_proxies(2)
+    store.load()
+    leased, lease = store.lease(2, ttl=0.05)
+    assert store.lease(1) == ([], None)
+    time.sleep(0.1)
+    store.expire_leases()
+    assert store.renew(lease.token, 10) is None
+    leased, _ = store.lease(2)
+    assert len(leased) == 2
+
+
+def test_lease_is_not_held_up_by_a_large_refresh(db):
+    store = ProxyPool()
+    seed_proxies(10)
+    store.load()
+    added = [Proxy(id, "http", None, None, f"10.1.{id >> 8 & 255}.{id & 255}", 8080) for id in range(100, 50100)]
+    refresh = threading.Thread(target=store.apply_changes, args=(added, [], []))
+    # A full collection over every object earlier tests left behind would
+    # stall a lease just the same; only the refresh's hold on the lock counts
+    gc.collect()
+    gc.disable()
+    try:
+        refresh.start()
+        slowest = 0.0
+        while refresh.is_alive():
+            started = time.perf_counter()
+            _, lease = store.lease(1)
+            slowest = max(slowest, time.perf_counter() - started)
+            store.release(lease.proxy_ids)
+        refresh.join()
+    finally:
+        gc.enable()
+    assert store.get(50099) is not None
+    assert slowest < 0.05
+
+
+def test_reaper_survives_a_failed_pass(monkeypatch):
+    store = ProxyPool()
+    passes = []
+
+    def expire_leases():
+        passes.append(time.monotonic())
+        if len(passes) == 1:
+            raise RuntimeError("database is locked")
+        return 0
+
+    monkeypatch.setattr(pool_module, "LEASE_REAP_INTERVAL", 0.01)
+    monkeypatch.setattr(store, "expire_leases", expire_leases)
+
+    async def run():
+        reaper = asyncio.create_task(store.run_reaper())
+        while len(passes) < 2 and not reaper.done():
+            await asyncio.sleep(0.01)
+        reaper.cancel()
+        return reaper
+
+    reaper = asyncio.run(run())
+    assert len(passes) >= 2 and reaper.cancelled()
+
+
+def test_weighted_random_favours_healthy_proxies(store):
+    seed_proxies(200)
+    get_connection().execute("UPDATE proxies SET success_rate = 0.01 WHERE id <= 100")
+    store.load()
+    picked = []
+    for _ in range(20):
+        leased, lease = store.lease(5, strategy=SelectionStrategy.weighted_random)
+        assert len({proxy.id for proxy in leased}) == 5
+        picked += [proxy.id for proxy in leased]
+        store.release(lease.proxy_ids)
+    assert sum(proxy_id > 100 for proxy_id in picked) >= 0.9 * len(picked)
+
+
+def test_refresh_keeps_leased_proxies_until_released(store, tmp_path, monkeypatch):
+    proxy_file = tmp_path / "proxies.txt"
+    proxy_file.write_text("http://10.0.0.1:8080\nhttp://10.0.0.2:8080\nhttp://10.0.0.3:8080\n")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("proxy_api.pool.pool", store)
+    utils.sync_proxy_file()
+    store.load()
+    leased, lease = store.lease(1)
+    assert [proxy.id for proxy in leased] == [1]
+
+    proxy_file.write_text("http://10.0.0.3:8080\n")
+    assert utils.sync_proxy_file(force=True)["removed"] == 2
+    assert store.get(2) is None and get_proxy_by_id(2) is None
+    # Still leased: renewing and unlocking keep working
+    assert store.renew(lease.token, 60).proxy_ids == {1}
+    assert store.get(1) is not None
+
+    # Listed again while leased, then removed for good
+    proxy_file.write_text("http://10.0.0.1:8080\nhttp://10.0.0.3:8080\n")
+    utils.sync_proxy_file(force=True)
+    store.release([1])
+    store.flush()
+    assert store.drop_retired() == 0
+    proxy_file.write_text("http://10.0.0.3:8080\n")
+    assert utils.sync_proxy_file(force=True)["removed"] == 1
+    assert store.get(1) is None and get_proxy_by_id(1) is None
+    assert store.get(3) is not None
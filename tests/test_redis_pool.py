@@ -0,0 +1,63 @@
+import pytest
+
+from proxy_api.pool import SelectionStrategy
+from proxy_api.records import ProxyFilter
+from proxy_api.redis_pool import RedisProxyPool, _hash_tagged
+
+from .conftest import seed_proxies
+
+key_slot = pytest.importorskip("redis.crc").key_slot
+
+
+def test_prefix_gets_a_hash_tag():
+    assert _hash_tagged("{proxy_api}:") == "{proxy_api}:"
+    assert _hash_tagged("pool:") == "{pool:}"
+
+
+def test_every_key_lands_in_one_cluster_slot(db, redis_client):
+    seed_proxies(20, tags="a,b", country="us")
+    store = RedisProxyPool(client=redis_client, prefix="pool:")
+    store.load()
+    leased, lease = store.lease(5, ttl=60, strategy=SelectionStrategy.weighted_random)
+    store.lease(2, match=ProxyFilter(country="us", tags=["b"]))
+    store.record_checks([(6, False, None), (7, True, 120.0)])
+    store.set_status([8], "inactive")
+
+    keys = redis_client.keys("*")
+    assert any(key.startswith("{pool:}lease:") for key in keys)
+    assert {key_slot(key.encode()) for key in keys} == {key_slot(b"{pool:}")}
+
+
+def test_scripts_declare_their_keys(db, redis_client, monkeypatch):
+    seed_proxies(3)
+    store = RedisProxyPool(client=redis_client)
+    calls = []
+    for name in ("_add", "_set_status", "_lease", "_renew", "_remove"):
+        script = getattr(store, name)
+        monkeypatch.setattr(
+            store, name, lambda keys, args, script=script: calls.append(keys) or script(keys=keys, args=args)
+        )
+    store.load()
+    _, lease = store.lease(1, ttl=60)
+    store.renew(lease.token, 60)
+    store.set_status([2, 3], "inactive")
+    store.apply_changes([], [3], [])
+
+    base = ["{proxy_api}:" + name for name in ("available", "latency", "locked", "inactive", "leases", "ids", "seq")]
+    add, lease_keys, renew, set_status, remove = calls
+    assert add == base + ["{proxy_api}:proxy:1", "{proxy_api}:proxy:2", "{proxy_api}:proxy:3"]
+    assert lease_keys == renew == base + [f"{{proxy_api}}:lease:{lease.token}"]
+    assert set_status == base + ["{proxy_api}:proxy:2", "{proxy_api}:proxy:3"]
+    assert remove == base + ["{proxy_api}:proxy:3"]
+
+
+def test_weighted_leases_are_not_a_fixed_sequence(db, redis_client):
+    seed_proxies(50)
+    store = RedisProxyPool(client=redis_client)
+    store.load()
+    picks = set()
+    for _ in range(5):
+        leased, lease = store.lease(3, strategy=SelectionStrategy.weighted_random)
+        picks.add(tuple(sorted(proxy.id for proxy in leased)))
+        store.release(lease.proxy_ids)
+    assert len(picks) > 1
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+
+from proxy_api import watcher as watcher_module
+from proxy_api.database import list_jobs
+from proxy_api.jobs import jobs
+from proxy_api.pool import ProxyPool
+from proxy_api.watcher import ProxyFileWatcher
+
+
+@pytest.fixture
+def store(db, tmp_path, monkeypatch):
+    store = ProxyPool()
+    monkeypatch.setattr("proxy_api.pool.pool", store)
+    monkeypatch.setattr(watcher_module, "pool", store)
+    monkeypatch.chdir(tmp_path)
+    return store
+
+
+def test_full_sync_waits_for_a_running_refresh_job(store, tmp_path):
+    proxy_file = tmp_path / "proxies.txt"
+    proxy_file.write_text("http://10.0.0.1:8080\nhttp://10.0.0.2:8080\n")
+    watcher = ProxyFileWatcher()
+
+    def slow_refresh():
+        time.sleep(0.2)
+        return {"skipped": True}
+
+    async def run():
+        assert watcher.poll() is None and watcher.needs_sync
+        assert (await watcher.sync())["inserted"] == 2
+        store.load()
+
+        proxy_file.write_text("http://10.0.0.2:8080\n")
+        # A refresh that started before the edit is still running
+        await jobs.submit("refresh", slow_refresh, params={"trigger": "api"})
+        watcher.poll()
+        return await watcher.sync()
+
+    summary = asyncio.run(run())
+    assert summary["removed"] == 1
+    assert store.get(1) is None and store.get(2) is not None
+    refreshes = list_jobs("refresh", 10)
+    assert [job["params"]["trigger"] for job in refreshes] == ["watch", "api", "watch"]
+    # The watcher's job only started once the earlier refresh had finished
+    assert refreshes[0]["started_at"] >= refreshes[1]["finished_at"]